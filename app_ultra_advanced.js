@@ -26,6 +26,11 @@ class ElsaUltraAI {
         this.settings = { voiceSpeed: 1, voicePitch: 1 };
         this.normalMode = false;
         this.searchEngine = 'google';
+        this.sessionId = sessionStorage.getItem('elsa4-session');
+        if (!this.sessionId) {
+            this.sessionId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+            sessionStorage.setItem('elsa4-session', this.sessionId);
+        }
         var saved = localStorage.getItem('elsa4-settings');
         if (saved) { try { Object.assign(this.settings, JSON.parse(saved)); } catch (e) {} }
         this.init();
@@ -89,7 +94,7 @@ class ElsaUltraAI {
 
     async api(endpoint, method, body) {
         method = method || 'GET';
-        var opts = { method: method, headers: { 'Content-Type': 'application/json' } };
+        var opts = { method: method, headers: { 'Content-Type': 'application/json', 'X-Session-Id': this.sessionId } };
         if (body) opts.body = JSON.stringify(body);
         try {
             var r = await fetch(this.apiUrl + endpoint, opts);
@@ -100,19 +105,41 @@ class ElsaUltraAI {
         }
     }
 
+    // Long-poll a 202 job from /api/jobs/<id> until it finishes; returns the handler's reply
+    async awaitJob(d) {
+        if (!d || !d.job_id) return d;
+        while (true) {
+            var j = await this.api('/api/jobs/' + d.job_id + '?wait=25');
+            if (!j.success) return j;
+            if (j.status === 'done') return j.result;
+            if (j.status !== 'queued' && j.status !== 'running') return { success: false, message: j.error || 'Job ' + j.status };
+        }
+    }
+
     startStatsPoll() {
         var self = this;
+        var render = function(i) {
+            var cpuEl = document.getElementById('cpuStat');
+            var memEl = document.getElementById('memStat');
+            if (cpuEl && i.cpu_usage !== undefined) cpuEl.textContent = i.cpu_usage + '%';
+            if (memEl && i.memory_percent !== undefined) memEl.textContent = i.memory_percent + '%';
+        };
+        // Server push: full snapshot first, then only the values that changed
+        if (window.EventSource && this.backendOnline) {
+            var live = {};
+            var onEvent = function(e) {
+                try { Object.assign(live, JSON.parse(e.data)); render(live); } catch (err) {}
+            };
+            this.statsStream = new EventSource(this.apiUrl + '/api/stream/metrics');
+            this.statsStream.addEventListener('snapshot', onEvent);
+            this.statsStream.addEventListener('delta', onEvent);
+            return;
+        }
         var poll = async function() {
             if (!self.backendOnline) return;
             try {
                 var d = await self.api('/api/system/info');
-                if (d.success && d.info) {
-                    var i = d.info;
-                    var cpuEl = document.getElementById('cpuStat');
-                    var memEl = document.getElementById('memStat');
-                    if (cpuEl) cpuEl.textContent = i.cpu_usage + '%';
-                    if (memEl) memEl.textContent = i.memory_percent + '%';
-                }
+                if (d.success && d.info) render(d.info);
             } catch (e) {}
         };
         poll();
@@ -289,15 +316,14 @@ class ElsaUltraAI {
     async speakElevenLabs(text, voiceId) {
         voiceId = voiceId || '21m00Tcm4TlvDq8ikWAM';
         if (!this.backendOnline) { this.speak(text); return; }
-        try {
-            var d = await this.api('/api/tts/elevenlabs', 'POST', { text: text, voice_id: voiceId });
-            if (d.success && d.audio) {
-                var audio = new Audio('data:audio/mpeg;base64,' + d.audio);
-                audio.play();
-                return;
-            }
-        } catch (e) {}
-        this.speak(text);
+        // Streamed: playback starts with the first sentence while the rest is synthesised
+        var self = this, started = false;
+        var fallback = function() { if (!started) { started = true; self.speak(text); } };
+        var audio = new Audio(this.apiUrl + '/api/tts/stream?voice_id=' + encodeURIComponent(voiceId) +
+                              '&text=' + encodeURIComponent(text));
+        audio.onplaying = function() { started = true; };
+        audio.onerror = fallback;
+        audio.play().catch(fallback);
     }
 
     // ══════════════════════════════════════════════
@@ -915,12 +941,12 @@ class ElsaUltraAI {
         try {
             var d = await this.api('/api/screenshot', 'POST');
             if (d.success) {
-                if (d.image) {
+                if (d.url) {
                     var modal = document.getElementById('screenshotModal');
                     var img = document.getElementById('screenshotImg');
                     var dl = document.getElementById('screenshotDownload');
-                    if (img) img.src = 'data:image/png;base64,' + d.image;
-                    if (dl) dl.href = 'data:image/png;base64,' + d.image;
+                    if (img) img.src = this.apiUrl + d.url;
+                    if (dl) { dl.href = this.apiUrl + d.url + '?download=' + encodeURIComponent(d.filename || 'screenshot.png'); dl.download = d.filename || 'screenshot.png'; }
                     if (modal) modal.classList.add('active');
                     this.addMsg('✅ ' + d.message, 'ai');
                     this.speak('Screenshot taken!');
@@ -1067,7 +1093,7 @@ class ElsaUltraAI {
         this.setStatus('Generating…', 'processing');
         var typing = this.showTyping();
         try {
-            var d = await this.api('/api/image/generate', 'POST', { prompt: prompt });
+            var d = await this.awaitJob(await this.api('/api/image/generate', 'POST', { prompt: prompt, async: true }));
             typing.remove();
             if (d.success && d.url) {
                 var wrap = document.createElement('div');
@@ -4,13 +4,16 @@ ELSA 4.0 - ULTRA ADVANCED AI BACKEND
 Fixed: trailing period in app names, screen recording, added advanced features
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os, subprocess, platform, webbrowser, time, threading, re
-import json, urllib.parse, base64, logging, traceback, requests as req
+import json, urllib.parse, logging, traceback, requests as req
+import hashlib, sqlite3, queue, shlex, shutil, tempfile, secrets, heapq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO
+from collections import OrderedDict, deque, defaultdict
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
@@ -25,6 +28,7 @@ OPENAI_API_KEY    = os.getenv("OPENAI_API_KEY", "")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 GOOGLE_API_KEY    = os.getenv("GOOGLE_API_KEY", "")
 ELEVEN_API_KEY    = os.getenv("ELEVEN_API_KEY", "")
+ELEVEN_BASE_URL   = os.getenv("ELEVEN_BASE_URL", "https://api.elevenlabs.io").rstrip("/")   # point at stub_tts_server.py offline
 FAL_KEY           = os.getenv("FAL_KEY", "")
 
 def mask(k): return k[:12]+"..." if k and len(k)>12 else ("(not set)" if not k else k)
@@ -70,7 +74,7 @@ if FAL_KEY and len(FAL_KEY)>10:
 
 # === OPTIONAL FEATURES ===
 PSUTIL_AVAILABLE=False; PIL_AVAILABLE=False; PYAUTOGUI_AVAILABLE=False
-PYTTSX3_AVAILABLE=False; TTS_ENGINE=None; OPENCV_AVAILABLE=False
+PYTTSX3_AVAILABLE=False; OPENCV_AVAILABLE=False; MSS_AVAILABLE=False
 
 try:
     import psutil; PSUTIL_AVAILABLE=True; logger.info("✅ psutil")
@@ -85,239 +89,2256 @@ try:
 except: pass
 
 try:
-    import pyttsx3; TTS_ENGINE=pyttsx3.init(); TTS_ENGINE.setProperty('rate',160); PYTTSX3_AVAILABLE=True; logger.info("✅ pyttsx3")
+    import pyttsx3; PYTTSX3_AVAILABLE=True   # the engine itself is created on the LocalTTS worker thread
 except: pass
 
 try:
     import cv2; import numpy as np; OPENCV_AVAILABLE=True; logger.info("✅ OpenCV (screen recording)")
 except: pass
 
+try:
+    import mss; MSS_AVAILABLE=True; logger.info("✅ mss (fast screen capture)")
+except: pass
+
+# ============================================================
+# HTTP CLIENT — one pooled keep-alive Session for every outbound REST call
+# ============================================================
+HTTP_POOL            = int(os.getenv("ELSA_HTTP_POOL", "16"))          # connections kept per host
+HTTP_RETRIES         = int(os.getenv("ELSA_HTTP_RETRIES", "2"))
+HTTP_BACKOFF         = float(os.getenv("ELSA_HTTP_BACKOFF", "0.25"))   # 0.25s, 0.5s, … plus jitter
+HTTP_BACKOFF_MAX     = float(os.getenv("ELSA_HTTP_BACKOFF_MAX", "2"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("ELSA_HTTP_CONNECT_TIMEOUT", "3.05"))
+
+def http_timeout(read):
+    """(connect, read) — a dead host fails fast, a slow synthesis still gets `read` seconds."""
+    return (HTTP_CONNECT_TIMEOUT, read)
+
+def make_http_session():
+    """
+    Retries 429/5xx and connection failures with jittered exponential backoff, POST included:
+    TTS/voices calls are safe to repeat. Read timeouts are not retried (the upstream may be
+    mid-synthesis), and Retry-After is ignored in favour of the capped backoff — a spoken
+    reply can't wait out a minute-long hint. Cookies are refused so the shared jar is never
+    written from several threads.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    from http.cookiejar import DefaultCookiePolicy
+    opts=dict(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+              status_forcelist=(429,500,502,503,504), allowed_methods=frozenset({"GET","HEAD","POST"}),
+              respect_retry_after_header=False, raise_on_status=False)
+    try: retry=Retry(**opts, backoff_jitter=HTTP_BACKOFF, backoff_max=HTTP_BACKOFF_MAX)   # urllib3 >= 2
+    except TypeError: retry=Retry(**opts)
+    s=req.Session(); s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter=HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL, max_retries=retry)
+    s.mount("https://", adapter); s.mount("http://", adapter)
+    return s
+
+HTTP = make_http_session()
+
+# ============================================================
+# APP / SITE / KEY / FOLDER ALIASES — built once, shared by the handlers and the intent router
+# ============================================================
+WIN_BUILTIN_APPS = {
+    'notepad': 'notepad', 'calculator': 'calc', 'calc': 'calc',
+    'paint': 'mspaint', 'ms paint': 'mspaint', 'wordpad': 'wordpad',
+    'task manager': 'taskmgr', 'taskmgr': 'taskmgr',
+    'control panel': 'control', 'command prompt': 'cmd', 'cmd': 'cmd',
+    'powershell': 'powershell', 'file explorer': 'explorer',
+    'explorer': 'explorer', 'snipping tool': 'SnippingTool',
+    'registry editor': 'regedit', 'regedit': 'regedit',
+    'device manager': 'devmgmt.msc', 'disk management': 'diskmgmt.msc',
+    'character map': 'charmap', 'on screen keyboard': 'osk',
+    'magnifier': 'magnify', 'sticky notes': 'StikyNot',
+    'remote desktop': 'mstsc', 'resource monitor': 'resmon',
+    'event viewer': 'eventvwr', 'services': 'services.msc',
+}
+WIN_SETTINGS_URIS = {
+    'settings': 'ms-settings:', 'windows settings': 'ms-settings:',
+    'wifi settings': 'ms-settings:network-wifi',
+    'bluetooth settings': 'ms-settings:bluetooth',
+    'display settings': 'ms-settings:display',
+    'sound settings': 'ms-settings:sound',
+}
+WIN_INSTALLED_APPS = {
+    'chrome': 'chrome', 'google chrome': 'chrome',
+    'edge': 'msedge', 'microsoft edge': 'msedge',
+    'firefox': 'firefox', 'brave': 'brave', 'opera': 'opera',
+    'word': 'winword', 'microsoft word': 'winword',
+    'excel': 'excel', 'microsoft excel': 'excel',
+    'powerpoint': 'powerpnt', 'microsoft powerpoint': 'powerpnt',
+    'outlook': 'outlook', 'onenote': 'onenote',
+    'teams': 'teams', 'microsoft teams': 'teams',
+    'notepad++': 'notepad++', 'vscode': 'code', 'vs code': 'code',
+    'visual studio code': 'code', 'visual studio': 'devenv',
+    'pycharm': 'pycharm64', 'android studio': 'studio64',
+    'sublime': 'sublime_text', 'sublime text': 'sublime_text',
+    'atom': 'atom', 'cursor': 'cursor', 'cursor ai': 'cursor',
+    'postman': 'postman', 'git bash': 'git-bash',
+    'windows terminal': 'wt', 'terminal': 'wt',
+    'discord': 'discord', 'slack': 'slack', 'zoom': 'zoom',
+    'skype': 'skype', 'whatsapp': 'whatsapp', 'telegram': 'telegram',
+    'signal': 'signal', 'spotify': 'spotify', 'vlc': 'vlc',
+    'vlc media player': 'vlc', 'obs': 'obs64', 'obs studio': 'obs64',
+    'audacity': 'audacity', 'itunes': 'itunes',
+    'media player': 'wmplayer', 'windows media player': 'wmplayer',
+    'photoshop': 'photoshop', 'illustrator': 'illustrator',
+    'premiere': 'premiere', 'premiere pro': 'premiere',
+    'after effects': 'afterfx', 'lightroom': 'lightroom',
+    'acrobat': 'acrobat', 'adobe acrobat': 'acrobat',
+    'gimp': 'gimp-2.10', 'inkscape': 'inkscape', 'blender': 'blender',
+    'steam': 'steam', 'epic games': 'epicgameslauncher',
+    'epic': 'epicgameslauncher', 'origin': 'origin',
+    '7zip': '7zfm', 'winrar': 'winrar', 'virtualbox': 'virtualbox',
+    'anydesk': 'anydesk', 'teamviewer': 'teamviewer',
+    'ccleaner': 'ccleaner', 'putty': 'putty', 'filezilla': 'filezilla',
+}
+MAC_APPS = {
+    'chrome': 'Google Chrome', 'safari': 'Safari', 'firefox': 'Firefox',
+    'vscode': 'Visual Studio Code', 'vs code': 'Visual Studio Code',
+    'terminal': 'Terminal', 'finder': 'Finder', 'spotify': 'Spotify',
+    'discord': 'Discord', 'slack': 'Slack', 'zoom': 'zoom.us',
+    'notes': 'Notes', 'music': 'Music', 'photos': 'Photos',
+    'mail': 'Mail', 'calendar': 'Calendar',
+}
+LINUX_APPS = {
+    'chrome': 'google-chrome', 'firefox': 'firefox',
+    'terminal': 'gnome-terminal', 'vscode': 'code', 'vs code': 'code',
+    'vlc': 'vlc', 'gimp': 'gimp', 'calculator': 'gnome-calculator',
+}
+SITE_ALIASES = {'google':'https://www.google.com','youtube':'https://www.youtube.com',
+    'facebook':'https://www.facebook.com','twitter':'https://www.twitter.com',
+    'x':'https://www.x.com','instagram':'https://www.instagram.com',
+    'reddit':'https://www.reddit.com','linkedin':'https://www.linkedin.com',
+    'github':'https://www.github.com','stackoverflow':'https://stackoverflow.com',
+    'amazon':'https://www.amazon.com','flipkart':'https://www.flipkart.com',
+    'netflix':'https://www.netflix.com','hotstar':'https://www.hotstar.com',
+    'wikipedia':'https://www.wikipedia.org','gmail':'https://mail.google.com',
+    'outlook':'https://outlook.com','chatgpt':'https://chat.openai.com',
+    'claude':'https://claude.ai','gemini':'https://gemini.google.com',
+    'bing':'https://www.bing.com','maps':'https://maps.google.com',
+    'translate':'https://translate.google.com','drive':'https://drive.google.com',
+    'docs':'https://docs.google.com','sheets':'https://sheets.google.com',
+    'meet':'https://meet.google.com','whatsapp':'https://web.whatsapp.com',
+    'telegram':'https://web.telegram.org','discord':'https://discord.com/app',
+    'spotify':'https://open.spotify.com','twitch':'https://www.twitch.tv',
+    'tiktok':'https://www.tiktok.com','notion':'https://www.notion.so',
+    'canva':'https://www.canva.com','figma':'https://www.figma.com',
+    'codepen':'https://codepen.io','replit':'https://replit.com'}
+KEY_ALIASES = {
+    'enter':'enter','return':'enter','escape':'esc','esc':'esc',
+    'space':'space','tab':'tab','backspace':'backspace',
+    'up':'up','down':'down','left':'left','right':'right',
+    'volume up':'volumeup','volume down':'volumedown','mute':'volumemute',
+    'play':'playpause','play pause':'playpause','pause':'playpause',
+    'next track':'nexttrack','previous track':'prevtrack','prev track':'prevtrack',
+    'print screen':'printscreen','home':'home','end':'end',
+    'page up':'pageup','page down':'pagedown','delete':'delete',
+    'f1':'f1','f2':'f2','f3':'f3','f4':'f4','f5':'f5',
+    'f6':'f6','f7':'f7','f8':'f8','f9':'f9','f10':'f10','f11':'f11','f12':'f12',
+}
+FOLDER_PATHS = {
+    'desktop': os.path.join(os.path.expanduser("~"), "Desktop"),
+    'documents': os.path.join(os.path.expanduser("~"), "Documents"),
+    'downloads': os.path.join(os.path.expanduser("~"), "Downloads"),
+    'pictures': os.path.join(os.path.expanduser("~"), "Pictures"),
+    'music': os.path.join(os.path.expanduser("~"), "Music"),
+    'videos': os.path.join(os.path.expanduser("~"), "Videos"),
+    'home': os.path.expanduser("~"),
+}
+
+# ============================================================
+# APP LAUNCH INDEX — aliases + discovered apps, fuzzy matched, misses cached
+# ============================================================
+APP_INDEX_REFRESH = float(os.getenv("ELSA_APP_INDEX_REFRESH", "600"))
+APP_NEGATIVE_TTL  = float(os.getenv("ELSA_APP_NEGATIVE_TTL", "300"))
+APP_FUZZY_MIN     = float(os.getenv("ELSA_APP_FUZZY_MIN", "0.6"))
+
+def _trigrams(s):
+    s=f"  {s} "; return {s[i:i+3] for i in range(len(s)-2)}
+
+class AppIndex:
+    """
+    name → (kind, target) launch table. The per-OS alias dicts are loaded once at startup;
+    apps discovered on disk (PATH executables, Windows App Paths + Start Menu, Linux
+    .desktop files, macOS /Applications) are merged in by a background refresh.
+    Lookup is exact first, then fuzzy via a trigram index scored with the Dice coefficient.
+    PATH executables live in their own map and are only consulted by explicit API launches
+    (`resolve(n, cli=True)`), and then only by exact name — chat never reaches `shutdown` or `rm`.
+    Names that failed to launch are remembered for APP_NEGATIVE_TTL seconds.
+    """
+    def __init__(self):
+        if CURRENT_OS=="Windows":
+            self._static={**{k:("start",v) for k,v in WIN_INSTALLED_APPS.items()},
+                          **{k:("cmd",v) for k,v in WIN_BUILTIN_APPS.items()},
+                          **{k:("uri",v) for k,v in WIN_SETTINGS_URIS.items()}}
+        elif CURRENT_OS=="Darwin": self._static={k:("mac",v) for k,v in MAC_APPS.items()}
+        else: self._static={k:("exec",v) for k,v in LINUX_APPS.items()}
+        self._lock=threading.Lock(); self._negative={}; self.built_at=None; self.discovered=0
+        self._install({}, {})
+
+    def _install(self, gui, cli):
+        entries={**gui, **self._static}
+        grams={}
+        for name in entries:
+            for g in _trigrams(name): grams.setdefault(g, set()).add(name)
+        with self._lock:
+            self._entries, self._cli, self._grams = entries, cli, grams
+            self._negative.clear()
+
+    def refresh(self):
+        try:
+            gui, cli = self._discover()
+            self._install(gui, cli)
+            self.built_at=datetime.now().isoformat(); self.discovered=len(gui)+len(cli)
+        except Exception as e: logger.warning(f"App index refresh failed: {e}")
+
+    def start(self):
+        def _loop():
+            while True:
+                self.refresh(); time.sleep(APP_INDEX_REFRESH)
+        threading.Thread(target=_loop, daemon=True, name="app-index").start()
+
+    def _discover(self):
+        """Returns (gui_apps, path_executables) as name → (kind, target) dicts."""
+        gui, cli = {}, {}
+        exts=('.exe',) if CURRENT_OS=="Windows" else None
+        for d in os.environ.get("PATH","").split(os.pathsep):
+            try:
+                for e in os.scandir(d):
+                    stem,ext=os.path.splitext(e.name)
+                    if exts and ext.lower() not in exts: continue
+                    if not exts and not (e.is_file() and os.access(e.path, os.X_OK)): continue
+                    cli.setdefault((stem if exts else e.name).lower(), ("path", e.path))
+            except OSError: pass
+
+        if CURRENT_OS=="Windows":
+            try:
+                import winreg
+                for hive in (winreg.HKEY_LOCAL_MACHINE, winreg.HKEY_CURRENT_USER):
+                    try: root=winreg.OpenKey(hive, r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths")
+                    except OSError: continue
+                    for i in range(winreg.QueryInfoKey(root)[0]):
+                        sub=winreg.EnumKey(root, i)
+                        try: path=winreg.QueryValue(root, sub)
+                        except OSError: continue
+                        if path: gui.setdefault(os.path.splitext(sub)[0].lower(), ("path", path.strip('"')))
+            except ImportError: pass
+            for base in (os.getenv("PROGRAMDATA",""), os.getenv("APPDATA","")):
+                start_menu=os.path.join(base, "Microsoft", "Windows", "Start Menu", "Programs")
+                for root,_,files in os.walk(start_menu):
+                    for f in files:
+                        if f.lower().endswith(".lnk") and "uninstall" not in f.lower():
+                            gui.setdefault(f[:-4].lower(), ("file", os.path.join(root, f)))
+
+        elif CURRENT_OS=="Darwin":
+            for base in ("/Applications", "/Applications/Utilities", "/System/Applications",
+                         "/System/Applications/Utilities", os.path.expanduser("~/Applications")):
+                try:
+                    for e in os.scandir(base):
+                        if e.name.endswith(".app"): gui.setdefault(e.name[:-4].lower(), ("mac", e.name[:-4]))
+                except OSError: pass
+
+        else:
+            for base in ("/usr/share/applications", "/usr/local/share/applications",
+                         os.path.expanduser("~/.local/share/applications"),
+                         "/var/lib/flatpak/exports/share/applications", "/var/lib/snapd/desktop/applications"):
+                try: files=[e for e in os.scandir(base) if e.name.endswith(".desktop")]
+                except OSError: continue
+                for e in files:
+                    entry=self._parse_desktop(e.path)
+                    if not entry: continue
+                    name,cmd=entry
+                    gui.setdefault(name.lower(), ("exec", cmd))
+                    gui.setdefault(e.name[:-8].lower(), ("exec", cmd))
+        return gui, cli
+
+    @staticmethod
+    def _parse_desktop(path):
+        name=cmd=None
+        try:
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                in_entry=False
+                for line in f:
+                    line=line.strip()
+                    if line.startswith("["): in_entry=line=="[Desktop Entry]"; continue
+                    if not in_entry: continue
+                    if line.startswith("Name=") and name is None: name=line[5:]
+                    elif line.startswith("Exec=") and cmd is None: cmd=line[5:]
+                    elif line in ("NoDisplay=true", "Hidden=true") or (line.startswith("Type=") and line!="Type=Application"):
+                        return None
+        except OSError: return None
+        if not name or not cmd: return None
+        return name, re.sub(r"\s*%[a-zA-Z]", "", cmd).strip()
+
+    def resolve(self, n, cli=False):
+        """Best (name, kind, target, score) for `n`, or None. `cli` also allows an exact PATH executable."""
+        with self._lock: entries, clis, grams = self._entries, self._cli, self._grams
+        if n in entries: return (n, *entries[n], 1.0)
+        if cli and n in clis: return (n, *clis[n], 1.0)
+        # A known alias spoken inside a longer phrase ("google chrome browser")
+        words=n.split(); best=None
+        for i in range(len(words)):
+            for j in range(len(words), i, -1):
+                phrase=" ".join(words[i:j])
+                if phrase in entries and len(phrase)>=3 and (best is None or len(phrase)>len(best)): best=phrase
+        if best: return (best, *entries[best], 0.9)
+        # Trigram candidates, ranked by Dice similarity
+        q=_trigrams(n); counts={}
+        for g in q:
+            for name in grams.get(g, ()): counts[name]=counts.get(name, 0)+1
+        if not counts: return None
+        name,shared=max(counts.items(), key=lambda kv: (2*kv[1]/(len(q)+len(_trigrams(kv[0]))), -len(kv[0])))
+        score=2*shared/(len(q)+len(_trigrams(name)))
+        return (name, *entries[name], score) if score>=APP_FUZZY_MIN else None
+
+    def known_miss(self, n):
+        with self._lock:
+            exp=self._negative.get(n)
+            if exp and exp>time.monotonic(): return True
+            self._negative.pop(n, None); return False
+
+    def remember_miss(self, n):
+        with self._lock: self._negative[n]=time.monotonic()+APP_NEGATIVE_TTL
+
+    def stats(self):
+        with self._lock:
+            return {"entries":len(self._entries),"cli":len(self._cli),"discovered":self.discovered,
+                    "negative":len(self._negative),"built_at":self.built_at}
+
+def launch_app(kind, target):
+    """Start an AppIndex entry. Only the macOS `open -a` path can report failure synchronously."""
+    if kind=="uri": subprocess.Popen(f'start {target}', shell=True)
+    elif kind=="cmd": subprocess.Popen(target, shell=True)
+    elif kind=="start": subprocess.Popen(f'start "" {target}', shell=True)
+    elif kind=="file": os.startfile(target)
+    elif kind=="mac": return subprocess.run(['open', '-a', target], capture_output=True, text=True).returncode==0
+    elif kind=="path": subprocess.Popen([target], start_new_session=CURRENT_OS!="Windows")
+    else: subprocess.Popen(shlex.split(target), start_new_session=True)
+    return True
+
+APP_INDEX = AppIndex()
+APP_INDEX.start()
+
+# ============================================================
+# SYSTEM METRICS SAMPLER — one background thread, endpoints read snapshots
+# ============================================================
+METRICS_INTERVAL = float(os.getenv("ELSA_METRICS_INTERVAL", "2"))
+METRICS_HISTORY  = int(os.getenv("ELSA_METRICS_HISTORY", "300"))
+
+class MetricsSampler:
+    """
+    Samples CPU (total + per core), memory, disk, network I/O and battery every
+    `interval` seconds into a fixed-size ring buffer. cpu_percent() is measured
+    against the previous sample, so no reader ever blocks on it.
+    """
+    def __init__(self, interval, history):
+        self.interval=interval; self.ring=deque(maxlen=history)
+        self._ready=threading.Event(); self._thread=None; self._last_net=None
+
+    def start(self):
+        if not PSUTIL_AVAILABLE or self._thread: return
+        self._thread=threading.Thread(target=self._loop, daemon=True, name="metrics")
+        self._thread.start()
+
+    def _loop(self):
+        psutil.cpu_percent(percpu=True)  # prime the counters; the first real reading is one interval later
+        time.sleep(min(self.interval, 0.5))
+        while True:
+            try: self.ring.append(self._sample()); self._ready.set()
+            except Exception as e: logger.warning(f"Metrics sample failed: {e}")
+            time.sleep(self.interval)
+
+    def _sample(self):
+        now=time.time(); per_core=psutil.cpu_percent(percpu=True)
+        m=psutil.virtual_memory()
+        s={"ts":round(now,3),"cpu_usage":round(sum(per_core)/len(per_core),1) if per_core else 0.0,"cpu_per_core":per_core,
+           "memory_total":round(m.total/(1024**3),2),"memory_used":round(m.used/(1024**3),2),"memory_percent":m.percent}
+        try:
+            d=psutil.disk_usage('/')
+            s.update({"disk_total":round(d.total/(1024**3),2),"disk_used":round(d.used/(1024**3),2),"disk_percent":d.percent})
+        except Exception: pass
+        try:
+            n=psutil.net_io_counters()
+            s.update({"net_bytes_sent":n.bytes_sent,"net_bytes_recv":n.bytes_recv})
+            if self._last_net:
+                dt=max(now-self._last_net[0], 1e-6)
+                s.update({"net_sent_rate":round((n.bytes_sent-self._last_net[1])/dt),
+                          "net_recv_rate":round((n.bytes_recv-self._last_net[2])/dt)})
+            self._last_net=(now, n.bytes_sent, n.bytes_recv)
+        except Exception: pass
+        try:
+            b=psutil.sensors_battery()
+            s["battery"]=None if b is None else {"percent":round(b.percent,1),"plugged":b.power_plugged,"secsleft":b.secsleft}
+        except Exception: pass
+        return s
+
+    def latest(self, wait=1.0):
+        """Most recent snapshot (waits up to `wait` s for the very first one), or None."""
+        if not self._ready.is_set(): self._ready.wait(wait if self._thread else 0)
+        return self.ring[-1] if self.ring else None
+
+    def window(self, seconds):
+        """Snapshots from the last `seconds`, oldest first."""
+        cutoff=time.time()-seconds; out=[]
+        for s in reversed(self.ring):
+            if s["ts"]<cutoff: break
+            out.append(s)
+        return out[::-1]
+
+STATIC_SYS_INFO = {"os":CURRENT_OS,"os_version":platform.version(),"machine":platform.machine(),
+                   "processor":platform.processor(),"hostname":platform.node(),"python":platform.python_version(),
+                   "cpu_cores":psutil.cpu_count() if PSUTIL_AVAILABLE else None}
+
+METRICS = MetricsSampler(METRICS_INTERVAL, METRICS_HISTORY)
+METRICS.start()
+
 # Screen recording global state
-RECORDING_STATE = {"active": False, "process": None, "file": None, "start_time": None, "thread": None, "stop_event": None}
+RECORDING_STATE = {"active": False, "process": None, "file": None, "start_time": None, "recorder": None, "replay": None}
+
+# ============================================================
+# MEDIA STORE — binary payloads served by reference from /api/media/<key>
+# ============================================================
+MEDIA_MAX_MB    = float(os.getenv("ELSA_MEDIA_MAX_MB", "256"))        # memory + spilled files together
+MEDIA_MAX_ITEMS = int(os.getenv("ELSA_MEDIA_MAX_ITEMS", "256"))
+MEDIA_MEM_ITEM  = int(os.getenv("ELSA_MEDIA_MEM_ITEM_KB", "256"))*1024 # bigger blobs live on disk, not in RAM
+MEDIA_DIR       = os.getenv("ELSA_MEDIA_DIR", os.path.join(tempfile.gettempdir(), "elsa_media"))
+MEDIA_MAX_AGE   = 365*24*3600                                        # keys never change meaning → immutable
+
+class MediaStore:
+    """
+    Bounded LRU of blobs keyed by content hash (the ETag too). Items up to MEDIA_MEM_ITEM
+    stay in memory; larger ones are spilled to MEDIA_DIR. put_pending() registers an
+    encode that is still running under a random key, so a response can hand out the URL
+    before the bytes exist; get() waits for it.
+    """
+    def __init__(self, max_bytes, max_items, mem_item, folder):
+        self.max_bytes=max_bytes; self.max_items=max_items; self.mem_item=mem_item; self.folder=folder
+        self.items=OrderedDict(); self.lock=threading.Lock(); self.bytes=0; self.hits=0; self.misses=0
+        os.makedirs(folder, exist_ok=True)
+        for fn in os.listdir(folder):   # spills from a previous run; only names this class writes
+            if re.fullmatch(r"[0-9a-f]{32}(?:\.\d+\.part)?", fn):
+                try: os.remove(os.path.join(folder, fn))
+                except OSError: pass
+
+    def put(self, data, mime, key=None):
+        etag=hashlib.sha256(data).hexdigest()[:32]; key=key or etag
+        with self.lock:
+            if self._ready(key): self.items.move_to_end(key); return key
+        entry={"mime":mime, "size":len(data), "etag":etag, "created":time.time()}
+        if len(data)>self.mem_item:
+            path=os.path.join(self.folder, key); part=f"{path}.{threading.get_ident()}.part"
+            with open(part, "wb") as f: f.write(data)
+            os.replace(part, path); entry["path"]=path
+        else: entry["data"]=data
+        with self.lock:
+            if not self._ready(key):   # a concurrent put of the same key may have won
+                self.items[key]=entry; self.bytes+=len(data)
+            self.items.move_to_end(key); self._evict()
+        return key
+
+    def _ready(self, key):
+        e=self.items.get(key); return bool(e) and "future" not in e
+
+    def put_pending(self, future, mime):
+        key=secrets.token_hex(16)
+        with self.lock: self.items[key]={"future":future, "mime":mime, "size":0}
+        def _done(f):
+            try: self.put(f.result(), mime, key)
+            except Exception as e:
+                logger.error(f"Media {key} failed: {e}")
+                with self.lock: self.items.pop(key, None)
+        future.add_done_callback(_done)
+        return key
+
+    def get(self, key, timeout=60):
+        with self.lock:
+            e=self.items.get(key)
+            if e: self.items.move_to_end(key); self.hits+=1
+            else: self.misses+=1
+        if e and "future" in e:
+            # The done-callback may not have run yet when result() returns, so store it here too (put is idempotent)
+            try: self.put(e["future"].result(timeout), e["mime"], key)
+            except Exception: return None
+            with self.lock: e=self.items.get(key)
+        return e
+
+    def _evict(self):
+        while self.items and (self.bytes>self.max_bytes or len(self.items)>self.max_items):
+            k=next((k for k,v in self.items.items() if "future" not in v), None)
+            if k is None: break
+            e=self.items.pop(k); self.bytes-=e["size"]
+            if e.get("path"):
+                try: os.remove(e["path"])
+                except OSError: pass   # still being sent (Windows); the folder is wiped on next start
+
+    def stats(self):
+        with self.lock:
+            mem=sum(e["size"] for e in self.items.values() if "data" in e)
+            return {"items":len(self.items), "bytes":self.bytes, "memory_bytes":mem, "disk_bytes":self.bytes-mem,
+                    "pending":sum(1 for e in self.items.values() if "future" in e),
+                    "max_bytes":self.max_bytes, "hits":self.hits, "misses":self.misses}
+
+MEDIA = MediaStore(int(MEDIA_MAX_MB*2**20), MEDIA_MAX_ITEMS, MEDIA_MEM_ITEM, MEDIA_DIR)
+
+def media_url(key): return f"/api/media/{key}"
+
+# ============================================================
+# STREAMING TTS — sentence chunks synthesised ahead, relayed as they arrive
+# ============================================================
+TTS_CHUNK_CHARS = int(os.getenv("ELSA_TTS_CHUNK_CHARS", "250"))   # longest chunk sent in one request
+TTS_MIN_CHARS   = int(os.getenv("ELSA_TTS_MIN_CHARS", "40"))      # shorter sentences ride along with the next
+TTS_LOOKAHEAD   = int(os.getenv("ELSA_TTS_LOOKAHEAD", "2"))       # chunks synthesising ahead of the one relayed
+TTS_MODEL       = os.getenv("ELSA_TTS_MODEL", "eleven_monolingual_v1")
+TTS_LATENCY     = int(os.getenv("ELSA_TTS_LATENCY", "2"))         # ElevenLabs optimize_streaming_latency 0-4
+TTS_VOICE       = "21m00Tcm4TlvDq8ikWAM"
+TTS_SETTINGS    = {"stability":0.5,"similarity_boost":0.75}
+TTS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("ELSA_TTS_WORKERS", "8")), thread_name_prefix="elsa-tts")
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["\')\]])\s+|\n+')
+
+def split_sentences(text, max_chars=TTS_CHUNK_CHARS, min_chars=TTS_MIN_CHARS):
+    """Sentence-sized chunks: short ones merged forward, long ones cut at a comma or space."""
+    chunks=[]; buf=""
+    for p in (p.strip() for p in SENTENCE_END.split(text or "")):
+        if not p: continue
+        p=f"{buf} {p}" if buf else p; buf=""
+        while len(p)>max_chars:
+            cut=max(p.rfind(", ", 0, max_chars), p.rfind("; ", 0, max_chars))
+            if cut<min_chars: cut=p.rfind(" ", 0, max_chars)
+            if cut<=0: cut=max_chars-1
+            chunks.append(p[:cut+1].strip()); p=p[cut+1:].strip()
+        if len(p)>=min_chars: chunks.append(p)
+        else: buf=p
+    if buf:
+        if chunks and len(chunks[-1])+len(buf)<max_chars: chunks[-1]+=" "+buf
+        else: chunks.append(buf)
+    return chunks
+
+TTS_CACHE_ENABLED = os.getenv("ELSA_TTS_CACHE", "1").lower() in ("1","true","yes")
+TTS_CACHE_DIR     = os.getenv("ELSA_TTS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".elsa", "tts_cache"))
+TTS_CACHE_MB      = float(os.getenv("ELSA_TTS_CACHE_MB", "100"))
+TTS_PREWARM       = os.getenv("ELSA_TTS_PREWARM", "0").lower() in ("1","true","yes")   # costs API characters once
+# The fixed things the assistant says; pre-warming synthesises them once so they play from disk
+TTS_PREWARM_PHRASES = (
+    "Taking screenshot", "Screenshot taken!", "Screen recording started", "Recording stopped.",
+    "Done.", "Opening calculator", "Opening camera", "Opening weather", "Generating image, please wait",
+    "Image generated!", "Good Morning! Have a great day!", "Good Night! Sweet dreams!",
+    "Backend is offline. Please start the backend server.", "Sorry, something went wrong.",
+)
+
+class TTSCache:
+    """
+    Disk-backed MP3 cache keyed on sha256(text, voice, model, settings); one file per entry.
+    LRU by file mtime (touched on every hit), so recency survives restarts; the total is
+    kept under `max_bytes`. `saved_chars` counts the API characters hits did not pay for.
+    """
+    def __init__(self, folder, max_bytes):
+        self.folder=folder; self.max_bytes=max_bytes; self._lock=threading.Lock()
+        self.hits=0; self.misses=0; self.evictions=0; self.saved_chars=0
+        os.makedirs(folder, exist_ok=True)
+        files=[(e.stat().st_mtime, e.name, e.stat().st_size) for e in os.scandir(folder) if e.name.endswith(".mp3")]
+        self._lru=OrderedDict((name[:-4], size) for _, name, size in sorted(files))
+        self.bytes=sum(self._lru.values())
+        with self._lock: self._shrink()
+
+    @staticmethod
+    def key(text, voice_id, model_id=TTS_MODEL, settings=TTS_SETTINGS):
+        norm=" ".join((text or "").split())
+        return hashlib.sha256(json.dumps([norm, voice_id, model_id, settings], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key): return os.path.join(self.folder, key+".mp3")
+
+    def __contains__(self, key): return key in self._lru
+
+    def get(self, key, chars=0):
+        with self._lock:
+            if key not in self._lru: self.misses+=1; return None
+            self._lru.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f: data=f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock: self.bytes-=self._lru.pop(key, 0); self.misses+=1
+            return None
+        with self._lock: self.hits+=1; self.saved_chars+=chars
+        return data
+
+    def put(self, key, data):
+        if not data or len(data)>self.max_bytes: return
+        part=f"{self._path(key)}.{threading.get_ident()}.part"
+        try:
+            with open(part, "wb") as f: f.write(data)
+            os.replace(part, self._path(key))
+        except OSError as e: logger.warning(f"TTS cache write failed: {e}"); return
+        with self._lock:
+            self.bytes+=len(data)-self._lru.pop(key, 0); self._lru[key]=len(data)
+            self._shrink()
+
+    def _shrink(self):
+        while self._lru and self.bytes>self.max_bytes:
+            key,size=self._lru.popitem(last=False); self.bytes-=size; self.evictions+=1
+            try: os.remove(self._path(key))
+            except OSError: pass
+
+    def stats(self):
+        total=self.hits+self.misses
+        return {"enabled":True,"entries":len(self._lru),"bytes":self.bytes,"max_bytes":self.max_bytes,
+                "hits":self.hits,"misses":self.misses,"hit_rate":round(self.hits/total,3) if total else 0.0,
+                "evictions":self.evictions,"saved_chars":self.saved_chars}
+
+TTS_CACHE = TTSCache(TTS_CACHE_DIR, int(TTS_CACHE_MB*2**20)) if TTS_CACHE_ENABLED else None
+
+def _tts_fetch(text, voice_id, out, cancel, prev_text=None, next_text=None):
+    """One chunk via the streaming endpoint (or the cache) → bytes into `out`, then None (or the exception)."""
+    key=TTS_CACHE.key(text, voice_id) if TTS_CACHE else None
+    hit=TTS_CACHE.get(key, len(text)) if key else None
+    if hit: out.put(hit); out.put(None); return
+    body={"text":text,"model_id":TTS_MODEL,"voice_settings":TTS_SETTINGS}
+    if prev_text: body["previous_text"]=prev_text
+    if next_text: body["next_text"]=next_text
+    try:
+        parts=[]
+        with HTTP.post(f"{ELEVEN_BASE_URL}/v1/text-to-speech/{voice_id}/stream", params={"optimize_streaming_latency":TTS_LATENCY},
+                       json=body, headers={"Accept":"audio/mpeg","xi-api-key":ELEVEN_API_KEY}, stream=True, timeout=http_timeout(30)) as r:
+            if r.status_code!=200: raise RuntimeError(f"ElevenLabs {r.status_code}: {r.text[:200]}")
+            for chunk in r.iter_content(4096):
+                if cancel.is_set(): return
+                if chunk: out.put(chunk); parts.append(chunk)
+        out.put(None)
+        if key: TTS_CACHE.put(key, b"".join(parts))   # only complete chunks are cached
+    except Exception as e: out.put(e)
+
+def prewarm_tts(phrases=TTS_PREWARM_PHRASES, voice_id=TTS_VOICE):
+    """Synthesise the fixed phrases that are not cached yet (background thread at startup)."""
+    done=0
+    for text in phrases:
+        if TTS_CACHE.key(text, voice_id) in TTS_CACHE: continue
+        audio,msg=elsa.elevenlabs_tts(text, voice_id)
+        if audio: done+=1
+        else: logger.warning(f"TTS pre-warm stopped: {msg}"); break
+    logger.info(f"🔊 TTS pre-warm: {done} phrase(s) synthesised, {TTS_CACHE.stats()['entries']} cached")
+
+def tts_stream(text, voice_id=TTS_VOICE):
+    """
+    Yield MP3 bytes for `text` as they arrive. While chunk N is relayed, chunks
+    N+1..N+TTS_LOOKAHEAD are already being synthesised; each request gets its
+    neighbours as previous_text/next_text so prosody carries across the seams.
+    The first chunk's failure is raised, later ones are logged and skipped.
+    Closing the generator (client gone) cancels whatever is in flight.
+    """
+    chunks=split_sentences(text); cancel=threading.Event(); pending=deque(); nxt=0; sent=False
+    def launch(i):
+        q=queue.Queue(); pending.append(q)
+        TTS_POOL.submit(_tts_fetch, chunks[i], voice_id, q, cancel,
+                        chunks[i-1] if i else None, chunks[i+1] if i+1<len(chunks) else None)
+    try:
+        while pending or nxt<len(chunks):
+            while nxt<len(chunks) and len(pending)<=TTS_LOOKAHEAD: launch(nxt); nxt+=1
+            q=pending.popleft()
+            while True:
+                try: item=q.get(timeout=35)
+                except queue.Empty: item=TimeoutError("TTS chunk timed out")
+                if item is None: break
+                if isinstance(item, Exception):
+                    if not sent: raise item
+                    logger.warning(f"TTS chunk skipped: {item}"); break
+                sent=True; yield item
+    finally: cancel.set()
+
+# ============================================================
+# VOICE CATALOGUE — cached in memory and on disk, revalidated in the background
+# ============================================================
+VOICES_TTL   = float(os.getenv("ELSA_VOICES_TTL", "3600"))     # seconds before a background refresh
+VOICES_RETRY = float(os.getenv("ELSA_VOICES_RETRY", "60"))     # back-off after a failed refresh
+VOICES_FILE  = os.getenv("ELSA_VOICES_FILE", os.path.join(os.path.expanduser("~"), ".elsa", "voices.json"))
+
+class VoiceCatalog:
+    """
+    Stale-while-revalidate: get() always answers from memory (loaded from VOICES_FILE at
+    start) and, once the list is older than the TTL, starts a single background refresh.
+    Only an empty catalogue waits for the upstream. Refreshes send the upstream ETag, so an
+    unchanged list costs a 304; failures keep the old list and are reported, not swallowed.
+    `etag` is a hash of the list, for If-None-Match from clients.
+    """
+    def __init__(self, path, ttl=VOICES_TTL):
+        self.path=path; self.ttl=ttl; self.lock=threading.Lock(); self.refreshing=None
+        self.voices=None; self.fetched=0; self.upstream_etag=None; self.etag=None
+        self.error=None; self.failed=0; self.refreshes=0; self.not_modified=0
+        try:
+            with open(path, encoding="utf-8") as f: d=json.load(f)
+            self._set(d["voices"], d.get("fetched",0), d.get("etag"))
+        except (OSError, ValueError, KeyError): pass
+
+    def _set(self, voices, fetched, upstream_etag):
+        self.voices=voices; self.fetched=fetched; self.upstream_etag=upstream_etag
+        self.etag='"'+hashlib.sha256(json.dumps(voices, sort_keys=True).encode("utf-8")).hexdigest()[:32]+'"'
+
+    def get(self, force=False):
+        """The cached list (None if there has never been one); kicks off a refresh when due."""
+        now=time.time()
+        due=force or now-self.fetched>self.ttl
+        if due and now-self.failed>VOICES_RETRY: self.refresh_async()
+        if self.voices is None and self.refreshing: self.refreshing.join(15)
+        return self.voices
+
+    def stale(self): return time.time()-self.fetched>self.ttl
+
+    def refresh_async(self):
+        with self.lock:
+            if self.refreshing and self.refreshing.is_alive(): return
+            self.refreshing=threading.Thread(target=self.refresh, daemon=True, name="voices-refresh")
+            self.refreshing.start()
+
+    def refresh(self):
+        if not ELEVEN_AVAILABLE: self.error="ElevenLabs not configured"; self.failed=time.time(); return
+        headers={"xi-api-key":ELEVEN_API_KEY}
+        if self.upstream_etag and self.voices is not None: headers["If-None-Match"]=self.upstream_etag
+        try:
+            r=HTTP.get(f"{ELEVEN_BASE_URL}/v1/voices", headers=headers, timeout=http_timeout(10))
+            if r.status_code==304: self.fetched=time.time(); self.not_modified+=1
+            elif r.status_code==200:
+                self._set(r.json().get("voices",[]), time.time(), r.headers.get("ETag")); self._save()
+            else: raise RuntimeError(f"ElevenLabs {r.status_code}: {r.text[:200]}")
+            self.error=None; self.refreshes+=1
+        except Exception as e:
+            self.error=str(e); self.failed=time.time(); logger.warning(f"Voice list refresh failed: {e}")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            part=f"{self.path}.{threading.get_ident()}.part"
+            with open(part, "w", encoding="utf-8") as f:
+                json.dump({"voices":self.voices,"fetched":self.fetched,"etag":self.upstream_etag}, f)
+            os.replace(part, self.path)
+        except OSError as e: logger.warning(f"Voice list save failed: {e}")
+
+    def stats(self):
+        return {"voices":len(self.voices) if self.voices is not None else None,"age":round(time.time()-self.fetched,1) if self.fetched else None,
+                "stale":self.stale(),"refreshes":self.refreshes,"not_modified":self.not_modified,"error":self.error}
+
+VOICES = VoiceCatalog(VOICES_FILE)
+
+# ============================================================
+# LOCAL TTS — one worker thread owns the pyttsx3 engine, fed by a bounded priority queue
+# ============================================================
+LOCAL_TTS_QUEUE    = int(os.getenv("ELSA_LOCAL_TTS_QUEUE", "16"))
+LOCAL_TTS_RATE     = int(os.getenv("ELSA_LOCAL_TTS_RATE", "160"))
+LOCAL_TTS_BARGE_IN = os.getenv("ELSA_LOCAL_TTS_BARGE_IN", "1").lower() in ("1","true","yes")
+TTS_URGENT, TTS_NORMAL, TTS_LOW = 0, 5, 9
+
+def tts_priority(value):
+    """Request value → priority 0-9 (TTS_NORMAL when absent); ValueError otherwise."""
+    if value in (None, ""): return TTS_NORMAL
+    try: p=int(value)
+    except (TypeError, ValueError): raise ValueError("priority must be an integer 0-9")
+    if not TTS_URGENT<=p<=TTS_LOW: raise ValueError("priority must be an integer 0-9")
+    return p
+
+class Utterance:
+    def __init__(self, text, priority, key=None, render=False):
+        self.text=text; self.priority=priority; self.key=key; self.render=render
+        self.done=threading.Event(); self.status="queued"; self.audio=None; self.error=None
+
+class LocalTTS:
+    """
+    pyttsx3 engines are not thread-safe (and SAPI is apartment-bound), so a single thread
+    creates the engine and performs every say()/save_to_file(). Callers enqueue Utterances:
+    lower priority number first, FIFO within a priority. Identical queued text is coalesced,
+    and a `key` keeps only the newest utterance of its kind ("battery is 40%" replaces
+    "battery is 41%"). When the queue is full the least urgent item loses. interrupt()
+    stops the current utterance at the next word and flushes queued ones of equal or lower
+    urgency — barge-in when the user issues a new command.
+    """
+    def __init__(self, max_queue=LOCAL_TTS_QUEUE, rate=LOCAL_TTS_RATE):
+        self.max_queue=max_queue; self.rate=rate
+        self._heap=[]; self._seq=0; self._cv=threading.Condition(); self._cancel=threading.Event()
+        self.current=None; self.available=False; self._ready=threading.Event()
+        self.counters={"spoken":0,"rendered":0,"coalesced":0,"dropped":0,"interrupted":0,"errors":0}
+        self.thread=threading.Thread(target=self._run, daemon=True, name="local-tts")
+
+    def start(self, timeout=5):
+        self.thread.start(); self._ready.wait(timeout)
+        return self.available
+
+    def say(self, text, priority=TTS_NORMAL, key=None, interrupt=False, render=False):
+        """Queue `text`; returns its Utterance (status "dropped" if it lost to a fuller queue)."""
+        u=Utterance(" ".join(str(text).split()), int(priority), key, render)
+        if interrupt: self.interrupt(u.priority)
+        with self._cv:
+            for i,(_, seq, q) in enumerate(self._heap):
+                if not q.render and not render and (q.text==u.text or (key and q.key==key)):
+                    if key and q.key==key: q.text=u.text        # newest wins, keeps its place in line
+                    if u.priority<q.priority:                   # …but an urgent repeat is not demoted
+                        q.priority=u.priority; self._heap[i]=(u.priority, seq, q); heapq.heapify(self._heap)
+                    self.counters["coalesced"]+=1; return q
+            if len(self._heap)>=self.max_queue:
+                worst=max(self._heap)
+                if worst[0]<=u.priority: return self._drop(u)
+                self._heap.remove(worst); heapq.heapify(self._heap); self._drop(worst[2])
+            self._seq+=1; heapq.heappush(self._heap, (u.priority, self._seq, u)); self._cv.notify()
+        return u
+
+    def interrupt(self, priority=TTS_URGENT):
+        """Stop the current utterance and flush queued ones with priority >= `priority`."""
+        with self._cv:
+            keep=[e for e in self._heap if e[0]<priority]
+            for e in self._heap:
+                if e[0]>=priority: self._drop(e[2], "interrupted")
+            self._heap=keep; heapq.heapify(self._heap)
+            cur=self.current
+        if cur and not cur.render and cur.priority>=priority:
+            self._cancel.set(); self.counters["interrupted"]+=1
+
+    def _drop(self, u, status="dropped"):
+        u.status=status; u.done.set()
+        if status=="dropped": self.counters["dropped"]+=1
+        return u
+
+    def _on_word(self, name, location, length):
+        if self._cancel.is_set(): self.engine.stop()
+
+    def _run(self):
+        try:
+            import pyttsx3
+            self.engine=pyttsx3.init(); self.engine.setProperty('rate', self.rate)
+            self.engine.connect('started-word', self._on_word)
+            self.available=True
+        except Exception as e:
+            logger.warning(f"Local TTS unavailable: {e}")
+        finally: self._ready.set()
+        if not self.available: return
+        while True:
+            with self._cv:
+                while not self._heap: self._cv.wait()
+                u=heapq.heappop(self._heap)[2]; self.current=u; self._cancel.clear()
+            u.status="speaking"
+            try:
+                if u.render: self._render(u)
+                else:
+                    self.engine.say(u.text); self.engine.runAndWait()
+                    u.status="interrupted" if self._cancel.is_set() else "spoken"
+                    if u.status=="spoken": self.counters["spoken"]+=1
+            except Exception as e:
+                u.status="error"; u.error=str(e); self.counters["errors"]+=1; logger.error(f"Local TTS error: {e}")
+            finally:
+                with self._cv: self.current=None
+                u.done.set()
+
+    def _render(self, u):
+        ext=".aiff" if CURRENT_OS=="Darwin" else ".wav"
+        fd,path=tempfile.mkstemp(suffix=ext, prefix="elsa_tts_"); os.close(fd)
+        try:
+            self.engine.save_to_file(u.text, path); self.engine.runAndWait()
+            with open(path, "rb") as f: u.audio=(f.read(), "audio/aiff" if ext==".aiff" else "audio/wav")
+            u.status="rendered"; self.counters["rendered"]+=1
+        finally:
+            try: os.remove(path)
+            except OSError: pass
+
+    def stats(self):
+        with self._cv:
+            return {**self.counters, "available":self.available, "queued":len(self._heap), "max_queue":self.max_queue,
+                    "speaking":self.current.text if self.current else None}
+
+LOCAL_TTS = LocalTTS()
+PYTTSX3_AVAILABLE = LOCAL_TTS.start() if PYTTSX3_AVAILABLE else False
+if PYTTSX3_AVAILABLE: logger.info("✅ pyttsx3 (local TTS worker)")
+
+# ============================================================
+# ASYNC JOBS — slow upstream calls run on a bounded pool, clients poll /api/jobs/<id>
+# ============================================================
+JOB_WORKERS   = int(os.getenv("ELSA_JOB_WORKERS", "8"))
+JOB_MAX       = int(os.getenv("ELSA_JOB_MAX", "64"))          # queued + running jobs before submit() refuses
+JOB_TTL       = float(os.getenv("ELSA_JOB_TTL", "600"))       # seconds a finished job's result is kept
+JOB_LIMITS    = {k.strip(): int(v) for k, v in (kv.split("=") for kv in
+                 os.getenv("ELSA_JOB_LIMITS", "image=2,chat=4,tts=4").split(",") if "=" in kv)}
+JOB_WAIT_MAX  = 60
+
+class JobsFull(Exception): pass
+
+class Job:
+    __slots__=("id","type","fn","status","result","error","created","started","finished","done")
+    def __init__(self, jtype, fn):
+        self.id=secrets.token_hex(8); self.type=jtype; self.fn=fn; self.status="queued"
+        self.result=None; self.error=None; self.created=time.time(); self.started=self.finished=None
+        self.done=threading.Event()
+
+    def to_dict(self):
+        d={"job_id":self.id,"type":self.type,"status":self.status,"created":self.created,
+           "started":self.started,"finished":self.finished}
+        if self.status=="done": d["result"]=self.result
+        if self.error: d["error"]=self.error
+        return d
+
+class JobQueue:
+    """
+    One shared pool; each job type has its own concurrency limit, and jobs over the limit
+    wait in a per-type FIFO instead of holding a pool thread (a burst of image renders can't
+    starve chat). Cancelling a queued job removes it; a running one can't be interrupted
+    upstream, so its result is discarded. Finished jobs expire after JOB_TTL.
+    """
+    def __init__(self, workers=JOB_WORKERS, limits=JOB_LIMITS, max_jobs=JOB_MAX, ttl=JOB_TTL):
+        self.workers=workers; self.pool=ThreadPoolExecutor(max_workers=workers, thread_name_prefix="elsa-job")
+        self.limits=limits; self.max_jobs=max_jobs; self.ttl=ttl
+        self.jobs={}; self.waiting=defaultdict(deque); self.running=defaultdict(int)
+        self.lock=threading.Lock(); self.counters={"submitted":0,"done":0,"error":0,"cancelled":0,"rejected":0,"expired":0}
+
+    def submit(self, jtype, fn):
+        """Queue fn() as a job of `jtype`; raises JobsFull when JOB_MAX jobs are already pending."""
+        with self.lock:
+            self._expire()
+            if sum(1 for j in self.jobs.values() if j.finished is None)>=self.max_jobs:
+                self.counters["rejected"]+=1; raise JobsFull(f"{self.max_jobs} jobs already pending")
+            job=Job(jtype, fn); self.jobs[job.id]=job; self.counters["submitted"]+=1
+            if self.running[jtype]<self.limits.get(jtype, self.workers): self._start(job)
+            else: self.waiting[jtype].append(job)
+        return job
+
+    def get(self, job_id, wait=0):
+        """The job, optionally blocking up to `wait` seconds for it to finish (long-poll)."""
+        with self.lock:
+            self._expire(); job=self.jobs.get(job_id)
+        if job and wait>0: job.done.wait(min(wait, JOB_WAIT_MAX))
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job=self.jobs.get(job_id)
+            if not job or job.finished is not None: return job
+            if job.status=="queued": self.waiting[job.type].remove(job)
+            self._finish(job, "cancelled")
+        return job
+
+    def _start(self, job):
+        self.running[job.type]+=1; job.status="running"; job.started=time.time()
+        self.pool.submit(self._run, job)
+
+    def _run(self, job):
+        try: result, err = job.fn(), None
+        except Exception as e:
+            result, err = None, str(e); logger.error(f"Job {job.type}/{job.id} failed: {e}")
+        with self.lock:
+            self.running[job.type]-=1
+            if job.finished is None:                     # not cancelled while running
+                job.result=result; job.error=err; self._finish(job, "error" if err else "done")
+            nxt=self.waiting[job.type]
+            if nxt: self._start(nxt.popleft())
+
+    def _finish(self, job, status):
+        job.status=status; job.finished=time.time(); job.fn=None
+        self.counters[status]+=1; job.done.set()
+
+    def _expire(self):
+        cutoff=time.time()-self.ttl
+        for jid in [jid for jid, j in self.jobs.items() if j.finished is not None and j.finished<cutoff]:
+            del self.jobs[jid]; self.counters["expired"]+=1
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "tracked":len(self.jobs), "limits":self.limits,
+                    "running":{t:n for t,n in self.running.items() if n},
+                    "waiting":{t:len(q) for t,q in self.waiting.items() if q}}
+
+JOBS = JobQueue()
+
+# ============================================================
+# IMAGE GENERATION — quality presets, batched variants, prompt-keyed disk cache
+# ============================================================
+IMG_MODEL       = os.getenv("ELSA_IMG_MODEL", "fal-ai/fast-sdxl")
+IMG_PRESET      = os.getenv("ELSA_IMG_PRESET", "standard")
+IMG_MAX_BATCH   = int(os.getenv("ELSA_IMG_MAX_BATCH", "4"))
+IMG_CACHE_ENABLED  = os.getenv("ELSA_IMG_CACHE", "1").lower() in ("1","true","yes")
+IMG_CACHE_DIR      = os.getenv("ELSA_IMG_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".elsa", "image_cache"))
+IMG_CACHE_MB       = float(os.getenv("ELSA_IMG_CACHE_MB", "200"))
+IMG_CACHE_ENTRIES  = int(os.getenv("ELSA_IMG_CACHE_ENTRIES", "500"))
+IMG_CACHE_DOWNLOAD = os.getenv("ELSA_IMG_CACHE_DOWNLOAD", "1").lower() in ("1","true","yes")  # keep bytes, not just fal URLs
+# preset → (image_size, num_inference_steps); "preview" is a quarter of the pixels at under half the steps
+IMG_PRESETS = {"preview": ("square", 12), "standard": ("landscape_4_3", 28), "high": ("landscape_4_3", 40)}
+IMG_SIZES   = ("square_hd", "square", "portrait_4_3", "portrait_16_9", "landscape_4_3", "landscape_16_9")
+IMG_EXT     = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+
+def image_args(prompt, preset=None, size=None, steps=None, seed=None, num_images=1):
+    """fal arguments for a request; ValueError on a bad preset/size/count."""
+    preset=preset or IMG_PRESET
+    if preset not in IMG_PRESETS: raise ValueError(f"preset must be one of {', '.join(IMG_PRESETS)}")
+    p_size,p_steps=IMG_PRESETS[preset]
+    if size and size not in IMG_SIZES:
+        wh=parse_size(size)
+        if not wh: raise ValueError(f"size must be WxH or one of {', '.join(IMG_SIZES)}")
+        size={"width":wh[0],"height":wh[1]}
+    n=int(num_images or 1)
+    if not 1<=n<=IMG_MAX_BATCH: raise ValueError(f"num_images must be 1-{IMG_MAX_BATCH}")
+    args={"prompt":" ".join(prompt.split()),"image_size":size or p_size,"num_inference_steps":int(steps or p_steps),"num_images":n}
+    if seed not in (None, ""): args["seed"]=int(seed)
+    return args
+
+class ImageCache:
+    """
+    Generations keyed on sha256(model, prompt, size, steps, seed, count). Each entry is a
+    <key>.json (fal URLs, seed) plus, once downloaded in the background, <key>-<i>.<ext>
+    image files — fal URLs expire, the local copies don't. LRU by the .json mtime, bounded
+    by bytes and entries like TTSCache.
+    """
+    def __init__(self, folder, max_bytes, max_entries):
+        self.folder=folder; self.max_bytes=max_bytes; self.max_entries=max_entries; self._lock=threading.Lock()
+        self.hits=0; self.misses=0; self.evictions=0
+        os.makedirs(folder, exist_ok=True)
+        sizes=defaultdict(int); stamps={}
+        for e in os.scandir(folder):
+            m=re.fullmatch(r"([0-9a-f]{64})(?:\.json|-\d+\.\w+)", e.name)
+            if not m: continue
+            sizes[m.group(1)]+=e.stat().st_size
+            if e.name.endswith(".json"): stamps[m.group(1)]=e.stat().st_mtime
+        self._lru=OrderedDict((k, sizes[k]) for k in sorted(stamps, key=stamps.get))
+        for k in set(sizes)-set(stamps): self._remove(k)           # images whose .json never landed
+        self.bytes=sum(self._lru.values())
+        with self._lock: self._shrink()
+
+    @staticmethod
+    def key(args):
+        return hashlib.sha256(json.dumps([IMG_MODEL, args], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, name): return os.path.join(self.folder, name)
+
+    def get(self, key):
+        """The entry dict with `files` resolved to paths (None where not downloaded), or None."""
+        with self._lock:
+            if key not in self._lru: self.misses+=1; return None
+            self._lru.move_to_end(key)
+        try:
+            with open(self._path(key+".json"), encoding="utf-8") as f: entry=json.load(f)
+            os.utime(self._path(key+".json"))
+        except (OSError, ValueError):
+            with self._lock: self.bytes-=self._lru.pop(key, 0); self.misses+=1
+            return None
+        entry["files"]=[self._path(fn) if fn and os.path.exists(self._path(fn)) else None for fn in entry.get("files",[])]
+        with self._lock: self.hits+=1
+        return entry
+
+    def put(self, key, entry, blobs=()):
+        """Write entry (+ optional [(bytes, mime)] per image) atomically; the .json lands last."""
+        files=[]; size=0
+        try:
+            for i,(data,mime) in enumerate(blobs):
+                if not data: files.append(None); continue
+                fn=f"{key}-{i}{IMG_EXT.get(mime, '.png')}"; self._write(fn, data); files.append(fn); size+=len(data)
+            meta=json.dumps(dict(entry, files=files)).encode("utf-8"); self._write(key+".json", meta); size+=len(meta)
+        except OSError as e: logger.warning(f"Image cache write failed: {e}"); return
+        with self._lock:
+            self.bytes+=size-self._lru.pop(key, 0); self._lru[key]=size
+            self._shrink()
+
+    def _write(self, name, data):
+        part=f"{self._path(name)}.{threading.get_ident()}.part"
+        with open(part, "wb") as f: f.write(data)
+        os.replace(part, self._path(name))
+
+    def _remove(self, key):
+        for fn in os.listdir(self.folder):
+            if fn.startswith(key):
+                try: os.remove(self._path(fn))
+                except OSError: pass
+
+    def _shrink(self):
+        while self._lru and (self.bytes>self.max_bytes or len(self._lru)>self.max_entries):
+            key,size=self._lru.popitem(last=False); self.bytes-=size; self.evictions+=1; self._remove(key)
+
+    def stats(self):
+        total=self.hits+self.misses
+        return {"enabled":True,"entries":len(self._lru),"bytes":self.bytes,"max_bytes":self.max_bytes,
+                "hits":self.hits,"misses":self.misses,"hit_rate":round(self.hits/total,3) if total else 0.0,
+                "evictions":self.evictions}
+
+IMG_CACHE = ImageCache(IMG_CACHE_DIR, int(IMG_CACHE_MB*2**20), IMG_CACHE_ENTRIES) if IMG_CACHE_ENABLED else None
+
+def _download_images(key, entry):
+    """Background: fetch the fal URLs once so later hits are served from /api/media."""
+    blobs=[]
+    for url in entry["urls"]:
+        try:
+            r=HTTP.get(url, timeout=http_timeout(30)); r.raise_for_status()
+            blobs.append((r.content, r.headers.get("Content-Type","image/png").split(";")[0]))
+        except Exception as e:
+            logger.warning(f"Image download failed: {e}"); blobs.append((None, None))
+    IMG_CACHE.put(key, entry, blobs)
+
+def cached_image_urls(entry):
+    """Local /api/media URLs for downloaded images, the original fal URL for the rest."""
+    urls=[]
+    for url,path in zip(entry["urls"], entry["files"]):
+        if path:
+            try:
+                with open(path, "rb") as f: data=f.read()
+                mime=next((m for m,x in IMG_EXT.items() if path.endswith(x)), "image/png")
+                url=media_url(MEDIA.put(data, mime))
+            except OSError: pass
+        urls.append(url)
+    return urls
+
+# ============================================================
+# SCREEN RECORDER — capture thread → bounded queue → encoder thread
+# ============================================================
+REC_FPS   = float(os.getenv("ELSA_REC_FPS", "10"))
+REC_CODEC = os.getenv("ELSA_REC_CODEC", "XVID")
+REC_QUEUE = int(os.getenv("ELSA_REC_QUEUE", "32"))
+REC_BACKEND = os.getenv("ELSA_REC_BACKEND", "auto").lower()   # auto | mss | pillow | pyautogui
+REC_SEGMENT_SECS = float(os.getenv("ELSA_REC_SEGMENT_SECS", "0"))   # 0 = one file; >0 = folder of fixed-length segments
+REC_CONCAT = os.getenv("ELSA_REC_CONCAT", "0") == "1"               # join segments into one file after stop
+REC_DEDUP = os.getenv("ELSA_REC_DEDUP", "1") == "1"                 # skip converting frames identical to the last one
+REC_DEDUP_THRESHOLD = int(os.getenv("ELSA_REC_DEDUP_THRESHOLD", "8")) # max per-sample change (0-255) still "static"
+REC_IDLE_FPS = float(os.getenv("ELSA_REC_IDLE_FPS", "2"))           # capture rate while the screen is static
+REC_IDLE_AFTER = float(os.getenv("ELSA_REC_IDLE_AFTER", "1.0"))     # seconds without change before dropping to it
+CODEC_EXT = {"XVID": ".avi", "MJPG": ".avi", "DIVX": ".avi", "MP4V": ".mp4", "AVC1": ".mp4", "H264": ".mp4"}
+
+def parse_size(value):
+    """'1280x720', [1280, 720] or {"width":..,"height":..} → (w, h); None for anything else."""
+    try:
+        if isinstance(value, str): w,h=value.lower().split("x")
+        elif isinstance(value, dict): w,h=value["width"],value["height"]
+        else: w,h=value
+        w,h=int(w),int(h)
+        return (w,h) if w>0 and h>0 else None
+    except Exception: return None
+
+def parse_region(value):
+    """'x,y,w,h', [x,y,w,h] or {"left"/"x","top"/"y","width","height"} → mss-style box; None for anything else."""
+    try:
+        if isinstance(value, str): value=[v for v in re.split(r"[,\s]+", value.strip()) if v]
+        if isinstance(value, dict): value=[value.get("left", value.get("x", 0)), value.get("top", value.get("y", 0)), value["width"], value["height"]]
+        l,t,w,h=(int(float(v)) for v in value)
+        return {"left":l, "top":t, "width":w, "height":h} if w>0 and h>0 else None
+    except Exception: return None
+
+def capture_opts(d):
+    """
+    Pull region/monitor/scale/max_dim out of a JSON body, query args or command params.
+    Everything is validated here (region and monitor against the real screens too), so
+    callers can answer a bad request with a 400 before any capture starts.
+    """
+    num=lambda k, cast: (lambda v: cast(v) if v not in (None, "") else None)(d.get(k))
+    try: o={"region": d.get("region"), "monitor": num("monitor", int), "scale": num("scale", float), "max_dim": num("max_dim", int)}
+    except (TypeError, ValueError): raise ValueError("monitor/max_dim must be integers and scale a number")
+    if o["scale"] is not None and not 0<o["scale"]<=1: raise ValueError("scale must be in (0, 1]")
+    if o["max_dim"] is not None and o["max_dim"]<16: raise ValueError("max_dim must be at least 16")
+    capture_box(o["region"], o["monitor"])
+    return o
+
+def shot_opts(d):
+    """format/quality/thumb for screenshot(), from a JSON body, query args or command params."""
+    try:
+        o={"fmt": d.get("format"), "quality": int(d["quality"]) if d.get("quality") not in (None, "") else None,
+           "thumb": int(d["thumb"]) if d.get("thumb") not in (None, "") else None}
+    except (TypeError, ValueError): raise ValueError("quality and thumb must be integers")
+    if o["fmt"] not in (None, "") and str(o["fmt"]).lower() not in IMAGE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(IMAGE_FORMATS)}")
+    if o["quality"] is not None and not 1<=o["quality"]<=100: raise ValueError("quality must be 1-100")
+    if o["thumb"] is not None and o["thumb"]<0: raise ValueError("thumb must be >= 0")
+    return o
+
+def recording_opts(d):
+    """fps/resolution/codec/segment/concat for start_recording(), validated like capture_opts."""
+    try:
+        fps=float(d["fps"]) if d.get("fps") not in (None, "") else None
+        segment=float(d["segment"]) if d.get("segment") not in (None, "") else None
+    except (TypeError, ValueError): raise ValueError("fps and segment must be numbers")
+    if fps is not None and not 0<fps<=120: raise ValueError("fps must be between 0 and 120")
+    if segment is not None and segment<0: raise ValueError("segment must be >= 0 seconds")
+    res=d.get("resolution") or None; codec=d.get("codec") or None
+    if res is not None and parse_size(res) is None: raise ValueError("resolution must be WIDTHxHEIGHT")
+    if codec is not None and not (isinstance(codec, str) and len(codec)==4):
+        raise ValueError("codec must be a 4-character FourCC such as XVID")
+    return {"fps": fps, "resolution": res, "codec": codec, "segment": segment, "concat": d.get("concat")}
+
+def replay_opts(d):
+    """seconds/fps/budget_mb/quality for replay_start(), validated like recording_opts."""
+    num=lambda k, cast: cast(d[k]) if d.get(k) not in (None, "") else None
+    try: o={"seconds": num("seconds", float), "fps": num("fps", float), "budget_mb": num("budget_mb", float), "quality": num("quality", int)}
+    except (TypeError, ValueError): raise ValueError("seconds, fps and budget_mb must be numbers and quality an integer")
+    for k in ("seconds", "budget_mb"):
+        if o[k] is not None and not 0<o[k]<float("inf"): raise ValueError(f"{k} must be a positive number")
+    if o["fps"] is not None and not 0<o["fps"]<=120: raise ValueError("fps must be between 0 and 120")
+    if o["quality"] is not None and not 1<=o["quality"]<=100: raise ValueError("quality must be 1-100")
+    return o
+
+def capture_box(region=None, monitor=None):
+    """
+    → (box, all_screens). A region is relative to the chosen monitor (primary when none is
+    given). Monitor 0 is the whole virtual desktop; picking other monitors needs mss for
+    their geometry. box=None means the backend's default full-screen grab.
+    """
+    box=parse_region(region)
+    if region not in (None, "", [], {}) and box is None:
+        raise ValueError("region must be x,y,width,height")
+    mon=None
+    if monitor not in (None, 1) or (monitor==1 and box and MSS_AVAILABLE):
+        if not MSS_AVAILABLE and monitor!=0: raise ValueError("Selecting a monitor needs mss: pip install mss")
+        if MSS_AVAILABLE:
+            with mss.mss() as sct:
+                if not 0<=monitor<len(sct.monitors): raise ValueError(f"No monitor {monitor} (have 1-{len(sct.monitors)-1})")
+                mon=dict(sct.monitors[monitor])
+    if box and mon:
+        box={**box, "left":mon["left"]+box["left"], "top":mon["top"]+box["top"]}
+    return (box or mon), monitor==0
+
+def scaled_size(w, h, scale=None, max_dim=None):
+    """Apply `scale`, then cap the longer side at `max_dim`. Scaled sizes are rounded to even for the codecs."""
+    f=float(scale) if scale and 0<float(scale)<=1 else 1.0
+    if max_dim and max(w,h)*f>int(max_dim): f=int(max_dim)/max(w,h)
+    if f>=1.0: return (w,h)
+    return (max(2, int(w*f)//2*2), max(2, int(h*f)//2*2))
+
+def grab_image(box=None, all_screens=False):
+    """One-shot grab as a PIL image, cropped by the OS/backend rather than after the fact."""
+    if MSS_AVAILABLE and (box or not PIL_AVAILABLE):
+        with mss.mss() as sct:
+            shot=sct.grab(box or sct.monitors[0 if all_screens else 1])
+            return Image.frombuffer("RGB", shot.size, shot.bgra, "raw", "BGRX", 0, 1)
+    if PIL_AVAILABLE:
+        bbox=(box["left"], box["top"], box["left"]+box["width"], box["top"]+box["height"]) if box else None
+        return ImageGrab.grab(bbox=bbox, all_screens=all_screens) if all_screens else ImageGrab.grab(bbox=bbox)
+    if PYAUTOGUI_AVAILABLE:
+        return pyautogui.screenshot(region=(box["left"], box["top"], box["width"], box["height"]) if box else None)
+    raise RuntimeError("Install Pillow: pip install pillow")
+
+SHOT_FORMAT    = os.getenv("ELSA_SHOT_FORMAT", "png").lower()    # png | jpeg | webp
+SHOT_QUALITY   = int(os.getenv("ELSA_SHOT_QUALITY", "85"))        # jpeg / webp
+SHOT_PNG_LEVEL = int(os.getenv("ELSA_SHOT_PNG_LEVEL", "1"))       # zlib level: 1 is ~10x faster than Pillow's 6 for screen content
+SHOT_THUMB     = int(os.getenv("ELSA_SHOT_THUMB", "640"))         # longest side of the preview in API responses
+IMAGE_FORMATS  = {"png": ("PNG", "image/png", ".png"), "jpg": ("JPEG", "image/jpeg", ".jpg"),
+                  "jpeg": ("JPEG", "image/jpeg", ".jpg"), "webp": ("WEBP", "image/webp", ".webp")}
+DISK_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="elsa-disk")
+
+def encode_image(img, fmt=SHOT_FORMAT, quality=SHOT_QUALITY, level=SHOT_PNG_LEVEL):
+    """Encode a PIL image once → (bytes, mime, ext). Unknown formats fall back to PNG."""
+    name, mime, ext = IMAGE_FORMATS.get(str(fmt or "png").lower(), IMAGE_FORMATS["png"])
+    if name != "PNG" and img.mode not in ("RGB", "L"): img = img.convert("RGB")
+    buf = BytesIO()
+    if name == "PNG": img.save(buf, format=name, compress_level=int(level))
+    elif name == "WEBP": img.save(buf, format=name, quality=int(quality), method=2)
+    else: img.save(buf, format=name, quality=int(quality))
+    return buf.getvalue(), mime, ext
+
+def save_image_async(img, path, fmt=SHOT_FORMAT, quality=SHOT_QUALITY):
+    """
+    Encode and write on the disk pool (tmp + rename, so a half-written file never appears
+    under `path`). The future resolves to the encoded bytes, which MEDIA then serves.
+    """
+    def _save():
+        data=encode_image(img, fmt, quality)[0]
+        try:
+            with open(path+".part", "wb") as f: f.write(data)
+            os.replace(path+".part", path)
+        except Exception as e: logger.error(f"Write failed for {path}: {e}")
+        return data
+    return DISK_POOL.submit(_save)
+
+def pillow_bgr(img):
+    """
+    PIL image → BGR numpy view. Pillow can't hand out its pixel memory, so one copy is
+    unavoidable; letting its packer write BGR makes that copy the channel swap too,
+    instead of tobytes() + np.array + cvtColor each allocating a full frame.
+    """
+    if img.mode!="RGB": img=img.convert("RGB")     # RGBA grabs (macOS); convert() on RGB would copy
+    return np.frombuffer(img.tobytes("raw", "BGR"), np.uint8).reshape(img.height, img.width, 3)
+
+def screen_grabber(backend=REC_BACKEND, box=None, all_screens=False):
+    """
+    → (grab, pixel_format, name). grab() returns a numpy view over the captured pixels
+    with as few copies as the backend allows: mss exposes its BGRA buffer directly
+    (none), Pillow packs BGR in the one copy it must make (see pillow_bgr).
+    mss handles are per-thread, so one is opened lazily in whichever thread grabs.
+    `box` (see capture_box) limits the grab itself to a region or monitor.
+    """
+    if backend in ("auto", "mss") and MSS_AVAILABLE:
+        local = threading.local()
+        def grab():
+            sct = getattr(local, "sct", None)
+            if sct is None: sct = local.sct = mss.mss()
+            shot = sct.grab(box or sct.monitors[0 if all_screens else 1])
+            return np.frombuffer(shot.raw, np.uint8).reshape(shot.height, shot.width, 4)
+        return grab, "BGR", "mss"
+    if backend in ("auto", "mss", "pillow") and PIL_AVAILABLE:
+        return (lambda: pillow_bgr(grab_image(box, all_screens))), "BGR", "pillow"
+    if PYAUTOGUI_AVAILABLE:
+        return (lambda: pillow_bgr(grab_image(box))), "BGR", "pyautogui"
+    return None, None, None
+
+class FrameConverter:
+    """Resize (before the channel swap, on the smaller image) then convert into reused BGR buffers."""
+    CONVERT = {("RGB", 3): "COLOR_RGB2BGR", ("RGB", 4): "COLOR_RGBA2BGR", ("BGR", 4): "COLOR_BGRA2BGR"}
+
+    def __init__(self, size, pixel_format="RGB"):
+        self.size=tuple(size); self.pixel_format=pixel_format; self._resized=None; self._bgr=None
+
+    def __call__(self, src):
+        w,h=self.size; ch=src.shape[2] if src.ndim==3 else 1
+        if (src.shape[1], src.shape[0])!=(w,h):
+            if self._resized is None or self._resized.shape[2:]!=src.shape[2:]:
+                self._resized=np.empty((h,w)+src.shape[2:], np.uint8)
+            src=cv2.resize(src, (w,h), dst=self._resized, interpolation=cv2.INTER_AREA)
+        code=self.CONVERT.get((self.pixel_format, ch))
+        if code is None: return src
+        if self._bgr is None: self._bgr=np.empty((h,w,3), np.uint8)
+        return cv2.cvtColor(src, getattr(cv2, code), dst=self._bgr)
+
+class ScreenRecorder:
+    """
+    The capture thread grabs on fixed deadlines (t0 + k/fps on the monotonic clock) and
+    stamps each frame; deadlines it misses are skipped rather than bursted. The encoder
+    thread maps each stamp to an output slot at `fps`: slots the capture missed are filled
+    by repeating the previous frame, frames arriving for an already-written slot are
+    dropped. The file therefore plays back at wall-clock speed regardless of grab cost.
+    `grab` returns an RGB(A) or BGR(A) numpy array per `pixel_format`; the encoder
+    converts and resizes into buffers allocated once. With mss nothing is allocated per
+    frame; Pillow/pyautogui grabs cost exactly one frame-sized copy (pillow_bgr).
+
+    With `segment_secs` the output is a folder of independently finalised segment files
+    plus manifest.json, rewritten atomically after each segment closes; a crash or kill
+    loses at most the open segment, and only one writer is ever held open.
+
+    With `dedup` every 4th pixel of every 4th row is compared with the same samples of
+    the last changed frame; unchanged grabs reach the encoder as a bare timestamp and become a
+    repeat of the previous frame, skipping conversion. After `idle_after` seconds without
+    change the capture rate falls to `idle_fps` and returns to `fps` on the next change;
+    the output stays at `fps` either way. cv2.VideoWriter is constant-rate and takes raw
+    frames only, so every repeat still goes through the codec at about the cost of a new
+    frame: dedup saves grabs and conversion, not encode time. Stats report `repeat_ms`.
+    """
+    def __init__(self, path, grab, fps=REC_FPS, size=None, codec=REC_CODEC, queue_size=REC_QUEUE, on_finish=None,
+                 pixel_format="RGB", scale=None, max_dim=None, segment_secs=0, dedup=REC_DEDUP, idle_fps=REC_IDLE_FPS,
+                 idle_after=REC_IDLE_AFTER):
+        self.path=path; self.grab=grab; self.fps=float(fps); self.size=size; self.codec=codec; self.pixel_format=pixel_format
+        self.scale=scale; self.max_dim=max_dim
+        self.segment_frames=max(1, round(float(segment_secs)*self.fps)) if segment_secs else 0
+        self.segments=[]; self._seg_start=0; self._seg_path=None
+        self.manifest_path=os.path.join(path, "manifest.json") if self.segment_frames else None
+        self._converter=None
+        self.dedup=bool(dedup); self.idle_fps=min(float(idle_fps or self.fps), self.fps); self.idle_after=float(idle_after)
+        self.idle=False; self._sig=None; self._prev_sig=None
+        self.frames=queue.Queue(maxsize=queue_size); self.stop_event=threading.Event(); self.on_finish=on_finish
+        self.counters={"captured":0,"written":0,"duplicated":0,"deduplicated":0,"dropped_late":0,"dropped_queue":0}
+        self.capture_time=0.0; self.encode_time=0.0; self.repeat_time=0.0
+        self.writer=None; self.t0=None; self.t_stop=None; self.error=None; self._threads=[]
+
+    def start(self):
+        t=time.monotonic(); first=self.grab(); self.capture_time+=time.monotonic()-t
+        h,w=first.shape[:2]
+        self.size=self.size or scaled_size(w, h, self.scale, self.max_dim)
+        if self.segment_frames: os.makedirs(self.path, exist_ok=True)
+        self._open_writer()
+        self.t0=time.monotonic()
+        if self.dedup: self._changed(first)
+        self.frames.put((self.t0, first)); self.counters["captured"]=1
+        self._threads=[threading.Thread(target=self._capture_loop, daemon=True, name="rec-capture"),
+                       threading.Thread(target=self._encode_loop, daemon=True, name="rec-encode")]
+        for th in self._threads: th.start()
+        return self
+
+    def stop(self, timeout=10):
+        """Signal stop and wait for the encoder to flush; True once the file is finalised."""
+        self.stop_event.set()
+        for th in self._threads: th.join(timeout)
+        return not any(th.is_alive() for th in self._threads)
+
+    def _changed(self, src):
+        """Sparse diff against the last changed frame; a strided copy is ~1.5 ms at 1080p, an area resize ~9."""
+        view=src[::4, ::4]
+        if self._sig is None or self._sig.shape!=view.shape:
+            self._sig=np.empty(view.shape, np.uint8); self._prev_sig=None
+        np.copyto(self._sig, view)
+        if self._prev_sig is not None and cv2.norm(self._sig, self._prev_sig, cv2.NORM_INF)<=REC_DEDUP_THRESHOLD:
+            return False
+        if self._prev_sig is None: self._prev_sig=self._sig.copy()
+        else: np.copyto(self._prev_sig, self._sig)
+        return True
+
+    def _capture_loop(self):
+        period=1.0/self.fps; idle_period=1.0/self.idle_fps; deadline=self.t0+period; last_change=self.t0
+        try:
+            while not self.stop_event.is_set():
+                delay=deadline-time.monotonic()
+                if delay>0 and self.stop_event.wait(delay): break
+                ts=time.monotonic(); rgb=self.grab(); self.capture_time+=time.monotonic()-ts
+                self.counters["captured"]+=1
+                if self.dedup and not self._changed(rgb):
+                    # Static: send only the timestamp, the encoder repeats the previous frame
+                    self.counters["deduplicated"]+=1; rgb=None
+                    self.idle=ts-last_change>=self.idle_after
+                else:
+                    last_change=ts; self.idle=False
+                try: self.frames.put_nowait((ts, rgb))
+                except queue.Full: self.counters["dropped_queue"]+=1
+                step=idle_period if self.idle else period
+                deadline+=step
+                now=time.monotonic()
+                if deadline<now: deadline+=((now-deadline)//step+1)*step
+        except Exception as e:
+            self.error=str(e); logger.error(f"Recording capture error: {e}")
+        finally:
+            self.t_stop=time.monotonic()
+            self.frames.put(None)
+
+    def _convert(self, src):
+        if self._converter is None: self._converter=FrameConverter(self.size, self.pixel_format)
+        return self._converter(src)
+
+    def _open_writer(self):
+        path=self.path
+        if self.segment_frames:
+            path=os.path.join(self.path, f"segment_{len(self.segments):03d}{CODEC_EXT.get(self.codec, '.avi')}")
+        self.writer=cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps, self.size)
+        if not self.writer.isOpened():
+            raise RuntimeError("VideoWriter could not be opened")
+        self._seg_path=path; self._seg_start=self.counters["written"]
+
+    def _close_writer(self, status="recording"):
+        if self.writer is None: return
+        self.writer.release(); self.writer=None
+        if not self.segment_frames: return
+        frames=self.counters["written"]-self._seg_start
+        if frames: self.segments.append({"file":os.path.basename(self._seg_path), "start":round(self._seg_start/self.fps, 3),
+                                         "frames":frames, "duration":round(frames/self.fps, 3)})
+        elif os.path.exists(self._seg_path): os.remove(self._seg_path)
+        self.write_manifest(status)
+
+    def write_manifest(self, status, **extra):
+        """Atomic replace, so readers (and a crash) only ever see a complete manifest."""
+        data={"status":status, "fps":self.fps, "size":list(self.size), "codec":self.codec,
+              "segment_secs":self.segment_frames/self.fps, "segments":self.segments,
+              "duration":round(sum(sg["frames"] for sg in self.segments)/self.fps, 3), **extra}
+        tmp=self.manifest_path+".tmp"
+        with open(tmp, "w") as f: json.dump(data, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _write(self, frame, dup=False):
+        if self.segment_frames and self.counters["written"]-self._seg_start>=self.segment_frames:
+            self._close_writer()
+        if self.writer is None: self._open_writer()
+        t=time.monotonic(); self.writer.write(frame); t=time.monotonic()-t
+        self.counters["written"]+=1
+        if dup: self.counters["duplicated"]+=1; self.repeat_time+=t
+        else: self.encode_time+=t
+
+    def _encode_loop(self):
+        last=None
+        try:
+            while True:
+                item=self.frames.get()
+                if item is None: break
+                ts,rgb=item
+                slot=int((ts-self.t0)*self.fps)
+                if slot<self.counters["written"]:
+                    if rgb is not None: self.counters["dropped_late"]+=1
+                    continue
+                # `last` lives in the shared buffer: emit its repeats before the next conversion overwrites it
+                while last is not None and self.counters["written"]<slot: self._write(last, dup=True)
+                if rgb is None:
+                    if last is not None: self._write(last, dup=True)
+                    continue
+                t=time.monotonic(); last=self._convert(rgb); self.encode_time+=time.monotonic()-t
+                self._write(last)
+            # Pad the tail so the file is as long as the recording was
+            end_slot=int(((self.t_stop or time.monotonic())-self.t0)*self.fps)
+            while last is not None and self.counters["written"]<end_slot: self._write(last, dup=True)
+        except Exception as e:
+            self.error=str(e); logger.error(f"Recording encode error: {e}")
+        finally:
+            self._close_writer("failed" if self.error else "complete")
+            logger.info(f"Recording saved: {self.path}")
+            if self.on_finish: self.on_finish(self)
+
+    def stats(self):
+        elapsed=max(((self.t_stop or time.monotonic())-self.t0) if self.t0 else 0.0, 1e-6)
+        c=self.counters; encoded=max(c["written"]-c["duplicated"], 1)
+        return {**c, "idle":self.idle, "dedup":self.dedup, "queue_depth":self.frames.qsize(), "queue_size":self.frames.maxsize,
+                "target_fps":self.fps, "capture_fps":round(c["captured"]/elapsed, 2),
+                "output_fps":round(c["written"]/elapsed, 2),
+                "capture_ms":round(1000*self.capture_time/max(c["captured"], 1), 2),
+                "encode_ms":round(1000*self.encode_time/encoded, 2),
+                "repeat_ms":round(1000*self.repeat_time/max(c["duplicated"], 1), 2),
+                "size":list(self.size) if self.size else None, "codec":self.codec,
+                "pixel_format":self.pixel_format, "segments":len(self.segments) if self.segment_frames else None,
+                "error":self.error}
+
+def concat_segments(folder):
+    """
+    Join a segmented recording into <folder>.<ext> next to it: ffmpeg's concat demuxer
+    (stream copy, no re-encode) when available, else an OpenCV read/write pass. The
+    segments and manifest are kept; the manifest gains a `concatenated` entry.
+    """
+    mpath=os.path.join(folder, "manifest.json")
+    with open(mpath) as f: man=json.load(f)
+    files=[os.path.join(folder, sg["file"]) for sg in man["segments"]]
+    if not files: return None
+    out=folder.rstrip(os.sep)+os.path.splitext(files[0])[1]
+    try:
+        if shutil.which("ffmpeg"):
+            lst=os.path.join(folder, "segments.txt")
+            with open(lst, "w") as f: f.writelines(f"file '{os.path.basename(p)}'\n" for p in files)
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", lst, "-c", "copy", out],
+                           check=True, timeout=600)
+        else:
+            w=cv2.VideoWriter(out, cv2.VideoWriter_fourcc(*man["codec"]), man["fps"], tuple(man["size"]))
+            try:
+                for p in files:
+                    cap=cv2.VideoCapture(p)
+                    while True:
+                        ok, frame=cap.read()
+                        if not ok: break
+                        w.write(frame)
+                    cap.release()
+            finally: w.release()
+        man["concatenated"]=os.path.basename(out)
+    except Exception as e:
+        man["concat_error"]=str(e); logger.error(f"Segment concat failed: {e}"); out=None
+    tmp=mpath+".tmp"
+    with open(tmp, "w") as f: json.dump(man, f, indent=1)
+    os.replace(tmp, mpath)
+    return out
+
+# ============================================================
+# INSTANT REPLAY — last N seconds kept as JPEG frames under a hard byte budget
+# ============================================================
+REPLAY_SECS      = float(os.getenv("ELSA_REPLAY_SECS", "30"))
+REPLAY_FPS       = float(os.getenv("ELSA_REPLAY_FPS", "5"))
+REPLAY_BUDGET_MB = float(os.getenv("ELSA_REPLAY_BUDGET_MB", "64"))
+REPLAY_QUALITY   = int(os.getenv("ELSA_REPLAY_QUALITY", "70"))
+REPLAY_MAX_DIM   = int(os.getenv("ELSA_REPLAY_MAX_DIM", "1280"))
+REPLAY_AUTOSTART = os.getenv("ELSA_REPLAY_AUTOSTART", "0") == "1"
+
+class ReplayBuffer:
+    """
+    Background capture into a ring of (timestamp, jpeg bytes). Frames older than `seconds`
+    are evicted, and so is the oldest frame whenever the total would exceed `budget`
+    bytes — the budget is a hard cap, a single frame larger than it is discarded.
+    save() decodes a snapshot of the ring into a video paced by the frame timestamps.
+    """
+    def __init__(self, grab, pixel_format="RGB", seconds=REPLAY_SECS, fps=REPLAY_FPS, budget=int(REPLAY_BUDGET_MB*2**20),
+                 quality=REPLAY_QUALITY, scale=None, max_dim=REPLAY_MAX_DIM):
+        self.grab=grab; self.pixel_format=pixel_format; self.seconds=float(seconds); self.fps=float(fps)
+        self.budget=int(budget); self.quality=int(quality); self.scale=scale; self.max_dim=max_dim
+        self.frames=deque(); self.bytes=0; self.lock=threading.Lock(); self.stop_event=threading.Event()
+        self.size=None; self.thread=None; self.error=None
+        self.counters={"captured":0,"evicted_age":0,"evicted_budget":0,"oversize":0,"saves":0}
+        self.encode_time=0.0
+
+    def start(self):
+        self.thread=threading.Thread(target=self._loop, daemon=True, name="replay-capture"); self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.thread: self.thread.join(timeout)
+        with self.lock: self.frames.clear(); self.bytes=0
+
+    @property
+    def running(self): return bool(self.thread and self.thread.is_alive())
+
+    def _loop(self):
+        period=1.0/self.fps; t0=time.monotonic(); k=0; conv=None
+        params=[cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        try:
+            while not self.stop_event.is_set():
+                delay=t0+k*period-time.monotonic()
+                if delay>0 and self.stop_event.wait(delay): break
+                ts=time.monotonic(); src=self.grab()
+                if conv is None:
+                    self.size=scaled_size(src.shape[1], src.shape[0], self.scale, self.max_dim)
+                    conv=FrameConverter(self.size, self.pixel_format)
+                ok, jpg=cv2.imencode(".jpg", conv(src), params)
+                self.encode_time+=time.monotonic()-ts
+                if ok: self._push(ts, jpg.tobytes())
+                k=max(k+1, int((time.monotonic()-t0)/period)+1)
+        except Exception as e:
+            self.error=str(e); logger.error(f"Replay capture error: {e}")
+
+    def _push(self, ts, data):
+        with self.lock:
+            self.counters["captured"]+=1
+            if len(data)>self.budget: self.counters["oversize"]+=1; return
+            while self.frames and self.frames[0][0]<ts-self.seconds:
+                self.bytes-=len(self.frames.popleft()[1]); self.counters["evicted_age"]+=1
+            while self.frames and self.bytes+len(data)>self.budget:
+                self.bytes-=len(self.frames.popleft()[1]); self.counters["evicted_budget"]+=1
+            self.frames.append((ts, data)); self.bytes+=len(data)
+
+    def save(self, path, seconds=None, codec=REC_CODEC):
+        """Write the last `seconds` (default: everything held) to `path`; returns frames written."""
+        with self.lock: snap=list(self.frames)
+        if seconds: snap=[f for f in snap if f[0]>=snap[-1][0]-float(seconds)] if snap else snap
+        if not snap: return 0
+        writer=cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), self.fps, self.size)
+        if not writer.isOpened(): raise RuntimeError("VideoWriter could not be opened")
+        written=0; last=None
+        try:
+            for ts, data in snap:
+                frame=cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                slot=int((ts-snap[0][0])*self.fps)
+                while last is not None and written<slot: writer.write(last); written+=1
+                if written<=slot: writer.write(frame); written+=1
+                last=frame
+        finally: writer.release()
+        self.counters["saves"]+=1
+        return written
+
+    def stats(self):
+        with self.lock:
+            n=len(self.frames); span=self.frames[-1][0]-self.frames[0][0] if n>1 else 0.0
+            c=dict(self.counters); held=self.bytes
+        return {**c, "running":self.running, "frames":n, "seconds_held":round(span, 2), "window":self.seconds,
+                "bytes":held, "budget":self.budget, "fps":self.fps, "quality":self.quality,
+                "size":list(self.size) if self.size else None,
+                "avg_frame_kb":round(held/n/1024, 1) if n else None,
+                "encode_ms":round(1000*self.encode_time/max(c["captured"], 1), 2), "error":self.error}
+
+
+# ============================================================
+# PER-SESSION CONVERSATION STATE
+# ============================================================
+SESSION_MAX_COUNT = int(os.getenv("ELSA_MAX_SESSIONS", "200"))
+SESSION_IDLE_TTL  = float(os.getenv("ELSA_SESSION_TTL", "3600"))
+SESSION_MAX_TURNS = int(os.getenv("ELSA_SESSION_MAX_TURNS", "30"))
+SESSION_MAX_BYTES = int(os.getenv("ELSA_SESSION_MAX_BYTES", "200000"))
+
+# Per-provider token budget for the history window (summary + recent turns)
+HISTORY_TOKEN_BUDGET = {
+    "anthropic": int(os.getenv("ELSA_HISTORY_TOKENS_ANTHROPIC", "6000")),
+    "openai":    int(os.getenv("ELSA_HISTORY_TOKENS_OPENAI", "6000")),
+    "gemini":    int(os.getenv("ELSA_HISTORY_TOKENS_GEMINI", "2000")),
+}
+SUMMARY_MAX_TOKENS = int(os.getenv("ELSA_SUMMARY_MAX_TOKENS", "600"))
+HISTORY_MAX_TOKENS = max(HISTORY_TOKEN_BUDGET.values())   # stored history serves the largest budget
+
+def _msg_bytes(m): return len((m["content"] or "").encode("utf-8"))
+
+def estimate_tokens(text):
+    """Cheap ~4 chars/token estimate plus per-message overhead; good enough for budgeting."""
+    return len(text or "")//4 + 4
+
+class ChatSession:
+    """
+    One client's conversation. `lock` serialises turns within this session only.
+    Token counts are tracked per message as turns are added. The stored history is
+    only evicted against the hard caps and the largest provider budget; each request
+    takes a window() for its own budget, so a small-budget call never throws away
+    turns a larger one should still see. Evicted turns (and, per view, turns left
+    out of the window) become a rolling extractive summary in the system prompt.
+    """
+    def __init__(self, sid):
+        self.id=sid; self.history=[]; self.tokens=[]; self.bytes=0; self.total_tokens=0
+        self.summary_lines=deque(); self.summary_tokens=0; self.summary=""
+        self.lock=threading.RLock(); self.last_used=time.monotonic()
+
+    def append(self, role, content):
+        m={"role":role,"content":content or ""}
+        self.history.append(m); self.tokens.append(estimate_tokens(m["content"]))
+        self.bytes+=_msg_bytes(m); self.total_tokens+=self.tokens[-1]
+        self._evict_while(lambda: len(self.history)>SESSION_MAX_TURNS or self.bytes>SESSION_MAX_BYTES
+                                  or self.total_tokens+self.summary_tokens>HISTORY_MAX_TOKENS)
+
+    def window(self, budget):
+        """(messages, summary) fitting `budget` tokens: the newest turns, older ones summarised. Read-only."""
+        n=len(self.history); start=0; tot=self.total_tokens
+        lines=deque(self.summary_lines); stoks=self.summary_tokens
+        def drop():
+            nonlocal start, tot, stoks
+            line=self._summary_line(self.history[start]); tot-=self.tokens[start]; start+=1
+            lines.append(line); stoks+=line[1]
+            while len(lines)>1 and stoks>SUMMARY_MAX_TOKENS: stoks-=lines.popleft()[1]
+        while n-start>1 and tot+stoks>budget: drop()
+        while n-start>1 and self.history[start]["role"]!="user": drop()
+        while len(lines)>1 and stoks>min(SUMMARY_MAX_TOKENS, budget//3): stoks-=lines.popleft()[1]
+        return self.history[start:], "\n".join(l for l,_ in lines)
+
+    def _evict_while(self, cond):
+        # Always keep the newest message, and open the window on a user turn
+        while len(self.history)>1 and cond(): self._pop_oldest()
+        while len(self.history)>1 and self.history[0]["role"]!="user": self._pop_oldest()
+
+    def _pop_oldest(self):
+        m=self.history.pop(0); t=self.tokens.pop(0)
+        self.bytes-=_msg_bytes(m); self.total_tokens-=t
+        self.summary_lines.append(self._summary_line(m)); self.summary_tokens+=self.summary_lines[-1][1]
+        self._trim_summary(SUMMARY_MAX_TOKENS)
+
+    @staticmethod
+    def _summary_line(m):
+        text=" ".join(m["content"].split())
+        first=re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0][:160]
+        line=("User: " if m["role"]=="user" else "ELSA: ")+first
+        return line, estimate_tokens(line)
+
+    def _trim_summary(self, limit):
+        while len(self.summary_lines)>1 and self.summary_tokens>limit:
+            self.summary_tokens-=self.summary_lines.popleft()[1]
+        self.summary="\n".join(l for l,_ in self.summary_lines)
+
+class SessionStore:
+    """Bounded LRU of ChatSession keyed by client session id; idle sessions expire."""
+    def __init__(self, max_sessions, idle_ttl):
+        self.max_sessions=max_sessions; self.idle_ttl=idle_ttl
+        self._sessions=OrderedDict(); self._lock=threading.Lock()
+
+    def get(self, sid):
+        sid=(sid or "default")[:128]; now=time.monotonic()
+        with self._lock:
+            sess=self._sessions.get(sid)
+            if sess is None: sess=self._sessions[sid]=ChatSession(sid)
+            else: self._sessions.move_to_end(sid)
+            sess.last_used=now
+            # Oldest entries sit at the front: evict until under the cap and nothing is idle
+            while len(self._sessions)>1:
+                oldest=next(iter(self._sessions.values()))
+                if len(self._sessions)<=self.max_sessions and now-oldest.last_used<=self.idle_ttl: break
+                self._sessions.popitem(last=False)
+            return sess
+
+    def drop(self, sid):
+        with self._lock: self._sessions.pop((sid or "default")[:128], None)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions":len(self._sessions),"max_sessions":self.max_sessions,
+                    "bytes":sum(s.bytes for s in self._sessions.values()),
+                    "history_tokens":sum(s.total_tokens+s.summary_tokens for s in self._sessions.values()),
+                    "token_budget":HISTORY_TOKEN_BUDGET}
+
+# ============================================================
+# RESPONSE CACHE (opt-in) — repeated questions skip the LLM round trip
+# ============================================================
+RESPONSE_CACHE_ENABLED = os.getenv("ELSA_RESPONSE_CACHE", "0").lower() in ("1","true","yes")
+RESPONSE_CACHE_SIZE    = int(os.getenv("ELSA_RESPONSE_CACHE_SIZE", "500"))
+RESPONSE_CACHE_TTL     = float(os.getenv("ELSA_RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_DB      = os.getenv("ELSA_RESPONSE_CACHE_DB", "")
+
+class ResponseCache:
+    """
+    TTL + LRU cache of assistant replies keyed on (normalised message, provider that answered,
+    system prompt). Only context-free first turns are cached — see ElsaEngine._cache_lookup.
+    When `db_path` is set, entries are also written through to SQLite so they survive restarts.
+    """
+    def __init__(self, max_entries, ttl, db_path=""):
+        self.max_entries=max_entries; self.ttl=ttl
+        self._mem=OrderedDict(); self._lock=threading.Lock()
+        self.hits=0; self.misses=0; self._db=None
+        if db_path:
+            try:
+                self._db=sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+                self._db.execute("DELETE FROM responses WHERE created < ?", (time.time()-ttl,))
+                self._db.commit()
+            except Exception as e:
+                logger.warning(f"Response cache DB disabled: {e}"); self._db=None
+
+    @staticmethod
+    def key(msg, provider, system):
+        norm=" ".join(clean_name(msg).split())
+        return hashlib.sha256(f"{provider}\0{system}\0{norm}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self.first([key])[1]
+
+    def first(self, keys):
+        """(key, value) for the first fresh entry among `keys`, else (None, None); one hit or miss either way."""
+        with self._lock:
+            for key in keys:
+                value=self._peek(key)
+                if value is not None:
+                    self.hits+=1; return key,value
+            self.misses+=1
+            return None,None
+
+    def _peek(self, key):
+        """Fresh value for `key` or None, without touching the counters. Caller holds the lock."""
+        hit=self._mem.get(key)
+        if hit is None and self._db is not None:
+            row=self._db.execute("SELECT value, created FROM responses WHERE key=?", (key,)).fetchone()
+            if row: hit=self._mem[key]=(row[0], row[1])
+        if hit is None: return None
+        if time.time()-hit[1]>self.ttl: self._mem.pop(key, None); return None
+        self._mem.move_to_end(key); self._shrink()
+        return hit[0]
+
+    def put(self, key, value):
+        now=time.time()
+        with self._lock:
+            self._mem[key]=(value, now); self._mem.move_to_end(key)
+            self._shrink()
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?)", (key, value, now))
+                    self._db.execute("DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                                     (self.max_entries,))
+                    self._db.commit()
+                except Exception as e: logger.warning(f"Response cache write failed: {e}")
+
+    def _shrink(self):
+        while len(self._mem)>self.max_entries: self._mem.popitem(last=False)
+
+    def stats(self):
+        total=self.hits+self.misses
+        return {"enabled":True,"entries":len(self._mem),"max_entries":self.max_entries,
+                "hits":self.hits,"misses":self.misses,"hit_rate":round(self.hits/total,3) if total else 0.0,
+                "persistent":self._db is not None}
+
+MODEL_LABELS = {"anthropic": "Claude Sonnet 4", "openai": "GPT-4o", "gemini": "Gemini 1.5 Flash"}
+
+# ============================================================
+# PROVIDER LATENCY + HEDGING (model="auto")
+# ============================================================
+HEDGE_ENABLED       = os.getenv("ELSA_HEDGE", "0").lower() in ("1","true","yes")
+HEDGE_PERCENTILE    = float(os.getenv("ELSA_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES   = int(os.getenv("ELSA_HEDGE_MIN_SAMPLES", "10"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("ELSA_HEDGE_DEFAULT_DELAY", "4.0"))
+HEDGE_MIN_DELAY     = float(os.getenv("ELSA_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY     = float(os.getenv("ELSA_HEDGE_MAX_DELAY", "15.0"))
+HEDGE_READ_TIMEOUT  = float(os.getenv("ELSA_HEDGE_READ_TIMEOUT", "30"))   # max wait for any chunk of a streamed reply
+HEDGE_POOL          = ThreadPoolExecutor(max_workers=int(os.getenv("ELSA_HEDGE_WORKERS", "16")), thread_name_prefix="hedge")
+
+class LatencyTracker:
+    """Rolling window of latency samples per (provider, kind); kind is "total" or "first_token"."""
+    def __init__(self, window=200):
+        self.window=window; self._samples={}; self._lock=threading.Lock()
+
+    def record(self, provider, kind, seconds):
+        with self._lock: self._samples.setdefault((provider, kind), deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider, kind, pct, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock: xs=sorted(self._samples.get((provider, kind), ()))
+        if len(xs)<max(1, min_samples): return None
+        return xs[min(len(xs)-1, int(len(xs)*pct/100))]
+
+    def stats(self):
+        with self._lock: keys=list(self._samples)
+        out={}
+        for provider,kind in keys:
+            out.setdefault(provider, {})[kind]={"samples":len(self._samples[(provider, kind)]),
+                "p50":self.percentile(provider, kind, 50, 1),"p95":self.percentile(provider, kind, 95, 1)}
+        return out
+
+LATENCY = LatencyTracker()
+
+# ============================================================
+# PER-PROVIDER CIRCUIT BREAKERS
+# ============================================================
+BREAKER_WINDOW     = int(os.getenv("ELSA_BREAKER_WINDOW", "20"))
+BREAKER_WINDOW_SECS= float(os.getenv("ELSA_BREAKER_WINDOW_SECS", "120"))
+BREAKER_MIN_CALLS  = int(os.getenv("ELSA_BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("ELSA_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL  = float(os.getenv("ELSA_BREAKER_SLOW_CALL", "30"))
+BREAKER_COOLDOWN   = float(os.getenv("ELSA_BREAKER_COOLDOWN", "30"))
+
+class CircuitOpenError(RuntimeError): pass
+
+class CircuitBreaker:
+    """
+    closed → open when the rate of bad calls (errors or calls slower than BREAKER_SLOW_CALL)
+    over the last BREAKER_WINDOW calls / BREAKER_WINDOW_SECS crosses BREAKER_ERROR_RATE; open → half_open after the cooldown,
+    letting a single probe through; the probe's outcome closes or re-opens the circuit.
+    """
+    def __init__(self, name):
+        self.name=name; self.state="closed"; self.opened_at=0.0; self.probe_at=None; self.trips=0
+        self.calls=deque(maxlen=BREAKER_WINDOW); self._lock=threading.Lock()
+
+    def available(self):
+        """Routing check — does not claim the half-open probe slot."""
+        with self._lock:
+            now=time.monotonic()
+            if self.state=="open": return now-self.opened_at>=BREAKER_COOLDOWN
+            if self.state=="half_open": return self.probe_at is None or now-self.probe_at>=BREAKER_COOLDOWN
+            return True
+
+    def before_call(self):
+        with self._lock:
+            now=time.monotonic()
+            if self.state=="closed": return
+            if self.state=="open":
+                if now-self.opened_at<BREAKER_COOLDOWN: raise CircuitOpenError(f"{self.name} circuit open")
+                self.state="half_open"; self.probe_at=None
+            if self.probe_at is not None and now-self.probe_at<BREAKER_COOLDOWN:
+                raise CircuitOpenError(f"{self.name} circuit half-open, probe in flight")
+            self.probe_at=now
+
+    def record(self, ok, seconds):
+        good=ok and seconds<=BREAKER_SLOW_CALL
+        with self._lock:
+            if self.state=="half_open":
+                self.probe_at=None
+                if good: self.state="closed"; self.calls.clear(); logger.info(f"{self.name} circuit closed")
+                else: self._trip()
+                return
+            self.calls.append((time.monotonic(), good)); self._prune()
+            n=len(self.calls); bad=n-self._good()
+            if self.state=="closed" and n>=BREAKER_MIN_CALLS and bad/n>=BREAKER_ERROR_RATE: self._trip()
+
+    def _prune(self):
+        cutoff=time.monotonic()-BREAKER_WINDOW_SECS
+        while self.calls and self.calls[0][0]<cutoff: self.calls.popleft()
+
+    def _good(self): return sum(1 for _,good in self.calls if good)
+
+    def release(self):
+        """A call was abandoned (e.g. a hedged loser) — free the probe slot without an outcome."""
+        with self._lock:
+            if self.state=="half_open": self.probe_at=None
+
+    def _trip(self):
+        self.state="open"; self.opened_at=time.monotonic(); self.trips+=1
+        logger.warning(f"{self.name} circuit opened")
+
+    def score(self):
+        """
+        Health in [0,1]: success ratio over the window, zero while open. Once the cooldown
+        has elapsed the provider ranks first so real traffic probes it, with fallback behind.
+        """
+        with self._lock:
+            if self.state!="closed": return 1.0 if time.monotonic()-self.opened_at>=BREAKER_COOLDOWN else 0.0
+            self._prune()
+            return self._good()/len(self.calls) if len(self.calls)>=BREAKER_MIN_CALLS else 1.0
+
+    def stats(self):
+        score=self.score()
+        with self._lock:
+            n=len(self.calls)
+            return {"state":self.state,"calls":n,"error_rate":round((n-self._good())/n,3) if n else 0.0,
+                    "trips":self.trips,"health":round(score,3)}
+
+BREAKERS = {p: CircuitBreaker(p) for p in MODEL_LABELS}
 
 # ============================================================
 class ElsaEngine:
     def __init__(self):
-        self.history=[]
+        self.sessions=SessionStore(SESSION_MAX_COUNT, SESSION_IDLE_TTL)
+        self.cache=ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DB) if RESPONSE_CACHE_ENABLED else None
         self.PROMPT="""You are ELSA - an ultra-intelligent, warm, witty AI assistant.
 You are ELSA, uniquely yourself. You know everything about every topic: science, tech,
 history, culture, arts, sports, philosophy, coding, math, medicine, law, finance,
 entertainment, travel, food, and much more.
 Respond helpfully, accurately, with personality. Be conversational but smart."""
 
-    def chat(self, msg, model="auto"):
+    def _route(self, model):
+        """Providers to try for `model`, in order: an explicit active choice, else the auto chain."""
+        explicit={"claude":"anthropic","anthropic":"anthropic","gpt":"openai","openai":"openai",
+                  "gemini":"gemini","google":"gemini"}.get(model)
+        active=[p for p,ok in (("anthropic",ANTHROPIC_CLIENT),("openai",OPENAI_CLIENT),("gemini",GEMINI_AVAILABLE)) if ok]
+        healthy=[p for p in active if BREAKERS[p].available()]
+        if explicit in healthy: return [explicit]
+        # Healthiest first; the fixed preference order breaks ties
+        return sorted(healthy, key=lambda p: (-round(BREAKERS[p].score(), 1), active.index(p)))
+
+    def _unavailable(self):
+        """Reply used when _route() finds nothing to call: no keys, or every circuit open."""
+        if ANTHROPIC_CLIENT or OPENAI_CLIENT or GEMINI_AVAILABLE:
+            return "AI providers are temporarily unavailable. Please try again in a moment.","unavailable"
+        return "No AI providers active. Rename your _env file to .env and restart backend.","none"
+
+    def _cache_lookup(self, sess, msg, order):
+        """
+        (cacheable, provider, reply). Follow-ups ("why?", "tell me more") depend on the
+        conversation, so only a session's first turn is cacheable. Entries are keyed on the
+        provider that actually answered, so every routed provider is looked up in order —
+        still one hit or miss in the cache stats.
+        """
+        if not self.cache or len(sess.history)!=1 or sess.summary_lines: return False,None,None
+        keys={self.cache.key(msg, p, self.PROMPT):p for p in order}
+        key,hit=self.cache.first(keys)
+        return True,keys.get(key),hit
+
+    def _system(self, summary):
+        """System prompt, plus the summary of turns left out of the history window."""
+        if not summary: return self.PROMPT
+        return self.PROMPT+"\n\nSummary of the earlier conversation:\n"+summary
+
+    def _complete(self, provider, msg, history, system):
+        """Blocking completion — returns the full reply text."""
+        breaker=BREAKERS[provider]; breaker.before_call(); t0=time.monotonic()
         try:
-            self.history.append({"role":"user","content":msg})
-            if len(self.history)>30: self.history=self.history[-30:]
-            res,mdl=None,None
-
-            if model in("claude","anthropic") and ANTHROPIC_CLIENT:
-                r=ANTHROPIC_CLIENT.messages.create(model="claude-sonnet-4-20250514",max_tokens=2048,system=self.PROMPT,messages=self.history)
-                res=r.content[0].text; mdl="Claude Sonnet 4"
-            elif model in("gpt","openai") and OPENAI_CLIENT:
-                r=OPENAI_CLIENT.chat.completions.create(model="gpt-4o",messages=[{"role":"system","content":self.PROMPT}]+self.history,max_tokens=2048)
-                res=r.choices[0].message.content; mdl="GPT-4o"
-            elif model in("gemini","google") and GEMINI_AVAILABLE:
-                r=GEMINI_MODEL.generate_content(self.PROMPT+"\n\nUser: "+msg); res=r.text; mdl="Gemini 1.5 Flash"
+            if provider=="anthropic":
+                r=ANTHROPIC_CLIENT.messages.create(model="claude-sonnet-4-20250514",max_tokens=2048,system=system,messages=history)
+                res=r.content[0].text
+            elif provider=="openai":
+                r=OPENAI_CLIENT.chat.completions.create(model="gpt-4o",messages=[{"role":"system","content":system}]+history,max_tokens=2048)
+                res=r.choices[0].message.content
             else:
-                if ANTHROPIC_CLIENT:
-                    r=ANTHROPIC_CLIENT.messages.create(model="claude-sonnet-4-20250514",max_tokens=2048,system=self.PROMPT,messages=self.history)
-                    res=r.content[0].text; mdl="Claude Sonnet 4"
-                elif OPENAI_CLIENT:
-                    r=OPENAI_CLIENT.chat.completions.create(model="gpt-4o",messages=[{"role":"system","content":self.PROMPT}]+self.history,max_tokens=2048)
-                    res=r.choices[0].message.content; mdl="GPT-4o"
-                elif GEMINI_AVAILABLE:
-                    r=GEMINI_MODEL.generate_content(self.PROMPT+"\n\nUser: "+msg); res=r.text; mdl="Gemini 1.5 Flash"
-                else:
-                    res="No AI providers active. Rename your _env file to .env and restart backend."; mdl="none"
+                r=GEMINI_MODEL.generate_content(system+"\n\nUser: "+msg); res=r.text
+        except Exception:
+            breaker.record(False, time.monotonic()-t0); raise
+        dt=time.monotonic()-t0
+        LATENCY.record(provider, "total", dt); breaker.record(True, dt)
+        return res
+
+    def _stream(self, provider, msg, history, system):
+        """Yield reply text deltas from the provider's streaming API as they arrive."""
+        breaker=BREAKERS[provider]; breaker.before_call(); t0=time.monotonic(); ttft=None
+        # Closing this generator closes the upstream stream; the read timeout bounds how long a
+        # silent provider (e.g. a losing hedge waiting for its first token) can hold a worker
+        def _chunks():
+            if provider=="anthropic":
+                with ANTHROPIC_CLIENT.messages.stream(model="claude-sonnet-4-20250514",max_tokens=2048,system=system,messages=history,
+                                                      timeout=HEDGE_READ_TIMEOUT) as s:
+                    yield from s.text_stream
+            elif provider=="openai":
+                with OPENAI_CLIENT.chat.completions.create(model="gpt-4o",messages=[{"role":"system","content":system}]+history,max_tokens=2048,
+                                                           stream=True,timeout=HEDGE_READ_TIMEOUT) as s:
+                    for chunk in s:
+                        if chunk.choices: yield chunk.choices[0].delta.content
+            else:
+                for chunk in GEMINI_MODEL.generate_content(system+"\n\nUser: "+msg,stream=True,
+                                                           request_options={"timeout":HEDGE_READ_TIMEOUT}):
+                    yield chunk.text
+        try:
+            for text in _chunks():
+                if not text: continue
+                if ttft is None: ttft=time.monotonic()-t0; LATENCY.record(provider, "first_token", ttft)
+                yield text
+        except GeneratorExit:
+            breaker.release(); raise
+        except Exception:
+            breaker.record(False, time.monotonic()-t0); raise
+        LATENCY.record(provider, "total", time.monotonic()-t0)
+        # Stream length depends on the answer, so slowness is judged on time to first token
+        breaker.record(True, ttft if ttft is not None else time.monotonic()-t0)
+
+    def _hedge_delay(self, provider, kind):
+        """How long to give `provider` before launching the next one: its pN latency, clamped."""
+        p=LATENCY.percentile(provider, kind, HEDGE_PERCENTILE)
+        if p is None: return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, p))
+
+    def _hedged_complete(self, order, msg, history, system):
+        """
+        Blocking hedge, collected from _hedged_stream(): the providers race to a first token
+        and the losers' upstream streams are closed right then, so a hedge costs at most a
+        few tokens from the losers instead of a second full answer running to completion.
+        """
+        provider=None; parts=[]
+        for provider,text in self._hedged_stream(order, msg, history, system): parts.append(text)
+        return provider or order[0], "".join(parts)
+
+    def _hedged_stream(self, order, msg, history, system):
+        """
+        Streaming hedge: the next provider is launched when the current one has produced no
+        first token by its deadline (or errors). The first provider to emit a token wins;
+        the others are signalled to stop and close their upstream streams.
+        Yields (provider, text) pairs.
+        """
+        events=queue.Queue(); cancels={}; nxt=0; failed=0; winner=None; deadline=None; last_err=None
+        def run(p, cancel):
+            gen=self._stream(p, msg, history, system)
+            try:
+                for text in gen:
+                    if cancel.is_set(): return
+                    events.put((p,"delta",text))
+                events.put((p,"end",None))
+            except Exception as e: events.put((p,"error",e))
+            finally: gen.close()
+        def launch():
+            nonlocal nxt, deadline
+            p=order[nxt]; nxt+=1; cancels[p]=threading.Event()
+            HEDGE_POOL.submit(run, p, cancels[p])
+            deadline=time.monotonic()+self._hedge_delay(p, "first_token")
+        try:
+            launch()
+            while True:
+                hedging=winner is None and nxt<len(order)
+                try: p,kind,val=events.get(timeout=max(0, deadline-time.monotonic()) if hedging else None)
+                except queue.Empty: launch(); continue
+                if winner is None:
+                    if kind=="error":
+                        failed+=1; last_err=val; logger.warning(f"{p} failed, hedging to next provider: {val}")
+                        if nxt<len(order): launch()
+                        elif failed==nxt: raise val
+                        continue
+                    winner=p
+                    for q,c in cancels.items():
+                        if q!=winner: c.set()
+                if p!=winner: continue
+                if kind=="delta": yield p,val
+                elif kind=="end": return
+                else: raise val
+        finally:
+            for c in cancels.values(): c.set()
+
+    def _reply(self, order, msg, history, system):
+        """
+        Blocking reply from the routed providers — hedged when enabled and more than one is
+        up, otherwise tried in order, moving on when a provider fails.
+        """
+        if HEDGE_ENABLED and len(order)>1: return self._hedged_complete(order, msg, list(history), system)
+        for i,p in enumerate(order):
+            try: return p, self._complete(p, msg, history, system)
+            except Exception as e:
+                if i==len(order)-1: raise
+                logger.warning(f"{p} failed, falling back: {e}")
+
+    def _reply_stream(self, order, msg, history, system):
+        """Streaming counterpart of _reply(); falls back only if a provider fails before its first token."""
+        if HEDGE_ENABLED and len(order)>1:
+            yield from self._hedged_stream(order, msg, list(history), system); return
+        for i,p in enumerate(order):
+            started=False
+            try:
+                for text in self._stream(p, msg, history, system):
+                    started=True; yield p,text
+                return
+            except Exception as e:
+                if started or i==len(order)-1: raise
+                logger.warning(f"{p} failed, falling back: {e}")
 
-            self.history.append({"role":"assistant","content":res})
-            return {"response":res,"model":mdl}
-        except Exception as e:
-            logger.error(traceback.format_exc())
-            return {"response":f"Error: {e}","model":"error"}
+    def chat(self, msg, model="auto", session_id=None):
+        sess=self.sessions.get(session_id)
+        with sess.lock:
+            try:
+                sess.append("user", msg)
+                order=self._route(model); cached=False
+                if order:
+                    cacheable,provider,res=self._cache_lookup(sess, msg, order)
+                    if res is not None: cached=True; mdl=MODEL_LABELS[provider]
+                    else:
+                        history,summary=sess.window(HISTORY_TOKEN_BUDGET[order[0]])
+                        provider,res=self._reply(order, msg, history, self._system(summary)); mdl=MODEL_LABELS[provider]
+                        if cacheable and res: self.cache.put(self.cache.key(msg, provider, self.PROMPT), res)
+                else:
+                    res,mdl=self._unavailable()
 
-    def elevenlabs_tts(self, text, voice_id="21m00Tcm4TlvDq8ikWAM"):
+                sess.append("assistant", res)
+                return {"response":res,"model":mdl,"cached":cached}
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                return {"response":f"Error: {e}","model":"error"}
+
+    def chat_stream(self, msg, model="auto", session_id=None):
+        """
+        Streaming variant of chat(). Yields {"type":"delta","text":...} events as tokens
+        arrive, then a final {"type":"done",...} event. The assistant turn is appended to
+        history once the stream ends (or with the partial text if the client disconnects).
+        """
+        sess=self.sessions.get(session_id)
+        with sess.lock:
+            sess.append("user", msg)
+            order=self._route(model)
+            if not order:
+                res,mdl=self._unavailable()
+                sess.append("assistant", res)
+                yield {"type":"done","response":res,"model":mdl}; return
+            parts=[]; mdl=MODEL_LABELS[order[0]]; provider=None
+            cacheable,hit_provider,hit=self._cache_lookup(sess, msg, order)
+            if hit is not None:
+                sess.append("assistant", hit)
+                yield {"type":"delta","text":hit}
+                yield {"type":"done","response":hit,"model":MODEL_LABELS[hit_provider],"cached":True}; return
+            history,summary=sess.window(HISTORY_TOKEN_BUDGET[order[0]])
+            stream=self._reply_stream(order, msg, history, self._system(summary))
+            try:
+                for provider,text in stream:
+                    mdl=MODEL_LABELS[provider]
+                    parts.append(text)
+                    yield {"type":"delta","text":text}
+                res="".join(parts)
+                if cacheable and res and provider: self.cache.put(self.cache.key(msg, provider, self.PROMPT), res)
+                yield {"type":"done","response":res,"model":mdl,"cached":False}
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                yield {"type":"error","response":f"Error: {e}","model":"error"}
+            finally:
+                stream.close()
+                if parts: sess.append("assistant", "".join(parts))
+
+    def elevenlabs_tts(self, text, voice_id=TTS_VOICE):
+        """→ (mp3 bytes | None, message). Served from TTS_CACHE when the same phrase was spoken before."""
+        key=TTS_CACHE.key(text, voice_id) if TTS_CACHE else None
+        hit=TTS_CACHE.get(key, len(text)) if key else None
+        if hit: return hit,"cached"
         if not ELEVEN_AVAILABLE: return None,"ElevenLabs not configured"
         try:
-            r=req.post(f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-                json={"text":text,"model_id":"eleven_monolingual_v1","voice_settings":{"stability":0.5,"similarity_boost":0.75}},
-                headers={"Accept":"audio/mpeg","Content-Type":"application/json","xi-api-key":ELEVEN_API_KEY},timeout=30)
-            if r.status_code==200: return base64.b64encode(r.content).decode(),"success"
+            r=HTTP.post(f"{ELEVEN_BASE_URL}/v1/text-to-speech/{voice_id}",
+                json={"text":text,"model_id":TTS_MODEL,"voice_settings":TTS_SETTINGS},
+                headers={"Accept":"audio/mpeg","Content-Type":"application/json","xi-api-key":ELEVEN_API_KEY},timeout=http_timeout(30))
+            if r.status_code==200:
+                if key: TTS_CACHE.put(key, r.content)
+                return r.content,"success"
             return None,f"ElevenLabs {r.status_code}: {r.text}"
         except Exception as e: return None,str(e)
 
-    def get_voices(self):
-        if not ELEVEN_AVAILABLE: return []
-        try:
-            r=req.get("https://api.elevenlabs.io/v1/voices",headers={"xi-api-key":ELEVEN_API_KEY},timeout=10)
-            return r.json().get("voices",[]) if r.status_code==200 else []
-        except: return []
-
-    def generate_image(self, prompt):
-        if not FAL_AVAILABLE: return None,"FAL not configured"
+    def get_voices(self, force=False):
+        """Cached ElevenLabs voice list (see VoiceCatalog); [] only if it was never fetched."""
+        return VOICES.get(force) or []
+
+    def generate_image(self, prompt, preset=None, size=None, steps=None, seed=None, num_images=1, cache=True):
+        """One upstream call for `num_images` variants; repeats of the same request come from IMG_CACHE."""
+        args=image_args(prompt, preset, size, steps, seed, num_images)
+        key=ImageCache.key(args) if IMG_CACHE else None
+        entry=IMG_CACHE.get(key) if key and cache else None
+        if entry:
+            urls=cached_image_urls(entry)
+            return {"success":True,"url":urls[0],"urls":urls,"seed":entry.get("seed"),"cached":True,"message":"success"}
+        if not FAL_AVAILABLE: return {"success":False,"url":None,"message":"FAL not configured"}
         try:
             import fal_client
-            res=fal_client.run("fal-ai/fast-sdxl",arguments={"prompt":prompt,"image_size":"landscape_4_3","num_inference_steps":28})
-            if res and res.get("images"): return res["images"][0]["url"],"success"
-            return None,"No image generated"
-        except Exception as e: return None,str(e)
+            res=fal_client.run(IMG_MODEL,arguments=args)
+        except Exception as e: return {"success":False,"url":None,"message":str(e)}
+        urls=[i["url"] for i in (res or {}).get("images",[]) if i.get("url")]
+        if not urls: return {"success":False,"url":None,"message":"No image generated"}
+        if key:
+            entry={"urls":urls,"seed":res.get("seed"),"args":args,"created":time.time()}
+            IMG_CACHE.put(key, entry)                     # URLs now, bytes once the download lands
+            if IMG_CACHE_DOWNLOAD: DISK_POOL.submit(_download_images, key, entry)
+        return {"success":True,"url":urls[0],"urls":urls,"seed":res.get("seed"),"cached":False,"message":"success"}
 
     # ============================================================
     # ✅ FIX 1: open_app — strips trailing punctuation from voice input
     # ============================================================
-    def open_app(self, name):
+    def open_app(self, name, cli=True):
         # Strip trailing punctuation (voice recognition adds "notepad." not "notepad")
+        # cli=False (chat-routed opens): only alias/GUI apps, never a bare PATH executable
         n = clean_name(name)
         logger.info(f"open_app: '{name}' → cleaned to: '{n}'")
+        fail = {"success": False, "message": f"❌ Could not open '{n}'. Make sure it is installed."}
+        if not n or APP_INDEX.known_miss(n):
+            return fail
 
         try:
-            if CURRENT_OS == "Windows":
-                builtin = {
-                    'notepad': 'notepad', 'calculator': 'calc', 'calc': 'calc',
-                    'paint': 'mspaint', 'ms paint': 'mspaint', 'wordpad': 'wordpad',
-                    'task manager': 'taskmgr', 'taskmgr': 'taskmgr',
-                    'control panel': 'control', 'command prompt': 'cmd', 'cmd': 'cmd',
-                    'powershell': 'powershell', 'file explorer': 'explorer',
-                    'explorer': 'explorer', 'snipping tool': 'SnippingTool',
-                    'registry editor': 'regedit', 'regedit': 'regedit',
-                    'device manager': 'devmgmt.msc', 'disk management': 'diskmgmt.msc',
-                    'character map': 'charmap', 'on screen keyboard': 'osk',
-                    'magnifier': 'magnify', 'sticky notes': 'StikyNot',
-                    'remote desktop': 'mstsc', 'resource monitor': 'resmon',
-                    'event viewer': 'eventvwr', 'services': 'services.msc',
-                }
-                settings_map = {
-                    'settings': 'ms-settings:', 'windows settings': 'ms-settings:',
-                    'wifi settings': 'ms-settings:network-wifi',
-                    'bluetooth settings': 'ms-settings:bluetooth',
-                    'display settings': 'ms-settings:display',
-                    'sound settings': 'ms-settings:sound',
-                }
-                installed = {
-                    'chrome': 'chrome', 'google chrome': 'chrome',
-                    'edge': 'msedge', 'microsoft edge': 'msedge',
-                    'firefox': 'firefox', 'brave': 'brave', 'opera': 'opera',
-                    'word': 'winword', 'microsoft word': 'winword',
-                    'excel': 'excel', 'microsoft excel': 'excel',
-                    'powerpoint': 'powerpnt', 'microsoft powerpoint': 'powerpnt',
-                    'outlook': 'outlook', 'onenote': 'onenote',
-                    'teams': 'teams', 'microsoft teams': 'teams',
-                    'notepad++': 'notepad++', 'vscode': 'code', 'vs code': 'code',
-                    'visual studio code': 'code', 'visual studio': 'devenv',
-                    'pycharm': 'pycharm64', 'android studio': 'studio64',
-                    'sublime': 'sublime_text', 'sublime text': 'sublime_text',
-                    'atom': 'atom', 'cursor': 'cursor', 'cursor ai': 'cursor',
-                    'postman': 'postman', 'git bash': 'git-bash',
-                    'windows terminal': 'wt', 'terminal': 'wt',
-                    'discord': 'discord', 'slack': 'slack', 'zoom': 'zoom',
-                    'skype': 'skype', 'whatsapp': 'whatsapp', 'telegram': 'telegram',
-                    'signal': 'signal', 'spotify': 'spotify', 'vlc': 'vlc',
-                    'vlc media player': 'vlc', 'obs': 'obs64', 'obs studio': 'obs64',
-                    'audacity': 'audacity', 'itunes': 'itunes',
-                    'media player': 'wmplayer', 'windows media player': 'wmplayer',
-                    'photoshop': 'photoshop', 'illustrator': 'illustrator',
-                    'premiere': 'premiere', 'premiere pro': 'premiere',
-                    'after effects': 'afterfx', 'lightroom': 'lightroom',
-                    'acrobat': 'acrobat', 'adobe acrobat': 'acrobat',
-                    'gimp': 'gimp-2.10', 'inkscape': 'inkscape', 'blender': 'blender',
-                    'steam': 'steam', 'epic games': 'epicgameslauncher',
-                    'epic': 'epicgameslauncher', 'origin': 'origin',
-                    '7zip': '7zfm', 'winrar': 'winrar', 'virtualbox': 'virtualbox',
-                    'anydesk': 'anydesk', 'teamviewer': 'teamviewer',
-                    'ccleaner': 'ccleaner', 'putty': 'putty', 'filezilla': 'filezilla',
-                }
-
-                # 1. Settings URIs
-                if n in settings_map:
-                    subprocess.Popen(f'start {settings_map[n]}', shell=True)
-                    return {"success": True, "message": f"✅ Opening {n}..."}
-
-                # 2. Built-in Windows commands
-                if n in builtin:
-                    subprocess.Popen(builtin[n], shell=True)
-                    return {"success": True, "message": f"✅ Opening {n}..."}
-
-                # 3. Known installed apps
-                if n in installed:
-                    subprocess.Popen(f'start "" {installed[n]}', shell=True)
-                    return {"success": True, "message": f"✅ Opening {n}..."}
-
-                # 4. Fuzzy match installed apps
-                for key, exe in installed.items():
-                    if key in n or n in key:
-                        subprocess.Popen(f'start "" {exe}', shell=True)
+            # 1. Alias tables + discovered apps (exact, then fuzzy)
+            hit = APP_INDEX.resolve(n, cli)
+            if hit:
+                match, kind, target, score = hit
+                logger.info(f"open_app: '{n}' → {match} ({kind}, score {score:.2f})")
+                try:
+                    if launch_app(kind, target):
                         return {"success": True, "message": f"✅ Opening {n}..."}
+                except OSError as e:
+                    logger.warning(f"open_app: launching {match} failed: {e}")
 
-                # 5. Windows 'start' command — searches App Paths registry (best general fallback)
-                r1 = subprocess.run(f'start "" {n}', shell=True, capture_output=True, timeout=5)
-                if r1.returncode == 0:
-                    return {"success": True, "message": f"✅ Opening {n}..."}
-
-                # 6. Try with .exe suffix
-                r2 = subprocess.run(f'start "" {n}.exe', shell=True, capture_output=True, timeout=5)
-                if r2.returncode == 0:
+            # 2. Names the index does not know — ask the OS directly, once
+            if not cli: return fail
+            if CURRENT_OS == "Windows":
+                if not re.fullmatch(r"[\w .+-]+", n): APP_INDEX.remember_miss(n); return fail   # goes through cmd.exe
+                for cmd in (f'start "" "{n}"', f'start "" "{n}.exe"'):
+                    try:
+                        if subprocess.run(cmd, shell=True, capture_output=True, timeout=5).returncode == 0:
+                            return {"success": True, "message": f"✅ Opening {n}..."}
+                    except subprocess.TimeoutExpired: pass
+            elif CURRENT_OS == "Darwin":
+                if not hit and subprocess.run(['open', '-a', name], capture_output=True, text=True).returncode == 0:
                     return {"success": True, "message": f"✅ Opening {n}..."}
-
-                # 7. PowerShell Start-Process as last resort
-                ps = subprocess.run(
-                    ['powershell', '-WindowStyle', 'Hidden', '-Command', f'Start-Process "{n}"'],
-                    capture_output=True, text=True, timeout=5)
-                if ps.returncode == 0:
+            else:
+                try:
+                    subprocess.Popen([n], start_new_session=True)
                     return {"success": True, "message": f"✅ Opening {n}..."}
+                except OSError: pass
 
-                return {"success": False, "message": f"❌ Could not open '{n}'. Make sure it is installed."}
-
-            elif CURRENT_OS == "Darwin":
-                mac = {
-                    'chrome': 'Google Chrome', 'safari': 'Safari', 'firefox': 'Firefox',
-                    'vscode': 'Visual Studio Code', 'vs code': 'Visual Studio Code',
-                    'terminal': 'Terminal', 'finder': 'Finder', 'spotify': 'Spotify',
-                    'discord': 'Discord', 'slack': 'Slack', 'zoom': 'zoom.us',
-                    'notes': 'Notes', 'music': 'Music', 'photos': 'Photos',
-                    'mail': 'Mail', 'calendar': 'Calendar',
-                }
-                app_name = mac.get(n, name)
-                r = subprocess.run(['open', '-a', app_name], capture_output=True, text=True)
-                if r.returncode == 0:
-                    return {"success": True, "message": f"✅ Opening {n}..."}
-                return {"success": False, "message": f"❌ App not found: {n}"}
-
-            else:  # Linux
-                linux = {
-                    'chrome': 'google-chrome', 'firefox': 'firefox',
-                    'terminal': 'gnome-terminal', 'vscode': 'code', 'vs code': 'code',
-                    'vlc': 'vlc', 'gimp': 'gimp', 'calculator': 'gnome-calculator',
-                }
-                subprocess.Popen([linux.get(n, n)])
-                return {"success": True, "message": f"✅ Opening {n}..."}
+            APP_INDEX.remember_miss(n)
+            return fail
 
         except Exception as e:
             logger.error(traceback.format_exc())
             return {"success": False, "message": f"❌ Could not open '{n}': {str(e)}"}
 
     def open_site(self, url):
-        s={'google':'https://www.google.com','youtube':'https://www.youtube.com',
-            'facebook':'https://www.facebook.com','twitter':'https://www.twitter.com',
-            'x':'https://www.x.com','instagram':'https://www.instagram.com',
-            'reddit':'https://www.reddit.com','linkedin':'https://www.linkedin.com',
-            'github':'https://www.github.com','stackoverflow':'https://stackoverflow.com',
-            'amazon':'https://www.amazon.com','flipkart':'https://www.flipkart.com',
-            'netflix':'https://www.netflix.com','hotstar':'https://www.hotstar.com',
-            'wikipedia':'https://www.wikipedia.org','gmail':'https://mail.google.com',
-            'outlook':'https://outlook.com','chatgpt':'https://chat.openai.com',
-            'claude':'https://claude.ai','gemini':'https://gemini.google.com',
-            'bing':'https://www.bing.com','maps':'https://maps.google.com',
-            'translate':'https://translate.google.com','drive':'https://drive.google.com',
-            'docs':'https://docs.google.com','sheets':'https://sheets.google.com',
-            'meet':'https://meet.google.com','whatsapp':'https://web.whatsapp.com',
-            'telegram':'https://web.telegram.org','discord':'https://discord.com/app',
-            'spotify':'https://open.spotify.com','twitch':'https://www.twitch.tv',
-            'tiktok':'https://www.tiktok.com','notion':'https://www.notion.so',
-            'canva':'https://www.canva.com','figma':'https://www.figma.com',
-            'codepen':'https://codepen.io','replit':'https://replit.com'}
         u = clean_name(url)
-        if u in s: final=s[u]
+        if u in SITE_ALIASES: final=SITE_ALIASES[u]
         elif not u.startswith(('http://','https://')): final=('https://www.'+u+'.com') if '.' not in u else 'https://'+u
         else: final=u
         webbrowser.open(final)
@@ -356,131 +2377,98 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
             webbrowser.open(url)
         return {"success": True, "message": f"✅ Searching {engine} for: {q}", "url": url}
 
-    def screenshot(self):
+    def screenshot(self, region=None, monitor=None, scale=None, max_dim=None, fmt=None, quality=None, thumb=None):
+        """
+        Grab, then encode once in `fmt` (png/jpeg/webp) and write on the disk pool while
+        the request returns. The response carries media URLs: `url` for the encoded image
+        (ready once the encode finishes) and `thumbnail_url` for a JPEG preview of at most
+        `thumb` px (0 = none).
+        """
         desktop = os.path.join(os.path.expanduser("~"), "Desktop")
         if not os.path.isdir(desktop):
             desktop = os.path.expanduser("~")
         ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-        fn = f"elsa_screenshot_{ts}.png"
-        save_path = os.path.join(desktop, fn)
         try:
-            if PIL_AVAILABLE:
-                from PIL import ImageGrab
-                ss = ImageGrab.grab()
-                ss.save(save_path)
-                buf = BytesIO(); ss.save(buf, format="PNG")
-                img_b64 = base64.b64encode(buf.getvalue()).decode()
-                return {"success": True, "message": f"✅ Screenshot saved to Desktop: {fn}", "image": img_b64, "filename": fn}
-            elif PYAUTOGUI_AVAILABLE:
-                ss = pyautogui.screenshot()
-                ss.save(save_path)
-                buf = BytesIO(); ss.save(buf, format="PNG")
-                img_b64 = base64.b64encode(buf.getvalue()).decode()
-                return {"success": True, "message": f"✅ Screenshot saved: {fn}", "image": img_b64, "filename": fn}
-            else:
+            if not (PIL_AVAILABLE or PYAUTOGUI_AVAILABLE):
                 return {"success": False, "message": "❌ Install Pillow: pip install pillow"}
+            ss = grab_image(*capture_box(region, monitor))
+            size = scaled_size(*ss.size, scale, max_dim)
+            if size != ss.size:
+                ss = ss.resize(size, Image.BILINEAR, reducing_gap=2.0)
+            fmt = fmt if str(fmt).lower() in IMAGE_FORMATS else SHOT_FORMAT
+            _, mime, ext = IMAGE_FORMATS[fmt.lower()]
+            fn = f"elsa_screenshot_{ts}{ext}"
+            key = MEDIA.put_pending(save_image_async(ss, os.path.join(desktop, fn), fmt, quality or SHOT_QUALITY), mime)
+            res = {"success": True, "message": f"✅ Screenshot saved to Desktop: {fn}", "filename": fn,
+                   "width": ss.size[0], "height": ss.size[1], "format": mime, "url": media_url(key)}
+            thumb = SHOT_THUMB if thumb is None else int(thumb)
+            if thumb > 0:
+                pv = ss.resize(scaled_size(*ss.size, None, thumb), Image.BILINEAR, reducing_gap=1.0)
+                res["thumbnail_url"] = media_url(MEDIA.put(encode_image(pv, "jpeg", 80)[0], "image/jpeg"))
+            return res
+        except ValueError as e:
+            return {"success": False, "message": f"❌ {e}"}
         except Exception as e:
             return {"success": False, "message": f"❌ Screenshot error: {str(e)}"}
 
     # ============================================================
     # ✅ FIX 2: SCREEN RECORDING — fully working implementation
     # ============================================================
-    def start_recording(self):
-        """Start screen recording with multiple methods."""
+    def start_recording(self, fps=None, resolution=None, codec=None, region=None, monitor=None, scale=None, max_dim=None,
+                        segment=None, concat=None):
+        """
+        Start screen recording with multiple methods. fps/resolution/codec and the capture
+        options (region/monitor/scale/max_dim) apply to the OpenCV pipeline; an explicit
+        resolution wins over scale/max_dim. `segment` seconds > 0 writes a folder of
+        segments (see ScreenRecorder); `concat` joins them once the recording stops.
+        """
         if RECORDING_STATE["active"]:
             return {"success": False, "message": "⚠️ Already recording! Say 'stop recording' first."}
+        # Bad options are the caller's error, not a reason to fall back to another method
+        try:
+            box, all_screens = capture_box(region, monitor)
+            o = recording_opts({"fps": fps, "resolution": resolution, "codec": codec, "segment": segment})
+        except ValueError as e: return {"success": False, "message": f"❌ {e}"}
+        fps, resolution, codec, segment = o["fps"], o["resolution"], o["codec"], o["segment"]
 
         desktop = os.path.join(os.path.expanduser("~"), "Desktop")
         if not os.path.isdir(desktop):
             desktop = os.path.expanduser("~")
         ts = datetime.now().strftime('%Y%m%d_%H%M%S')
 
-        # ── Method 1: OpenCV + Pillow (best quality, saves .avi to Desktop) ──
-        if OPENCV_AVAILABLE and PIL_AVAILABLE:
+        # ── Method 1: OpenCV pipeline (mss / Pillow / PyAutoGUI grab) ────────
+        grab, pixel_format, backend = screen_grabber(box=box, all_screens=all_screens) if OPENCV_AVAILABLE else (None, None, None)
+        if grab:
             try:
-                from PIL import ImageGrab
-                import numpy as np
-                test_frame = ImageGrab.grab()
-                w, h = test_frame.size
-                save_path = os.path.join(desktop, f"elsa_recording_{ts}.avi")
-                fourcc = cv2.VideoWriter_fourcc(*'XVID')
-                writer = cv2.VideoWriter(save_path, fourcc, 10.0, (w, h))
-                if not writer.isOpened():
-                    raise RuntimeError("VideoWriter could not be opened")
-
-                stop_event = threading.Event()
-                RECORDING_STATE.update({
-                    "active": True, "file": save_path,
-                    "start_time": datetime.now().isoformat(),
-                    "stop_event": stop_event, "process": None
-                })
+                method = f"opencv+{backend}"
+                codec = (codec or REC_CODEC).upper()
+                segment = REC_SEGMENT_SECS if segment is None else segment
+                save_path = os.path.join(desktop, f"elsa_recording_{ts}" + ("" if segment > 0 else CODEC_EXT.get(codec, '.avi')))
 
-                def _record_loop():
-                    try:
-                        while not stop_event.is_set():
-                            frame = ImageGrab.grab()
-                            frame_bgr = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-                            writer.write(frame_bgr)
-                            time.sleep(0.1)
-                    except Exception as ex:
-                        logger.error(f"Recording error: {ex}")
-                    finally:
-                        writer.release()
+                def _finished(rec):
+                    if RECORDING_STATE.get("recorder") is rec:
                         RECORDING_STATE["active"] = False
-                        logger.info(f"Recording saved: {save_path}")
 
-                t = threading.Thread(target=_record_loop, daemon=True)
-                RECORDING_STATE["thread"] = t
-                t.start()
-                fn = os.path.basename(save_path)
-                return {
-                    "success": True, "recording": True,
-                    "message": f"🔴 Recording started! Saving to Desktop: {fn}",
-                    "file": save_path, "method": "opencv+pillow"
-                }
-            except Exception as e:
-                RECORDING_STATE["active"] = False
-                logger.warning(f"OpenCV+PIL recording failed: {e}, trying next method...")
-
-        # ── Method 1b: OpenCV + PyAutoGUI ────────────────────────────────────
-        if OPENCV_AVAILABLE and PYAUTOGUI_AVAILABLE and not PIL_AVAILABLE:
-            try:
-                import numpy as np
-                test_frame = pyautogui.screenshot()
-                w, h = test_frame.size
-                save_path = os.path.join(desktop, f"elsa_recording_{ts}.avi")
-                fourcc = cv2.VideoWriter_fourcc(*'XVID')
-                writer = cv2.VideoWriter(save_path, fourcc, 10.0, (w, h))
-                stop_event = threading.Event()
+                rec = ScreenRecorder(save_path, grab, fps=fps or REC_FPS, size=parse_size(resolution),
+                                     codec=codec, on_finish=_finished, pixel_format=pixel_format, scale=scale, max_dim=max_dim,
+                                     segment_secs=max(segment, 0))
+                rec.concat = REC_CONCAT if concat is None else str(concat).lower() in ("1", "true", "yes")
                 RECORDING_STATE.update({
-                    "active": True, "file": save_path,
-                    "start_time": datetime.now().isoformat(),
-                    "stop_event": stop_event, "process": None
+                    "active": True, "file": save_path, "recorder": rec,
+                    "start_time": datetime.now().isoformat(), "process": None
                 })
-
-                def _record_loop2():
-                    try:
-                        while not stop_event.is_set():
-                            frame = pyautogui.screenshot()
-                            frame_bgr = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-                            writer.write(frame_bgr)
-                            time.sleep(0.1)
-                    finally:
-                        writer.release()
-                        RECORDING_STATE["active"] = False
-
-                t = threading.Thread(target=_record_loop2, daemon=True)
-                RECORDING_STATE["thread"] = t
-                t.start()
+                rec.start()
                 fn = os.path.basename(save_path)
                 return {
                     "success": True, "recording": True,
                     "message": f"🔴 Recording started! Saving to Desktop: {fn}",
-                    "file": save_path, "method": "opencv+pyautogui"
+                    "file": save_path, "method": method,
+                    "fps": rec.fps, "resolution": list(rec.size), "codec": codec, "region": box,
+                    "segment_secs": segment if segment > 0 else None, "manifest": rec.manifest_path
                 }
             except Exception as e:
-                RECORDING_STATE["active"] = False
-                logger.warning(f"OpenCV+PyAutoGUI recording failed: {e}")
+                RECORDING_STATE.update({"active": False, "recorder": None})
+                logger.warning(f"OpenCV recording failed: {e}, trying next method...")
 
         # ── Method 2: Windows Game Bar via PyAutoGUI hotkey ──────────────────
         if CURRENT_OS == "Windows" and PYAUTOGUI_AVAILABLE:
@@ -488,8 +2476,7 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
                 pyautogui.hotkey('win', 'alt', 'r')   # ✅ just call it, don't check return
                 RECORDING_STATE.update({
                     "active": True, "file": "Videos/Captures folder",
-                    "start_time": datetime.now().isoformat(),
-                    "stop_event": None, "process": None
+                    "start_time": datetime.now().isoformat(), "process": None
                 })
                 return {
                     "success": True, "recording": True,
@@ -518,7 +2505,7 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
                 proc = subprocess.Popen(['screencapture', '-v', save_path])
                 RECORDING_STATE.update({
                     "active": True, "process": proc, "file": save_path,
-                    "start_time": datetime.now().isoformat(), "stop_event": None
+                    "start_time": datetime.now().isoformat()
                 })
                 return {
                     "success": True, "recording": True,
@@ -540,18 +2527,22 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
 
         saved_file = RECORDING_STATE.get("file", "unknown")
 
-        # Stop software recording thread (OpenCV)
-        stop_event = RECORDING_STATE.get("stop_event")
-        if stop_event and not stop_event.is_set():
-            stop_event.set()
-            t = RECORDING_STATE.get("thread")
-            if t:
-                t.join(timeout=5)
-            RECORDING_STATE.update({"active": False, "stop_event": None, "thread": None})
-            return {
-                "success": True, "recording": False,
+        # Stop the OpenCV pipeline and wait for the encoder to flush
+        rec = RECORDING_STATE.get("recorder")
+        if rec:
+            finalised = rec.stop(timeout=10)
+            RECORDING_STATE.update({"active": False, "recorder": None})
+            res = {
+                "success": True, "recording": False, "finalised": finalised, "stats": rec.stats(),
                 "message": f"⏹️ Recording stopped! Saved to Desktop: {os.path.basename(saved_file)}"
             }
+            if rec.segment_frames:
+                res.update({"manifest": rec.manifest_path, "segments": [sg["file"] for sg in rec.segments]})
+                if rec.concat and finalised and rec.segments:
+                    # Stream-copy joins are quick, re-encodes are not — either way don't hold the request
+                    threading.Thread(target=concat_segments, args=(saved_file,), daemon=True, name="rec-concat").start()
+                    res["concat"] = os.path.basename(saved_file) + os.path.splitext(rec.segments[0]["file"])[1]
+            return res
 
         # Stop macOS screencapture
         proc = RECORDING_STATE.get("process")
@@ -585,15 +2576,65 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
             "recording": RECORDING_STATE["active"],
             "file": RECORDING_STATE.get("file"),
             "duration": duration,
+            "stats": RECORDING_STATE["recorder"].stats() if RECORDING_STATE.get("recorder") else None,
+            "replay": RECORDING_STATE["replay"].stats() if RECORDING_STATE.get("replay") else None,
             "capabilities": {
                 "opencv": OPENCV_AVAILABLE,
                 "pil": PIL_AVAILABLE,
                 "pyautogui": PYAUTOGUI_AVAILABLE,
+                "mss": MSS_AVAILABLE,
                 "ready": OPENCV_AVAILABLE and (PIL_AVAILABLE or PYAUTOGUI_AVAILABLE),
                 "install_hint": None if OPENCV_AVAILABLE else "pip install opencv-python pillow"
             }
         }
 
+    def replay_start(self, seconds=None, fps=None, budget_mb=None, quality=None, region=None, monitor=None, scale=None, max_dim=None):
+        """Start the instant-replay ring (see ReplayBuffer); capture options work as for recording."""
+        rb = RECORDING_STATE.get("replay")
+        if rb and rb.running:
+            return {"success": False, "message": "⚠️ Instant replay is already running.", "replay": rb.stats()}
+        try: box, all_screens = capture_box(region, monitor)
+        except ValueError as e: return {"success": False, "message": f"❌ {e}"}
+        grab, pixel_format, backend = screen_grabber(box=box, all_screens=all_screens) if OPENCV_AVAILABLE else (None, None, None)
+        if not grab:
+            return {"success": False, "message": "❌ Instant replay needs OpenCV: pip install opencv-python pillow"}
+        try:
+            rb = ReplayBuffer(grab, pixel_format, seconds=float(seconds or REPLAY_SECS), fps=float(fps or REPLAY_FPS),
+                              budget=int(float(budget_mb or REPLAY_BUDGET_MB)*2**20), quality=int(quality or REPLAY_QUALITY),
+                              scale=scale, max_dim=REPLAY_MAX_DIM if max_dim is None else max_dim)
+        except (TypeError, ValueError) as e:
+            return {"success": False, "message": f"❌ Invalid replay option: {e}"}
+        RECORDING_STATE["replay"] = rb.start()
+        return {"success": True, "message": f"⏺️ Instant replay on — keeping the last {rb.seconds:g}s ({backend}).",
+                "replay": rb.stats()}
+
+    def replay_stop(self):
+        rb = RECORDING_STATE.get("replay")
+        if not rb or not rb.running:
+            return {"success": False, "message": "⚠️ Instant replay is not running."}
+        rb.stop(); RECORDING_STATE["replay"] = None
+        return {"success": True, "message": "⏹️ Instant replay off."}
+
+    def save_replay(self, seconds=None, codec=None):
+        """Dump the last `seconds` (default: the whole window) held by the replay ring to the Desktop."""
+        rb = RECORDING_STATE.get("replay")
+        if not rb or not rb.running:
+            return {"success": False, "message": "⚠️ Instant replay is off. Say 'start instant replay' first."}
+        desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+        if not os.path.isdir(desktop):
+            desktop = os.path.expanduser("~")
+        codec = (codec or REC_CODEC).upper()
+        fn = f"elsa_replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}{CODEC_EXT.get(codec, '.avi')}"
+        save_path = os.path.join(desktop, fn)
+        try:
+            n = rb.save(save_path, seconds, codec)
+        except Exception as e:
+            return {"success": False, "message": f"❌ Replay save failed: {e}"}
+        if not n:
+            return {"success": False, "message": "⚠️ Nothing captured yet."}
+        return {"success": True, "message": f"💾 Saved the last {n / rb.fps:.0f}s to Desktop: {fn}",
+                "file": save_path, "frames": n, "duration": round(n / rb.fps, 2)}
+
     # ============================================================
     # KEYBOARD, MOUSE, CLIPBOARD, SYSTEM EXTRAS
     # ============================================================
@@ -612,25 +2653,13 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
             return {"success": False, "message": "❌ Install: pip install pyautogui"}
         try:
             k = clean_name(key)
-            key_map = {
-                'enter':'enter','return':'enter','escape':'esc','esc':'esc',
-                'space':'space','tab':'tab','backspace':'backspace',
-                'up':'up','down':'down','left':'left','right':'right',
-                'volume up':'volumeup','volume down':'volumedown','mute':'volumemute',
-                'play':'playpause','play pause':'playpause','pause':'playpause',
-                'next track':'nexttrack','previous track':'prevtrack','prev track':'prevtrack',
-                'print screen':'printscreen','home':'home','end':'end',
-                'page up':'pageup','page down':'pagedown','delete':'delete',
-                'f1':'f1','f2':'f2','f3':'f3','f4':'f4','f5':'f5',
-                'f6':'f6','f7':'f7','f8':'f8','f9':'f9','f10':'f10','f11':'f11','f12':'f12',
-            }
             if k == 'alt f4':
                 pyautogui.hotkey('alt', 'f4')
             elif '+' in k:
                 parts = [p.strip() for p in k.split('+')]
                 pyautogui.hotkey(*parts)
             else:
-                pyautogui.press(key_map.get(k, k))
+                pyautogui.press(KEY_ALIASES.get(k, k))
             return {"success": True, "message": f"✅ Pressed: {key}"}
         except Exception as e:
             return {"success": False, "message": f"❌ Key error: {e}"}
@@ -694,16 +2723,7 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
 
     def open_folder(self, path):
         try:
-            path_map = {
-                'desktop': os.path.join(os.path.expanduser("~"), "Desktop"),
-                'documents': os.path.join(os.path.expanduser("~"), "Documents"),
-                'downloads': os.path.join(os.path.expanduser("~"), "Downloads"),
-                'pictures': os.path.join(os.path.expanduser("~"), "Pictures"),
-                'music': os.path.join(os.path.expanduser("~"), "Music"),
-                'videos': os.path.join(os.path.expanduser("~"), "Videos"),
-                'home': os.path.expanduser("~"),
-            }
-            resolved = path_map.get(clean_name(path), path)
+            resolved = FOLDER_PATHS.get(clean_name(path), path)
             if CURRENT_OS == "Windows":
                 subprocess.Popen(f'explorer "{resolved}"', shell=True)
             elif CURRENT_OS == "Darwin":
@@ -718,13 +2738,18 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
         if not PSUTIL_AVAILABLE:
             return {"success": False, "message": "pip install psutil"}
         try:
-            b = psutil.sensors_battery()
+            snap = METRICS.latest()
+            if snap and "battery" in snap:
+                b = snap["battery"]
+            else:
+                raw = psutil.sensors_battery()
+                b = raw and {"percent": raw.percent, "plugged": raw.power_plugged, "secsleft": raw.secsleft}
             if b is None:
                 return {"success": True, "message": "No battery (desktop PC)", "has_battery": False}
-            time_str = "Charging" if b.secsleft == psutil.POWER_TIME_UNLIMITED else f"{int(b.secsleft//60)} min"
-            return {"success": True, "has_battery": True, "percent": round(b.percent, 1),
-                    "plugged": b.power_plugged, "time_left": time_str,
-                    "message": f"🔋 {round(b.percent)}% {'🔌 Charging' if b.power_plugged else f'| {time_str} left'}"}
+            time_str = "Charging" if b["secsleft"] == psutil.POWER_TIME_UNLIMITED else f"{int(b['secsleft']//60)} min"
+            return {"success": True, "has_battery": True, "percent": round(b["percent"], 1),
+                    "plugged": b["plugged"], "time_left": time_str,
+                    "message": f"🔋 {round(b['percent'])}% {'🔌 Charging' if b['plugged'] else f'| {time_str} left'}"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
@@ -766,19 +2791,16 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
         except Exception as e:
             return {"success": False, "message": str(e)}
 
-    def sys_info(self):
-        info={"os":CURRENT_OS,"os_version":platform.version(),"machine":platform.machine(),
-              "processor":platform.processor(),"hostname":platform.node(),
-              "python":platform.python_version(),"time":datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    def sys_info(self, window=None):
+        """Static host info + the sampler's latest snapshot; `window` (seconds) adds a time series."""
+        info={**STATIC_SYS_INFO,"time":datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
         if PSUTIL_AVAILABLE:
-            info["cpu_usage"]=psutil.cpu_percent(interval=0.5); info["cpu_cores"]=psutil.cpu_count()
-            m=psutil.virtual_memory()
-            info.update({"memory_total":round(m.total/(1024**3),2),"memory_used":round(m.used/(1024**3),2),"memory_percent":m.percent})
-            try:
-                d=psutil.disk_usage('/')
-                info.update({"disk_total":round(d.total/(1024**3),2),"disk_used":round(d.used/(1024**3),2),"disk_percent":d.percent})
-            except: pass
-        return {"success":True,"info":info}
+            info["cpu_cores"]=STATIC_SYS_INFO["cpu_cores"]
+            snap=METRICS.latest()
+            if snap: info.update({k:v for k,v in snap.items() if k not in ("ts","battery")}); info["sampled_at"]=snap["ts"]
+        out={"success":True,"info":info}
+        if window: out["series"]=METRICS.window(float(window))
+        return out
 
     def running_apps(self):
         if not PSUTIL_AVAILABLE: return {"success":False,"message":"pip install psutil"}
@@ -810,18 +2832,337 @@ Respond helpfully, accurately, with personality. Be conversational but smart."""
             return {"success":True,"message":"✅ Screen locked!"}
         except Exception as e: return {"success":False,"message":str(e)}
 
-    def speak(self, text):
-        if PYTTSX3_AVAILABLE:
-            def _s():
-                try: TTS_ENGINE.say(text); TTS_ENGINE.runAndWait()
-                except: pass
-            threading.Thread(target=_s, daemon=True).start()
+    def speak(self, text, priority=TTS_NORMAL, key=None, interrupt=False, render=False):
+        """Queue `text` on the local TTS worker; `render` waits and returns the audio as a media URL instead of playing it."""
+        if not PYTTSX3_AVAILABLE: return {"success": False, "message": "❌ Install pyttsx3: pip install pyttsx3"}
+        if not text: return {"success": False, "message": "No text"}
+        u = LOCAL_TTS.say(text, priority, key, interrupt, render)
+        if not render:
+            return {"success": u.status != "dropped", "status": u.status, "queued": LOCAL_TTS.stats()["queued"]}
+        if not u.done.wait(30) or not u.audio:
+            return {"success": False, "status": u.status, "message": u.error or "Local TTS render timed out"}
+        return {"success": True, "status": u.status, "audio_url": media_url(MEDIA.put(*u.audio))}
+
+    def stop_speaking(self):
+        LOCAL_TTS.interrupt(TTS_URGENT)
+        return {"success": True, "message": "🔇 Stopped speaking."}
 
-    def clear(self):
-        self.history=[]; return {"success":True,"message":"✅ History cleared!"}
+    def clear(self, session_id=None):
+        self.sessions.drop(session_id); return {"success":True,"message":"✅ History cleared!"}
 
 
 elsa = ElsaEngine()
+if REPLAY_AUTOSTART: logger.info(elsa.replay_start()["message"])
+if TTS_PREWARM and TTS_CACHE and ELEVEN_AVAILABLE:
+    threading.Thread(target=prewarm_tts, daemon=True, name="tts-prewarm").start()
+if ELEVEN_AVAILABLE and VOICES.stale(): VOICES.refresh_async()   # picker opens warm
+
+# ============================================================
+# COMMAND TABLE — /api/command actions, also the dispatch target of the intent router
+# ============================================================
+COMMANDS = {
+    'open_app':         lambda p: elsa.open_app(p.get('name',''), cli=not p.get('routed')),
+    'open_website':     lambda p: elsa.open_site(p.get('url','')),
+    'play_youtube':     lambda p: elsa.play_yt(p.get('query','')),
+    'search_google':    lambda p: elsa.search('google', p.get('query','')),
+    'search_wikipedia': lambda p: elsa.search('wikipedia', p.get('query','')),
+    'search_edge':      lambda p: elsa.search('edge', p.get('query','')),
+    'search_chrome':    lambda p: elsa.search('chrome', p.get('query','')),
+    'open_chatgpt':     lambda p: elsa.search('chatgpt', p.get('prompt','')),
+    'open_claude':      lambda p: elsa.search('claude', ''),
+    'screenshot':       lambda p: elsa.screenshot(**capture_opts(p), **shot_opts(p)),
+    # ✅ FIXED recording
+    'start_recording':  lambda p: elsa.start_recording(**capture_opts(p), **recording_opts(p)),
+    'stop_recording':   lambda p: elsa.stop_recording(),
+    'recording_status': lambda p: elsa.recording_status(),
+    'replay_start':     lambda p: elsa.replay_start(**replay_opts(p), **capture_opts(p)),
+    'replay_stop':      lambda p: elsa.replay_stop(),
+    'save_replay':      lambda p: elsa.save_replay(p.get('seconds'), p.get('codec')),
+    'speak':            lambda p: elsa.speak(p.get('text',''), tts_priority(p.get('priority')), p.get('key'),
+                                             bool(p.get('interrupt')), bool(p.get('render'))),
+    'stop_speaking':    lambda p: elsa.stop_speaking(),
+    # Keyboard & Mouse
+    'type_text':        lambda p: elsa.type_text(p.get('text','')),
+    'press_key':        lambda p: elsa.press_key(p.get('key','')),
+    'click_mouse':      lambda p: elsa.click_mouse(p.get('x'), p.get('y'), p.get('button','left')),
+    'move_mouse':       lambda p: elsa.move_mouse(p.get('x',0), p.get('y',0)),
+    'scroll':           lambda p: elsa.scroll(p.get('direction','down'), p.get('amount',3)),
+    # Clipboard
+    'clipboard_set':    lambda p: elsa.clipboard_set(p.get('text','')),
+    'clipboard_get':    lambda p: elsa.clipboard_get(),
+    # System
+    'system_info':      lambda p: elsa.sys_info(),
+    'running_apps':     lambda p: elsa.running_apps(),
+    'battery_info':     lambda p: elsa.battery_info(),
+    'wifi_info':        lambda p: elsa.wifi_info(),
+    'open_folder':      lambda p: elsa.open_folder(p.get('path','desktop')),
+    'kill_process':     lambda p: elsa.kill_process(p.get('name','')),
+    'shutdown':         lambda p: elsa.power('shutdown', p.get('delay',5)),
+    'restart':          lambda p: elsa.power('restart', p.get('delay',5)),
+    'sleep':            lambda p: elsa.power('sleep'),
+    'confirm_power':    lambda p: confirm_power(p),
+    'confirm_kill':     lambda p: confirm_kill(p),
+    'cancel_shutdown':  lambda p: elsa.power('cancel'),
+    'lock_screen':      lambda p: elsa.lock(),
+    'clear_history':    lambda p: elsa.clear(p.get('session_id')),
+    'get_time':         lambda p: {"success":True,
+                                   "time":datetime.now().strftime("%I:%M %p"),
+                                   "date":datetime.now().strftime("%A, %B %d, %Y")},
+}
+
+
+# ============================================================
+# LOCAL INTENT ROUTER — device commands in /api/chat skip the LLM
+# ============================================================
+INTENT_FASTPATH = os.getenv("ELSA_INTENT_FASTPATH", "1").lower() in ("1","true","yes")
+
+APP_ALIASES = set(WIN_BUILTIN_APPS)|set(WIN_SETTINGS_URIS)|set(WIN_INSTALLED_APPS) if CURRENT_OS=="Windows" else \
+              set(MAC_APPS) if CURRENT_OS=="Darwin" else set(LINUX_APPS)
+MEDIA_KEYS = ('volume up','volume down','mute','next track','previous track','prev track','play pause','pause')
+# Actions that take no parameters and are safe to trigger by simply saying their name
+PARAMLESS_ACTIONS = ('screenshot','start_recording','stop_recording','recording_status','clipboard_get','save_replay',
+                     'system_info','running_apps','battery_info','wifi_info','lock_screen','clear_history',
+                     'get_time','open_claude','cancel_shutdown')
+
+def _open_target(m):
+    """Only alias/GUI apps we can resolve; "start a story…", "open ai" and bare PATH tools ("run reboot") stay chat."""
+    verb=m["verb"].lower(); t=clean_name(m["target"])
+    if t in APP_ALIASES: return "open_app",{"name":t}
+    if verb in ("start","run"):         # everyday verbs: an exact app name or nothing
+        hit=APP_INDEX.resolve(t)
+        return ("open_app",{"name":t}) if hit and hit[3]>=1.0 else None
+    if t in FOLDER_PATHS: return "open_folder",{"path":t}
+    if t in SITE_ALIASES or re.search(r"\.[a-z]{2,}$", t): return "open_website",{"url":t}
+    return ("open_app",{"name":t}) if APP_INDEX.resolve(t) else None
+
+def _search(m):
+    engine=(m.groupdict().get("engine") or "google").lower()
+    if engine=="youtube": return "play_youtube",{"query":m["query"]}
+    return {"wikipedia":"search_wikipedia","edge":"search_edge","bing":"search_edge",
+            "chrome":"search_chrome"}.get(engine,"search_google"),{"query":m["query"]}
+
+def _press(m):
+    k=clean_name(m["key"])
+    if k in KEY_ALIASES or '+' in k or re.fullmatch(r"[a-z0-9]", k): return "press_key",{"key":k}
+    return None
+
+# (trigger words, anchored pattern, action name or resolver(match) -> (action, params) | None)
+# Order matters: earlier rules win, so specific phrasings sit above the generic "open X".
+INTENT_RULES = [
+    (("stop","quiet","shut","silence"), r"(?:stop (?:talking|speaking)|be quiet|shut up|silence)", "stop_speaking"),
+    (("replay",), r"(?:start|turn on|enable|begin)(?: the)? instant replay", "replay_start"),
+    (("replay",), r"(?:stop|turn off|disable|end)(?: the)? instant replay", "replay_stop"),
+    (("save","clip","replay"), r"(?:save|clip|keep)(?: the)? (?:last|past) (?P<n>\d+) ?(?P<unit>s|sec|secs|seconds?|m|min|mins|minutes?)(?: of (?:the )?(?:screen|recording|replay))?",
+        lambda m: ("save_replay",{"seconds":int(m["n"])*(60 if m["unit"].startswith("m") else 1)})),
+    (("save","clip","replay"), r"(?:save|clip)(?: that| the replay| replay| instant replay)|instant replay", "save_replay"),
+    (("record","recording"), r"(?:start|begin)(?: the| a)?(?: screen)? record(?:ing)?(?: (?:the|my) screen)?", "start_recording"),
+    (("record","recording"), r"(?:stop|end|finish)(?: the)?(?: screen)? record(?:ing)?", "stop_recording"),
+    (("recording",), r"(?:am i|are you|is it|are we) (?:still )?recording", "recording_status"),
+    (("screenshot","screen","capture"), r"(?:take|capture|grab|get)(?: a| the| me a)? (?:screenshot|screen ?shot|screen capture)(?: of (?:the|my) screen)?", "screenshot"),
+    (("time","date","day","today"), r"what(?:'s| is) the (?:current )?(?:time|date)(?: now| today)?|what time is it(?: now)?|what(?:'s| is) today(?:'s date)?|what day is (?:it|today)", "get_time"),
+    (("battery",), r"(?:what(?:'s| is) (?:my |the )?|check (?:my |the )?|show (?:my |the )?|how much )?battery(?: level| status| percentage| left| is left| do i have)?", "battery_info"),
+    (("system","cpu","memory","ram"), r"(?:show |get |check )?(?:my |the )?(?:system (?:info|information|stats|status)|cpu usage|memory usage|ram usage)", "system_info"),
+    (("running","processes"), r"(?:show |list )?(?:(?:the )?running (?:apps|processes|programs)|what(?:'s| is) running)", "running_apps"),
+    (("wifi","wi-fi","network"), r"(?:show |check )?(?:my |the )?(?:wifi|wi-fi|network)(?: info| status| signal| connection)?", "wifi_info"),
+    (("lock",), r"lock(?: the| my)? (?:screen|computer|pc|laptop)", "lock_screen"),
+    # Power actions never run from one chat line: they ask, and "confirm <action>" carries them out
+    (("shutdown","shut","turn","power"), r"(?:shut ?down|turn off|power off)(?: the| my)? (?:computer|pc|laptop|system)", lambda m: ("confirm_power",{"action":"shutdown"})),
+    (("restart","reboot"), r"(?:restart|reboot)(?: the| my)? (?:computer|pc|laptop|system)", lambda m: ("confirm_power",{"action":"restart"})),
+    (("sleep",), r"put(?: the| my)? (?:computer|pc|laptop) to sleep|sleep(?: the| my)? (?:computer|pc|laptop)", lambda m: ("confirm_power",{"action":"sleep"})),
+    (("confirm",), r"confirm (?P<action>shut ?down|restart|reboot|sleep)",
+        lambda m: ("confirm_power",{"action":{"reboot":"restart"}.get(m["action"].lower(), m["action"].lower().replace(" ","")),"confirmed":True})),
+    (("cancel",), r"cancel(?: the)? shut ?down", "cancel_shutdown"),
+    (("clear","reset","forget"), r"(?:clear|reset|forget)(?: the| our| my)? (?:chat|conversation|history|chat history|conversation history)", "clear_history"),
+    (("clipboard",), r"what(?:'s| is) (?:on|in) (?:my |the )?clipboard|read(?: my| the)? clipboard", "clipboard_get"),
+    (("clipboard",), r"copy (?P<text>.+?) to(?: my| the)? clipboard", lambda m: ("clipboard_set",{"text":m["text"]})),
+    (("scroll",), r"scroll (?P<direction>up|down)(?: (?P<amount>\d+))?",
+        lambda m: ("scroll",{"direction":m["direction"].lower(),"amount":int(m["amount"] or 3)})),
+    (("click",), r"(?:(?P<button>left|right|middle) )?click(?: the mouse)?",
+        lambda m: ("click_mouse",{"button":(m["button"] or "left").lower()})),
+    (("press","hit"), r"(?:press|hit)(?: the)? (?P<key>.+?)(?: key| button)?", _press),
+    (("volume","mute","track","pause"), r"(?:turn (?:the )?)?(?P<key>"+"|".join(MEDIA_KEYS)+r")", _press),
+    # Typing needs a strict form — `type: text` or quoted text — so "type a poem about spring" stays chat
+    (("type",), r"type ?: ?(?P<text>.+)|type [\"“'](?P<quoted>.+)[\"”']", lambda m: ("type_text",{"text":m["text"] or m["quoted"]})),
+    # Killing is destructive: it needs an explicit "process"/"app" or "force close", then "confirm kill"
+    (("confirm",), r"confirm (?:kill|force (?:close|quit))(?: (?P<name>[\w .+-]+))?", lambda m: ("confirm_kill",{"name":m["name"],"confirmed":True})),
+    (("kill","terminate","force"), r"(?:kill|terminate)(?: the)? (?P<name>[\w .+-]+?) (?:process|app)|(?:kill|terminate) process (?P<name2>[\w .+-]+)|force (?:close|quit) (?P<name3>[\w .+-]+)",
+        lambda m: ("confirm_kill",{"name":m["name"] or m["name2"] or m["name3"]})),
+    # YouTube needs it named ("… on youtube") or an explicit song/video, not any sentence starting with "play"
+    (("play","youtube"), r"play (?P<query>.+?) (?:on|in) youtube|(?:search|play)(?: on)? youtube(?: for)? (?P<query2>.+)|play (?:the |a )?(?:song|track|music|video|album) (?P<query3>.+)",
+        lambda m: ("play_youtube",{"query":m["query"] or m["query2"] or m["query3"]})),
+    (("search","google"), r"(?:search|google)(?: for)? (?P<query>.+?) (?:on|in|with) (?P<engine>google|bing|youtube|wikipedia|edge|chrome)", _search),
+    (("search","google"), r"(?:search(?: google)?|google)(?: for)? (?P<query>.+)", _search),
+    (("open","launch","start","run"), r"(?P<verb>open|launch|start|run)(?: up)? (?:the |my )?(?P<target>.+?)(?: app| application| website| site| folder)?", _open_target),
+]
+
+CONFIRM_SECS = 30
+PENDING_CONFIRM = {}    # session id → (action, params, expiry) awaiting "confirm <action>"
+
+def _take_armed(sid, action):
+    """Params armed for `action` in this session if still inside the window; always disarms."""
+    armed=PENDING_CONFIRM.pop(sid, None)
+    return armed[1] if armed and armed[0]==action and armed[2]>time.time() else None
+
+def confirm_power(p):
+    """First call arms `action` for this session; "confirm <action>" within the window runs it."""
+    action=p.get("action"); sid=p.get("session_id")
+    if action not in ("shutdown","restart","sleep"): return {"success":False,"message":f"Unknown power action: {action}"}
+    if p.get("confirmed"):
+        if _take_armed(sid, action) is not None: return COMMANDS[action]({})
+        return {"success":False,"message":"⚠️ Nothing to confirm."}
+    PENDING_CONFIRM[sid]=(action, {}, time.time()+CONFIRM_SECS)
+    what={"shutdown":"shut down the computer","restart":"restart the computer","sleep":"put the computer to sleep"}[action]
+    return {"success":True,"message":f"⚠️ This will {what}. Say “confirm {action}” within {CONFIRM_SECS} seconds to go ahead."}
+
+def confirm_kill(p):
+    """Same arm/confirm flow for kill_process: pkill -f matches whole command lines, including ours."""
+    sid=p.get("session_id")
+    if p.get("confirmed"):
+        armed=_take_armed(sid, "kill_process")
+        if armed and (not p.get("name") or clean_name(p["name"])==armed["name"]): return COMMANDS["kill_process"](armed)
+        return {"success":False,"message":"⚠️ Nothing to confirm."}
+    name=clean_name(p.get("name",""))
+    if not name: return {"success":False,"message":"❌ Which process?"}
+    PENDING_CONFIRM[sid]=("kill_process", {"name":name}, time.time()+CONFIRM_SECS)
+    return {"success":True,"message":f"⚠️ This will force-quit every process matching “{name}”. "
+                                      f"Say “confirm kill” within {CONFIRM_SECS} seconds to go ahead."}
+
+class IntentRouter:
+    """
+    Resolves command utterances to (action, params) locally, in microseconds.
+    Whole-utterance aliases (action names, media keys) are an O(1) dict hit; otherwise only
+    the rules whose trigger words appear in the utterance are tried, in rule order.
+    Every rule is an anchored full match, so questions that merely mention a keyword
+    ("what is the time complexity of quicksort") fall through to the LLM.
+    """
+    FILLER = re.compile(r"^(?:(?:hey |ok |okay )?elsa\b[,\s]*)?(?:(?:can|could|would|will) you |please )*|(?:\s+(?:please|for me|now))+$", re.I)
+
+    def __init__(self, rules, commands):
+        self.commands=commands
+        self.exact={a.replace('_',' '):(a,{}) for a in PARAMLESS_ACTIONS if a in commands}
+        self.exact.update({k:("press_key",{"key":k}) for k in MEDIA_KEYS})
+        self.rules=[]; self.index={}
+        for triggers,pattern,target in rules:
+            i=len(self.rules)
+            self.rules.append((re.compile(rf"(?:{pattern})", re.I), target))
+            for t in triggers: self.index.setdefault(t, []).append(i)
+
+    def normalize(self, text):
+        text=re.sub(r'[.,!?;:\s]+$', '', " ".join((text or "").split()))
+        return self.FILLER.sub("", text).strip()
+
+    def match(self, text):
+        utt=self.normalize(text); low=utt.lower()
+        if not low: return None
+        hit=self.exact.get(low)
+        if hit: return hit[0],dict(hit[1])
+        candidates=sorted({i for w in re.findall(r"[\w'-]+", low) for i in self.index.get(w, ())})
+        for i in candidates:
+            rx,target=self.rules[i]
+            m=rx.fullmatch(utt)
+            if not m: continue
+            res=(target,{}) if isinstance(target,str) else target(m)
+            if res and res[0] in self.commands: return res
+        return None
+
+INTENTS = IntentRouter(INTENT_RULES, COMMANDS)
+
+def intent_reply(action, result):
+    """Short spoken-style reply for a locally handled command."""
+    if result.get("message"): return result["message"]
+    if action=="get_time": return f"🕐 It's {result.get('time')} — {result.get('date')}"
+    if action=="system_info" and result.get("info"):
+        i=result["info"]; return f"💻 CPU {i.get('cpu_usage','?')}% · RAM {i.get('memory_percent','?')}%"
+    if action=="running_apps" and result.get("processes"):
+        return "📋 Top apps: "+", ".join(p["name"] for p in result["processes"][:5])
+    if action=="clipboard_get": return f"📋 Clipboard: {result.get('text','')}"
+    if action=="recording_status": return "🔴 Recording "+(result.get("duration") or "") if result.get("recording") else "⏹️ Not recording."
+    if action=="wifi_info": return result.get("raw","").strip() or "📶 No WiFi info."
+    return "✅ Done."
+
+def run_intent(msg, sid):
+    """Dispatch `msg` locally if it is a device command; returns the chat-shaped reply or None."""
+    if not INTENT_FASTPATH: return None
+    hit=INTENTS.match(msg)
+    if not hit: return None
+    action,params=hit; params.update(session_id=sid, routed=True)   # routed: chat-limited handlers (open_app)
+    if LOCAL_TTS_BARGE_IN and PYTTSX3_AVAILABLE: LOCAL_TTS.interrupt(TTS_NORMAL)   # a new command cuts off old chatter
+    result=COMMANDS[action](params)
+    return {"response":intent_reply(action, result),"model":"local","intent":action,"result":result}
+
+# ============================================================
+# LIVE STATS PUSH — one producer, SSE fan-out of changed values only
+# ============================================================
+METRICS_DELTA = float(os.getenv("ELSA_METRICS_DELTA", "1.0"))
+# Per-key minimum change before a value is re-sent; anything else uses METRICS_DELTA
+DELTA_THRESHOLDS = {"net_sent_rate": 2048, "net_recv_rate": 2048, "memory_used": 0.05, "disk_used": 0.05}
+DELTA_SKIP = ("ts", "net_bytes_sent", "net_bytes_recv")
+
+class StatsBroadcaster:
+    """
+    Every METRICS_INTERVAL a single thread builds a flat state from the sampler snapshot,
+    recording status and provider health, and diffs it against what was last published.
+    Only keys that changed beyond their threshold are pushed to subscriber queues; new
+    subscribers first receive the full published state. Slow subscribers are dropped.
+    """
+    def __init__(self, interval):
+        self.interval=interval; self.state={}; self._subs=set()
+        self._lock=threading.Lock(); self._thread=None
+
+    def subscribe(self):
+        q=queue.Queue(maxsize=64)
+        with self._lock:
+            if not self.state: self._publish()
+            q.put(("snapshot", dict(self.state))); self._subs.add(q)
+            if not self._thread:
+                self._thread=threading.Thread(target=self._loop, daemon=True, name="stats-push"); self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock: self._subs.discard(q)
+
+    def _collect(self):
+        out={}
+        snap=METRICS.latest(wait=0)
+        if snap: out.update({k:v for k,v in snap.items() if k not in DELTA_SKIP})
+        out["recording"]=RECORDING_STATE["active"]; out["recording_file"]=RECORDING_STATE.get("file")
+        for p,b in BREAKERS.items():
+            st=b.stats(); out[f"providers.{p}.state"]=st["state"]; out[f"providers.{p}.health"]=st["health"]
+        return out
+
+    @staticmethod
+    def _changed(key, old, new):
+        if isinstance(new, (int, float)) and not isinstance(new, bool) and isinstance(old, (int, float)):
+            return abs(new-old)>=DELTA_THRESHOLDS.get(key, METRICS_DELTA)
+        if isinstance(new, list) and isinstance(old, list) and len(new)==len(old):
+            return any(abs(a-b)>=METRICS_DELTA for a,b in zip(old, new))
+        return old!=new
+
+    def _publish(self):
+        """Diff fresh state against the published one and fan the delta out. Caller holds _lock."""
+        delta={k:v for k,v in self._collect().items() if k not in self.state or self._changed(k, self.state[k], v)}
+        if not delta: return
+        self.state.update(delta)
+        for q in list(self._subs):
+            try: q.put_nowait(("delta", delta))
+            except queue.Full:
+                # Too far behind to catch up with deltas: make room for the close marker and drop it
+                self._subs.discard(q)
+                try: q.get_nowait()
+                except queue.Empty: pass
+                q.put_nowait(None)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                try: self._publish()
+                except Exception as e: logger.warning(f"Stats push failed: {e}")
+
+    def stats(self):
+        with self._lock: return {"subscribers":len(self._subs)}
+
+BROADCAST = StatsBroadcaster(METRICS_INTERVAL)
 
 # ============================================================
 # ROUTES
@@ -838,18 +3179,82 @@ def health():
         "features":{"screenshot":PIL_AVAILABLE or PYAUTOGUI_AVAILABLE,
                     "screen_recording":OPENCV_AVAILABLE and (PIL_AVAILABLE or PYAUTOGUI_AVAILABLE),
                     "tts_local":PYTTSX3_AVAILABLE,"tts_eleven":ELEVEN_AVAILABLE,
-                    "system_info":PSUTIL_AVAILABLE,"desktop_control":PYAUTOGUI_AVAILABLE}})
+                    "system_info":PSUTIL_AVAILABLE,"desktop_control":PYAUTOGUI_AVAILABLE},
+        "hedging":HEDGE_ENABLED,"latency":LATENCY.stats(),
+        "circuits":{p:b.stats() for p,b in BREAKERS.items()}})
+
+def session_id(data):
+    """Client session id: X-Session-Id header, else `session_id` in the JSON body. ValueError unless a string."""
+    return checked_sid(request.headers.get('X-Session-Id') or data.get('session_id'))
+
+def checked_sid(sid):
+    if sid is None or isinstance(sid, str): return sid
+    raise ValueError("session_id must be a string")
+
+def chat_reply(d):
+    local=run_intent(d['message'], d.get('session_id'))
+    if local: return {"success":True,"cached":False,**local}
+    r=elsa.chat(d['message'], d.get('model','auto'), d.get('session_id'))
+    return {"success":True,"response":r['response'],"model":r['model'],"cached":r.get('cached',False)}
+
+def image_opts(d):
+    return {k:d.get(k) for k in ("preset","size","steps","seed","num_images")}
+
+def image_reply(d):
+    return elsa.generate_image(d['prompt'], **image_opts(d), cache=str(d.get('cache',True)).lower() not in ("0","false","no"))
+
+def tts_reply(d):
+    audio,msg=elsa.elevenlabs_tts(d['text'], d.get('voice_id') or TTS_VOICE)
+    return {"success":bool(audio),"audio_url":media_url(MEDIA.put(audio, "audio/mpeg")) if audio else None,"message":msg}
+
+# Job type → (required field, handler); the sync routes call the same handlers inline
+JOB_TYPES = {"chat": ("message", chat_reply), "image": ("prompt", image_reply), "tts": ("text", tts_reply)}
+
+def submit_job(jtype, d):
+    """202 + job id; the client polls /api/jobs/<id>?wait=N for the handler's reply."""
+    try: job=JOBS.submit(jtype, lambda: JOB_TYPES[jtype][1](d))
+    except JobsFull as e: return jsonify({"success":False,"message":str(e)}),429
+    return jsonify({"success":True,**job.to_dict(),"url":f"/api/jobs/{job.id}"}),202
+
+def text_param(d, key):
+    """Stripped string value of `key`, or "" when absent or not a string."""
+    v=d.get(key); return v.strip() if isinstance(v, str) else ""
+
+def wants_async(d):
+    return str(d.get('async', request.args.get('async',''))).lower() in ("1","true","yes")
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
         data=request.get_json() or {}
-        msg=data.get('message','').strip()
+        msg=text_param(data, 'message')
         if not msg: return jsonify({"error":"Empty message"}),400
-        r=elsa.chat(msg, data.get('model','auto'))
-        return jsonify({"success":True,"response":r['response'],"model":r['model']})
+        try: d=dict(data, message=msg, session_id=session_id(data))
+        except ValueError as e: return jsonify({"error":str(e)}),400
+        if wants_async(data): return submit_job("chat", d)
+        return jsonify(chat_reply(d))
     except Exception as e: return jsonify({"error":str(e)}),500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Server-Sent Events: one `data:` line per delta, then a final done/error event."""
+    data=request.get_json() or {}
+    msg=text_param(data, 'message')
+    if not msg: return jsonify({"error":"Empty message"}),400
+    try: sid=session_id(data)
+    except ValueError as e: return jsonify({"error":str(e)}),400
+    local=run_intent(msg, sid)
+    if local:
+        def _events():
+            yield f"data: {json.dumps({'type':'delta','text':local['response']})}\n\n"
+            yield f"data: {json.dumps({'type':'done',**local}, default=str)}\n\n"
+        return Response(_events(), mimetype='text/event-stream', headers={"Cache-Control":"no-cache"})
+    def _events():
+        for ev in elsa.chat_stream(msg, data.get('model','auto'), sid):
+            yield f"data: {json.dumps(ev)}\n\n"
+    return Response(stream_with_context(_events()), mimetype='text/event-stream',
+                    headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+
 @app.route('/api/process', methods=['POST'])
 def process(): return chat()
 
@@ -858,57 +3263,51 @@ def command():
     try:
         data=request.get_json() or {}
         a=data.get('action',''); p=data.get('params',{})
-        fn = {
-            'open_app':         lambda: elsa.open_app(p.get('name','')),
-            'open_website':     lambda: elsa.open_site(p.get('url','')),
-            'play_youtube':     lambda: elsa.play_yt(p.get('query','')),
-            'search_google':    lambda: elsa.search('google', p.get('query','')),
-            'search_wikipedia': lambda: elsa.search('wikipedia', p.get('query','')),
-            'search_edge':      lambda: elsa.search('edge', p.get('query','')),
-            'search_chrome':    lambda: elsa.search('chrome', p.get('query','')),
-            'open_chatgpt':     lambda: elsa.search('chatgpt', p.get('prompt','')),
-            'open_claude':      lambda: elsa.search('claude', ''),
-            'screenshot':       lambda: elsa.screenshot(),
-            # ✅ FIXED recording
-            'start_recording':  lambda: elsa.start_recording(),
-            'stop_recording':   lambda: elsa.stop_recording(),
-            'recording_status': lambda: elsa.recording_status(),
-            # Keyboard & Mouse
-            'type_text':        lambda: elsa.type_text(p.get('text','')),
-            'press_key':        lambda: elsa.press_key(p.get('key','')),
-            'click_mouse':      lambda: elsa.click_mouse(p.get('x'), p.get('y'), p.get('button','left')),
-            'move_mouse':       lambda: elsa.move_mouse(p.get('x',0), p.get('y',0)),
-            'scroll':           lambda: elsa.scroll(p.get('direction','down'), p.get('amount',3)),
-            # Clipboard
-            'clipboard_set':    lambda: elsa.clipboard_set(p.get('text','')),
-            'clipboard_get':    lambda: elsa.clipboard_get(),
-            # System
-            'system_info':      lambda: elsa.sys_info(),
-            'running_apps':     lambda: elsa.running_apps(),
-            'battery_info':     lambda: elsa.battery_info(),
-            'wifi_info':        lambda: elsa.wifi_info(),
-            'open_folder':      lambda: elsa.open_folder(p.get('path','desktop')),
-            'kill_process':     lambda: elsa.kill_process(p.get('name','')),
-            'shutdown':         lambda: elsa.power('shutdown', p.get('delay',5)),
-            'restart':          lambda: elsa.power('restart', p.get('delay',5)),
-            'sleep':            lambda: elsa.power('sleep'),
-            'cancel_shutdown':  lambda: elsa.power('cancel'),
-            'lock_screen':      lambda: elsa.lock(),
-            'clear_history':    lambda: elsa.clear(),
-            'get_time':         lambda: {"success":True,
-                                         "time":datetime.now().strftime("%I:%M %p"),
-                                         "date":datetime.now().strftime("%A, %B %d, %Y")},
-        }.get(a)
-        return jsonify(fn() if fn else {"success":False,"message":f"Unknown action: {a}"})
+        p=dict(p, session_id=checked_sid(p.get('session_id')) or session_id(data))
+        fn=COMMANDS.get(a)
+        if fn and LOCAL_TTS_BARGE_IN and PYTTSX3_AVAILABLE and a not in ('speak','stop_speaking'): LOCAL_TTS.interrupt(TTS_NORMAL)
+        return jsonify(fn(p) if fn else {"success":False,"message":f"Unknown action: {a}"})
+    except ValueError as e:         # option parsers (capture_opts & co.) reject bad params
+        return jsonify({"success":False,"message":f"❌ {e}"}),400
     except Exception as e:
         return jsonify({"error":str(e)}),500
 
 # Direct routes
 @app.route('/api/screenshot',            methods=['GET','POST']) 
-def ss():           return jsonify(elsa.screenshot())
+def ss():
+    d={**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    try: opts={**capture_opts(d), **shot_opts(d)}
+    except ValueError as e: return jsonify({"success":False,"message":f"❌ {e}"}),400
+    return jsonify(elsa.screenshot(**opts))
+
+@app.route('/api/media/<key>',           methods=['GET'])
+def media(key):
+    """Raw bytes from MEDIA with ETag/304, Range and immutable caching; ?download=<name> saves as a file."""
+    e=MEDIA.get(key)
+    if not e: return jsonify({"success":False,"message":"Media expired or unknown."}),404
+    name=request.args.get('download')
+    resp=send_file(e.get("path") or BytesIO(e["data"]), mimetype=e["mime"], etag=e["etag"], conditional=True,
+                   max_age=MEDIA_MAX_AGE, as_attachment=bool(name), download_name=name or key)
+    resp.cache_control.public=True; resp.cache_control.immutable=True
+    return resp
 
 @app.route('/api/system/info',           methods=['GET'])        
-def sinfo():        return jsonify(elsa.sys_info())
+def sinfo():        return jsonify(elsa.sys_info(request.args.get('window', type=float)))
+
+@app.route('/api/stream/metrics',        methods=['GET'])
+def stream_metrics():
+    """SSE: a `snapshot` event with the full live state, then `delta` events with changed keys only."""
+    q=BROADCAST.subscribe()
+    def _events():
+        try:
+            while True:
+                try: ev=q.get(timeout=15)
+                except queue.Empty: yield ": keep-alive\n\n"; continue
+                if ev is None: return
+                yield f"event: {ev[0]}\ndata: {json.dumps(ev[1])}\n\n"
+        finally: BROADCAST.unsubscribe(q)
+    return Response(_events(), mimetype='text/event-stream',
+                    headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
 
 @app.route('/api/system/apps',           methods=['GET'])        
 def sapps():        return jsonify(elsa.running_apps())
@@ -929,7 +3328,11 @@ def open_folder():  return jsonify(elsa.open_folder((request.get_json() or {}).g
 def kill_proc():    return jsonify(elsa.kill_process((request.get_json() or {}).get('name','')))
 
 @app.route('/api/recording/start',       methods=['POST'])       
-def rec_start():    return jsonify(elsa.start_recording())
+def rec_start():
+    d=request.get_json(silent=True) or {}
+    try: opts={**capture_opts(d), **recording_opts(d)}
+    except ValueError as e: return jsonify({"success":False,"message":f"❌ {e}"}),400
+    return jsonify(elsa.start_recording(**opts))
 
 @app.route('/api/recording/stop',        methods=['POST'])       
 def rec_stop():     return jsonify(elsa.stop_recording())
@@ -937,6 +3340,23 @@ def rec_stop():     return jsonify(elsa.stop_recording())
 @app.route('/api/recording/status',      methods=['GET'])        
 def rec_status():   return jsonify(elsa.recording_status())
 
+@app.route('/api/recording/replay',      methods=['GET','POST'])
+def rec_replay():
+    """GET: ring stats. POST {seconds?, codec?}: save the last N seconds to disk."""
+    if request.method=='GET':
+        rb=RECORDING_STATE.get("replay"); return jsonify({"success":True,"replay":rb.stats() if rb else None})
+    d=request.get_json(silent=True) or {}; return jsonify(elsa.save_replay(d.get('seconds'), d.get('codec')))
+
+@app.route('/api/recording/replay/start', methods=['POST'])
+def rec_replay_start():
+    d=request.get_json(silent=True) or {}
+    try: opts={**replay_opts(d), **capture_opts(d)}
+    except ValueError as e: return jsonify({"success":False,"message":f"❌ {e}"}),400
+    return jsonify(elsa.replay_start(**opts))
+
+@app.route('/api/recording/replay/stop',  methods=['POST'])
+def rec_replay_stop(): return jsonify(elsa.replay_stop())
+
 @app.route('/api/keyboard/type',         methods=['POST'])       
 def kbd_type():     return jsonify(elsa.type_text((request.get_json() or {}).get('text','')))
 
@@ -963,23 +3383,86 @@ def clip_get():     return jsonify(elsa.clipboard_get())
 
 @app.route('/api/tts/elevenlabs',        methods=['POST'])
 def tts():
-    data=request.get_json() or {}; text=data.get('text','')
+    data=request.get_json() or {}
+    if not text_param(data, 'text'): return jsonify({"error":"No text"}),400
+    if wants_async(data): return submit_job("tts", data)
+    return jsonify(tts_reply(data))
+
+@app.route('/api/tts/stream',            methods=['GET','POST'])
+def tts_stream_route():
+    """Chunked audio/mpeg as it is synthesised. GET (?text=&voice_id=) so an <audio> element can play it directly."""
+    data={**request.args.to_dict(), **(request.get_json(silent=True) or {})}; text=data.get('text','')
     if not text: return jsonify({"error":"No text"}),400
-    audio,msg=elsa.elevenlabs_tts(text, data.get('voice_id','21m00Tcm4TlvDq8ikWAM'))
-    return jsonify({"success":bool(audio),"audio":audio,"message":msg})
+    if not ELEVEN_AVAILABLE: return jsonify({"success":False,"message":"ElevenLabs not configured"}),503
+    gen=tts_stream(text, data.get('voice_id') or TTS_VOICE)
+    try: first=next(gen)            # surface auth/quota errors as a status code, not a broken stream
+    except StopIteration: return jsonify({"success":False,"message":"No audio"}),502
+    except Exception as e: return jsonify({"success":False,"message":str(e)}),502
+    def _relay():
+        yield first
+        yield from gen
+    return Response(stream_with_context(_relay()), mimetype='audio/mpeg',
+                    headers={"Cache-Control":"no-store","X-Accel-Buffering":"no"})
+
+@app.route('/api/tts/local',             methods=['POST'])
+def tts_local():
+    """Speak on the server's local engine: {text, priority 0-9, key, interrupt, render}; render returns audio_url."""
+    d=request.get_json(silent=True) or {}
+    try: prio=tts_priority(d.get('priority'))
+    except ValueError as e: return jsonify({"success":False,"message":str(e)}),400
+    return jsonify(elsa.speak(d.get('text',''), prio, d.get('key'), bool(d.get('interrupt')), bool(d.get('render'))))
 
 @app.route('/api/tts/voices',            methods=['GET'])        
-def voices():       return jsonify({"success":True,"voices":elsa.get_voices()})
+def voices():
+    """Cached catalogue; ETag/If-None-Match → 304, ?refresh=1 forces a revalidation."""
+    v=VOICES.get(request.args.get('refresh','').lower() in ("1","true","yes"))
+    if v is None: return jsonify({"success":False,"voices":[],"message":VOICES.error or "Voice list unavailable"}),503
+    if request.if_none_match.contains(VOICES.etag.strip('"')): return Response(status=304, headers={"ETag":VOICES.etag})
+    r=jsonify({"success":True,"voices":v,"stale":VOICES.stale(),"fetched":VOICES.fetched,"error":VOICES.error})
+    r.headers["ETag"]=VOICES.etag; r.headers["Cache-Control"]="no-cache"
+    return r
 
 @app.route('/api/image/generate',        methods=['POST'])
 def genimg():
-    prompt=(request.get_json() or {}).get('prompt','')
-    if not prompt: return jsonify({"error":"No prompt"}),400
-    url,msg=elsa.generate_image(prompt)
-    return jsonify({"success":bool(url),"url":url,"message":msg})
+    data=request.get_json() or {}
+    if not text_param(data, 'prompt'): return jsonify({"error":"No prompt"}),400
+    try: image_args(data['prompt'], **image_opts(data))
+    except (TypeError, ValueError) as e: return jsonify({"success":False,"message":str(e)}),400
+    if wants_async(data): return submit_job("image", data)
+    return jsonify(image_reply(data))
+
+@app.route('/api/jobs',                  methods=['GET','POST'])
+def jobs():
+    """POST {type: chat|image|tts, ...same body as the sync route} → 202 job; GET → queue stats."""
+    if request.method=='GET': return jsonify({"success":True,**JOBS.stats()})
+    data=request.get_json(silent=True) or {}; jtype=data.get('type')
+    if not isinstance(jtype, str) or jtype not in JOB_TYPES: return jsonify({"success":False,"message":f"Unknown job type: {jtype}"}),400
+    field=JOB_TYPES[jtype][0]; text=text_param(data, field)
+    if not text: return jsonify({"success":False,"message":f"{field} must be a non-empty string"}),400
+    data=dict(data, **{field:text})
+    if jtype=="chat":
+        try: data["session_id"]=session_id(data)
+        except ValueError as e: return jsonify({"success":False,"message":str(e)}),400
+    if jtype=="image":
+        try: image_args(data['prompt'], **image_opts(data))
+        except (TypeError, ValueError) as e: return jsonify({"success":False,"message":str(e)}),400
+    return submit_job(jtype, data)
+
+@app.route('/api/jobs/<job_id>',         methods=['GET','DELETE'])
+def job(job_id):
+    """GET ?wait=N long-polls up to N seconds for completion; DELETE cancels."""
+    if request.method=='DELETE': j=JOBS.cancel(job_id)
+    else:
+        try: wait=float(request.args.get('wait', 0))
+        except ValueError: return jsonify({"success":False,"message":"wait must be a number"}),400
+        j=JOBS.get(job_id, wait)
+    if not j: return jsonify({"success":False,"message":"Unknown or expired job"}),404
+    return jsonify({"success":True,**j.to_dict()})
 
 @app.route('/api/clear',                 methods=['POST'])       
-def clear():        return jsonify(elsa.clear())
+def clear():
+    try: return jsonify(elsa.clear(session_id(request.get_json(silent=True) or {})))
+    except ValueError as e: return jsonify({"success":False,"message":str(e)}),400
 
 @app.route('/api/status',               methods=['GET'])
 def status():
@@ -987,7 +3470,17 @@ def status():
         "keys":{"openai":mask(OPENAI_API_KEY),"anthropic":mask(ANTHROPIC_API_KEY),
                 "google":mask(GOOGLE_API_KEY),"elevenlabs":mask(ELEVEN_API_KEY),"fal":mask(FAL_KEY)},
         "providers":{"openai":OPENAI_CLIENT is not None,"anthropic":ANTHROPIC_CLIENT is not None,
-                     "gemini":GEMINI_AVAILABLE,"elevenlabs":ELEVEN_AVAILABLE,"fal":FAL_AVAILABLE}})
+                     "gemini":GEMINI_AVAILABLE,"elevenlabs":ELEVEN_AVAILABLE,"fal":FAL_AVAILABLE},
+        "sessions":elsa.sessions.stats(),
+        "response_cache":elsa.cache.stats() if elsa.cache else {"enabled":False},
+        "app_index":APP_INDEX.stats(),
+        "media":MEDIA.stats(),
+        "tts_cache":TTS_CACHE.stats() if TTS_CACHE else {"enabled":False},
+        "image_cache":IMG_CACHE.stats() if IMG_CACHE else {"enabled":False},
+        "local_tts":LOCAL_TTS.stats(),
+        "voices":VOICES.stats(),
+        "jobs":JOBS.stats(),
+        "stats_push":BROADCAST.stats()})
 
 if __name__=='__main__':
     print("\n"+"="*70)
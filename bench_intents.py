@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+ELSA 4.0 - INTENT ROUTER BENCHMARK
+Measures local routing latency and accuracy of INTENTS.match() over a corpus of
+sample phrases. `None` means the phrase must fall through to the LLM.
+
+    python bench_intents.py [iterations]
+"""
+
+import sys, time, statistics
+from backend_ultra_advanced_FIXED import INTENTS
+
+CORPUS = [
+    # ── device commands ──
+    ("Open firefox.", "open_app"), ("open vs code", "open_app"), ("launch chrome", "open_app"),
+    ("Elsa, open YouTube", "open_website"), ("open github.com", "open_website"),
+    ("open my downloads folder", "open_folder"), ("open desktop", "open_folder"),
+    ("take a screenshot", "screenshot"), ("screenshot", "screenshot"), ("capture the screen capture", "screenshot"),
+    ("start recording", "start_recording"), ("start screen recording", "start_recording"),
+    ("stop recording.", "stop_recording"), ("am I still recording?", "recording_status"),
+    ("start instant replay", "replay_start"), ("save the last 30 seconds", "save_replay"), ("clip that", "save_replay"),
+    ("turn off instant replay", "replay_stop"), ("stop talking", "stop_speaking"), ("be quiet", "stop_speaking"),
+    ("what time is it", "get_time"), ("what's the date today", "get_time"), ("what day is it", "get_time"),
+    ("check my battery", "battery_info"), ("battery level", "battery_info"), ("how much battery is left", "battery_info"),
+    ("system info", "system_info"), ("show cpu usage", "system_info"), ("what's running", "running_apps"),
+    ("wifi status", "wifi_info"), ("lock the screen", "lock_screen"), ("lock my computer please", "lock_screen"),
+    ("shut down the computer", "confirm_power"), ("restart my pc", "confirm_power"), ("confirm shutdown", "confirm_power"), ("cancel shutdown", "cancel_shutdown"),
+    ("volume up", "press_key"), ("mute", "press_key"), ("press enter", "press_key"), ("press ctrl+c", "press_key"),
+    ("next track", "press_key"), ("scroll down", "scroll"), ("scroll up 5", "scroll"), ("right click", "click_mouse"),
+    ('type "hello world"', "type_text"), ("type: meeting at 5", "type_text"), ("copy meeting at 5 to clipboard", "clipboard_set"),
+    ("what's on my clipboard", "clipboard_get"), ("kill the chrome process", "confirm_kill"),
+    ("force close zoom", "confirm_kill"), ("confirm kill", "confirm_kill"),
+    ("play lofi hip hop on youtube", "play_youtube"), ("play the song despacito", "play_youtube"),
+    ("search youtube for cat videos", "play_youtube"),
+    ("search python tutorials", "search_google"), ("search black holes on wikipedia", "search_wikipedia"),
+    ("google weather in delhi", "search_google"), ("clear chat history", "clear_history"),
+    ("could you please take a screenshot", "screenshot"),
+    # ── questions and chit-chat for the LLM ──
+    ("what is quantum computing", None), ("tell me a joke", None),
+    ("what is the time complexity of quicksort", None), ("how do I open a file in python", None),
+    ("explain how batteries work", None), ("write a poem about the screen of my laptop", None),
+    ("who won the world cup in 2011", None), ("can you help me plan a trip to goa", None),
+    ("why do my recordings stutter on linux", None), ("summarise the history of rome", None),
+    ("kill time before the meeting", None), ("type of dogs in india", None), ("how much is my battery worth", None),
+    ("save the world", None), ("stop talking about the weather and tell me a story", None),
+    ("start a story about dragons", None), ("run me through the plan", None), ("start over", None), ("open ai", None),
+    ("play a game with me", None), ("youtube is great", None), ("play despacito", None),
+    ("type a poem about spring", None), ("how do I shut down a python thread", None),
+    ("open shutdown", None), ("run reboot", None), ("start poweroff", None), ("open halt", None),
+]
+
+def main(iterations=2000):
+    correct, wrong = 0, []
+    for phrase, expected in CORPUS:
+        hit = INTENTS.match(phrase)
+        got = hit[0] if hit else None
+        if got == expected: correct += 1
+        else: wrong.append((phrase, expected, got))
+
+    samples = []
+    for _ in range(iterations):
+        for phrase, _ in CORPUS:
+            t0 = time.perf_counter(); INTENTS.match(phrase); samples.append(time.perf_counter() - t0)
+    samples.sort()
+    us = lambda x: f"{x * 1e6:7.2f} µs"
+
+    print(f"Phrases   : {len(CORPUS)}  ({sum(1 for _, e in CORPUS if e)} commands, {sum(1 for _, e in CORPUS if not e)} LLM)")
+    print(f"Accuracy  : {correct}/{len(CORPUS)} = {100 * correct / len(CORPUS):.1f}%")
+    print(f"Latency   : mean {us(statistics.fmean(samples))}  p50 {us(samples[len(samples) // 2])}  "
+          f"p99 {us(samples[int(len(samples) * 0.99)])}  max {us(samples[-1])}")
+    for phrase, expected, got in wrong:
+        print(f"  ✗ {phrase!r}: expected {expected}, got {got}")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
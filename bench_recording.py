@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+ELSA 4.0 - SCREEN RECORDER BENCHMARK
+Runs the ScreenRecorder capture → queue → encoder pipeline for a few seconds and
+reports achieved capture/encode throughput against the target fps. Uses a synthetic
+frame source by default; --screen grabs the real display with the configured backend.
+
+--idle records a static screen with and without dedup/adaptive fps and reports the
+CPU each run used. Repeated frames still go through the codec, so their encode time
+is listed on its own.
+
+--paths compares per-frame conversion cost of the old copy-per-step path against the
+recorder's paths (Pillow packing BGR in its one copy, mss BGRA zero-copy), each in a
+fresh process so peak RSS and page faults are comparable.
+
+    python bench_recording.py [seconds] [fps] [WxH] [--screen]
+    python bench_recording.py --idle [seconds] [fps] [WxH] [--screen]
+    python bench_recording.py --paths [frames] [WxH]
+"""
+
+import sys, os, time, json, tempfile, resource, subprocess
+import numpy as np
+import cv2
+from backend_ultra_advanced_FIXED import ScreenRecorder, parse_size, screen_grabber, pillow_bgr, REC_CODEC, CODEC_EXT
+
+def synthetic(w, h):
+    base = np.random.randint(0, 255, (h, w, 3), dtype=np.uint8)
+    n = [0]
+    def grab():
+        n[0] += 1
+        return np.roll(base, n[0] * 8, axis=1)
+    return grab
+
+def compare_idle(seconds=5.0, fps=10.0, size=(1920, 1080), screen=False):
+    """Static screen (the common desktop case). Synthetic grabs cost only a copy, so --screen shows the real saving."""
+    if screen:
+        grab, fmt, backend = screen_grabber()
+    else:
+        w, h = size
+        frame = np.full((h, w, 3), 235, np.uint8)        # a window of text on a flat background
+        for y in range(60, h - 40, 28):
+            cv2.putText(frame, "def grab(self): return np.asarray(ImageGrab.grab())  # " + str(y), (40, y),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (30, 30, 30), 1, cv2.LINE_AA)
+        grab, fmt, backend = (lambda: frame.copy()), "RGB", "synthetic"
+    print(f"Static screen ({backend}), {fps:g} fps target, {seconds:g}s each")
+    for dedup in (False, True):
+        path = os.path.join(tempfile.gettempdir(), f"elsa_bench_idle{CODEC_EXT.get(REC_CODEC, '.avi')}")
+        cpu0 = time.process_time()
+        rec = ScreenRecorder(path, grab, fps=fps, dedup=dedup, pixel_format=fmt).start()
+        time.sleep(seconds); rec.stop()
+        cpu = time.process_time() - cpu0; s = rec.stats()
+        print(f"  dedup {'on ' if dedup else 'off'}  CPU {cpu:6.2f}s ({100 * cpu / seconds:5.1f}% of a core)  "
+              f"grab {rec.capture_time:5.2f}s  encode {rec.encode_time:5.2f}s + repeats {rec.repeat_time:5.2f}s  grabs {s['captured']:4d}  "
+              f"deduplicated {s['deduplicated']:4d}  written {s['written']:4d} (repeats {s['duplicated']})")
+
+def main(seconds=5.0, fps=10.0, size=(1920, 1080), screen=False):
+    grab, fmt, backend = screen_grabber() if screen else (synthetic(*size), "RGB", "synthetic")
+    path = os.path.join(tempfile.gettempdir(), f"elsa_bench{CODEC_EXT.get(REC_CODEC, '.avi')}")
+    rec = ScreenRecorder(path, grab, fps=fps, size=None if screen else size, pixel_format=fmt).start()
+    time.sleep(seconds)
+    rec.stop()
+    s = rec.stats()
+    expected = int(seconds * fps)
+
+    print(f"Source    : {backend}  {s['size'][0]}x{s['size'][1]}  codec {s['codec']}")
+    print(f"Target    : {fps:g} fps for {seconds:g}s  ({expected} frames)")
+    print(f"Capture   : {s['capture_fps']:6.2f} fps  ({s['capture_ms']:.2f} ms/grab, {s['captured']} frames)")
+    print(f"Encode    : {s['encode_ms']:.2f} ms/frame  → max {1000 / max(s['encode_ms'], 1e-3):.1f} fps")
+    print(f"Output    : {s['written']} frames ({s['output_fps']:.2f} fps)  duplicated {s['duplicated']}  "
+          f"dropped late {s['dropped_late']}  dropped queue {s['dropped_queue']}")
+    print(f"File      : {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    if s['error']: print(f"  ✗ {s['error']}")
+
+# ── conversion paths ─────────────────────────────────────────────────────────
+def run_path(name, frames, w, h, scale):
+    """One path in this process → per-frame CPU ms, peak RSS growth and minor page faults."""
+    from PIL import Image
+    rgb = Image.frombytes("RGB", (w, h), np.random.randint(0, 255, w * h * 3, dtype=np.uint8).tobytes())
+    bgra = bytearray(np.random.randint(0, 255, w * h * 4, dtype=np.uint8).tobytes())
+    out = (int(w * scale), int(h * scale))
+    if name == "legacy":           # np.array copy → new BGR array (→ new resized array)
+        step = lambda: cv2.cvtColor(np.array(rgb), cv2.COLOR_RGB2BGR)
+        if out != (w, h):
+            convert = step; step = lambda: cv2.resize(convert(), out, interpolation=cv2.INTER_AREA)
+    elif name == "pooled-pillow":  # Pillow packs BGR itself (the one copy) → resize into a reused buffer
+        rec = ScreenRecorder(os.devnull, None, size=out, pixel_format="BGR")
+        step = lambda: rec._convert(pillow_bgr(rgb))
+    else:                          # mss layout: zero-copy BGRA view over the grab buffer
+        rec = ScreenRecorder(os.devnull, None, size=out, pixel_format="BGR")
+        step = lambda: rec._convert(np.frombuffer(bgra, np.uint8).reshape(h, w, 4))
+    cv2.setNumThreads(1)   # process_time sums all threads; keep OpenCV's pool out of the comparison
+    ru0, cpu0 = resource.getrusage(resource.RUSAGE_SELF), time.process_time()
+    for _ in range(frames): step()
+    ru1 = resource.getrusage(resource.RUSAGE_SELF)
+    return {"cpu_ms": 1000 * (time.process_time() - cpu0) / frames, "rss_mb": (ru1.ru_maxrss - ru0.ru_maxrss) / 1024,
+            "faults": (ru1.ru_minflt - ru0.ru_minflt) / frames}
+
+def compare_paths(frames=200, size=(1920, 1080)):
+    for scale in (1.0, 2 / 3):
+        print(f"Converting {frames} frames {size[0]}x{size[1]} → {int(size[0] * scale)}x{int(size[1] * scale)} BGR")
+        for name in ("legacy", "pooled-pillow", "pooled-bgra"):
+            out = subprocess.run([sys.executable, __file__, "--path", name, str(frames), f"{size[0]}x{size[1]}", str(scale)],
+                                 capture_output=True, text=True)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"  {name:14s} {r['cpu_ms']:7.2f} ms CPU/frame   peak RSS +{r['rss_mb']:6.1f} MB   {r['faults']:8.1f} page faults/frame")
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if '--path' in sys.argv:
+        print(json.dumps(run_path(sys.argv[sys.argv.index('--path') + 1], int(args[1]), *parse_size(args[2]), float(args[3])))); sys.exit()
+    if '--idle' in sys.argv:
+        compare_idle(float(args[0]) if args else 5.0, float(args[1]) if len(args) > 1 else 10.0,
+                     parse_size(args[2]) if len(args) > 2 else (1920, 1080), '--screen' in sys.argv); sys.exit()
+    if '--paths' in sys.argv:
+        compare_paths(int(args[0]) if args else 200, parse_size(args[1]) if len(args) > 1 else (1920, 1080)); sys.exit()
+    main(float(args[0]) if args else 5.0, float(args[1]) if len(args) > 1 else 10.0,
+         parse_size(args[2]) if len(args) > 2 else (1920, 1080), '--screen' in sys.argv)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+ELSA 4.0 - OFFLINE ELEVENLABS STUB
+Speaks just enough of the ElevenLabs REST API for the TTS paths to run without a key or
+network. /v1/text-to-speech/<voice>[/stream] return silent MP3 whose length follows the
+text (about 14 characters a second); the stream variant sends it in chunks at a fixed
+synthesis speed after a first-byte delay, the plain one all at once when done.
+/v1/voices lists a couple of voices (with an ETag, 304 on a match). --errors answers that fraction of API requests with
+503/429 to exercise client retries; /stub/stats counts requests and injected errors.
+
+    python stub_tts_server.py [port] [--latency 0.3] [--speed 4] [--errors 0.2]
+    ELEVEN_BASE_URL=http://localhost:5055 ELEVEN_API_KEY=stub-key-0000 python backend_ultra_advanced_FIXED.py
+"""
+
+import sys, time, random, argparse, threading
+from flask import Flask, request, jsonify, Response
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono, no CRC: 417-byte frames of 1152 samples.
+# All-zero side info and main data decode as silence.
+FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+FRAME_SECS = 1152 / 44100
+CHARS_PER_SEC = 14
+
+app = Flask(__name__)
+OPTS = argparse.Namespace(latency=0.3, speed=4.0, errors=0.0)
+STATS = {"requests": 0, "errors": 0}; LOCK = threading.Lock()
+
+@app.before_request
+def count():
+    with LOCK:
+        STATS["requests"] += 1
+    if request.path.startswith("/v1/") and random.random() < OPTS.errors:
+        with LOCK: STATS["errors"] += 1
+        return jsonify({"detail": {"status": "system_busy", "message": "injected"}}), random.choice((503, 429))
+
+@app.route('/stub/stats', methods=['GET'])
+def stats():
+    with LOCK: return jsonify(STATS)
+
+def frames_for(text):
+    return max(1, int(len(text) / CHARS_PER_SEC / FRAME_SECS))
+
+def check():
+    if not request.headers.get("xi-api-key"):
+        return jsonify({"detail": {"status": "needs_authorization", "message": "Missing xi-api-key"}}), 401
+    if not (request.get_json(silent=True) or {}).get("text"):
+        return jsonify({"detail": {"status": "invalid_text", "message": "text is required"}}), 422
+
+@app.route('/v1/text-to-speech/<voice_id>', methods=['POST'])
+def tts(voice_id):
+    err = check()
+    if err: return err
+    n = frames_for(request.get_json()["text"])
+    time.sleep(OPTS.latency + n * FRAME_SECS / OPTS.speed)
+    return Response(FRAME * n, mimetype='audio/mpeg')
+
+@app.route('/v1/text-to-speech/<voice_id>/stream', methods=['POST'])
+def tts_stream(voice_id):
+    err = check()
+    if err: return err
+    n = frames_for(request.get_json()["text"])
+    def _gen():
+        time.sleep(OPTS.latency)
+        for i in range(0, n, 10):
+            k = min(10, n - i)
+            time.sleep(k * FRAME_SECS / OPTS.speed)
+            yield FRAME * k
+    return Response(_gen(), mimetype='audio/mpeg')
+
+VOICES = {"voices": [
+    {"voice_id": "21m00Tcm4TlvDq8ikWAM", "name": "Rachel (stub)", "category": "premade"},
+    {"voice_id": "AZnzlk1XvdvUeBnXmlld", "name": "Domi (stub)", "category": "premade"},
+]}
+
+@app.route('/v1/voices', methods=['GET'])
+def voices():
+    time.sleep(OPTS.latency)
+    r = jsonify(VOICES); r.add_etag(); return r.make_conditional(request)
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("port", nargs="?", type=int, default=5055)
+    ap.add_argument("--latency", type=float, default=0.3, help="seconds before the first byte of each request")
+    ap.add_argument("--speed", type=float, default=4.0, help="synthesis speed as a multiple of real time")
+    ap.add_argument("--errors", type=float, default=0.0, help="fraction of API requests answered with 503/429")
+    OPTS = ap.parse_args()
+    app.run(host="127.0.0.1", port=OPTS.port, threaded=True)